@@ -0,0 +1,257 @@
+"""
+DAGValidator のベンチマークスイート
+
+シード付きの生成器で合成グラフ（直列・ファンアウト/ファンイン・ダイヤモンド格子・ランダムDAG・循環あり）を作り、
+build_graph / detect_cycles / topological_sort / get_operation_execution_order / validate の
+実行時間とピークメモリを計測する。結果はJSONで保存でき、--compare で別のコミットの結果と比較できる。
+
+Usage:
+    python benchmarks/bench_dag_validator.py [--families chain random] [--sizes 10 1000 100000 1000000]
+                                             [--json results.json] [--compare baseline.json]
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from agents.dag_validator import DAGValidator
+
+Plan = Tuple[dict, dict]
+
+METHODS = ["build_graph", "detect_cycles", "topological_sort", "get_operation_execution_order", "validate"]
+INITIAL = [f"objects/initial/reagent_{i}.reagent" for i in range(16)]
+
+
+def _obj(i: int, j: int = 0) -> str:
+    return f"objects/intermediate/op{i}_out{j}.sample"
+
+
+def _plan(operations: List[dict]) -> Plan:
+    """初期試薬を共通にし、どこからも使われない出力を最終成果物とした計画にする"""
+    consumed = {obj for op in operations for obj in op["input"]}
+    final = list(dict.fromkeys(obj for op in operations for obj in op["output"] if obj not in consumed))
+    phase1 = {"identified_objects": {"initial": INITIAL, "intermediate": [], "final": final}}
+    return phase1, {"operations": operations}
+
+
+def chain_plan(n: int, seed: int = 0) -> Plan:
+    """直列: 各オペレーションが直前の出力だけを消費する"""
+    operations = [
+        {"operation_id": f"op_{i}", "input": [_obj(i - 1) if i else INITIAL[0]], "output": [_obj(i)]} for i in range(n)
+    ]
+    return _plan(operations)
+
+
+def fanout_plan(n: int, seed: int = 0) -> Plan:
+    """ファンアウト/ファンイン: 1つのストックを n-2 個のオペレーションが分け合い、最後に1つへ集約する"""
+    if n < 3:
+        return chain_plan(n, seed)
+    operations = [{"operation_id": "op_stock", "input": [INITIAL[0]], "output": [_obj(0)]}]
+    operations += [
+        {"operation_id": f"op_{i}", "input": [_obj(0), INITIAL[i % len(INITIAL)]], "output": [_obj(i)]}
+        for i in range(1, n - 1)
+    ]
+    operations.append({"operation_id": "op_pool", "input": [_obj(i) for i in range(1, n - 1)], "output": [_obj(n - 1)]})
+    return _plan(operations)
+
+
+def diamond_plan(n: int, seed: int = 0) -> Plan:
+    """ダイヤモンド格子: 幅 √n の層を重ね、各オペレーションは前の層の隣り合う2つの出力を消費する"""
+    width = max(1, int(n**0.5))
+    operations = []
+    for i in range(n):
+        layer, column = divmod(i, width)
+        if layer == 0:
+            inputs = [INITIAL[column % len(INITIAL)]]
+        else:
+            prev = (layer - 1) * width
+            inputs = list(dict.fromkeys([_obj(prev + column), _obj(prev + (column + 1) % width)]))
+        operations.append({"operation_id": f"op_{i}", "input": inputs, "output": [_obj(i)]})
+    return _plan(operations)
+
+
+def random_plan(n: int, seed: int = 0) -> Plan:
+    """ランダムDAG: 各オペレーションは初期試薬1つと、それ以前の任意の出力を0〜2個消費し、1〜2個を出力する"""
+    rng = random.Random(seed)
+    operations = []
+    outputs: List[str] = []
+    for i in range(n):
+        inputs = [rng.choice(INITIAL)]
+        if outputs:
+            inputs += list(dict.fromkeys(rng.choice(outputs) for _ in range(rng.randint(0, 2))))
+        produced = [_obj(i, j) for j in range(rng.randint(1, 2))]
+        outputs += produced
+        operations.append({"operation_id": f"op_{i}", "input": inputs, "output": produced})
+    return _plan(operations)
+
+
+def cyclic_plan(n: int, seed: int = 0) -> Plan:
+    """
+    循環あり: ランダムDAGの依存経路を数段たどり、その先のオペレーションの出力を起点の入力へ戻す辺を
+    約1%のオペレーションに加える（経路上にあるので必ず循環になる）
+    """
+    rng = random.Random(seed)
+    phase1, phase2 = random_plan(n, seed)
+    operations = phase2["operations"]
+    consumers: Dict[str, List[int]] = {}
+    for k, op in enumerate(operations):
+        for obj in op["input"]:
+            consumers.setdefault(obj, []).append(k)
+
+    added, attempts = 0, 0
+    while added < max(1, n // 100) and attempts < 10 * n:
+        attempts += 1
+        start = node = rng.randrange(n)
+        for _ in range(rng.randint(1, 8)):
+            nexts = [k for obj in operations[node]["output"] for k in consumers.get(obj, [])]
+            if not nexts:
+                break
+            node = rng.choice(nexts)
+        if node != start:
+            operations[start]["input"].append(operations[node]["output"][0])
+            added += 1
+    return phase1, phase2
+
+
+FAMILIES: Dict[str, Callable[[int, int], Plan]] = {
+    "chain": chain_plan,
+    "fanout": fanout_plan,
+    "diamond": diamond_plan,
+    "random": random_plan,
+    "cyclic": cyclic_plan,
+}
+
+
+def _run_methods(phase1: dict, phase2: dict, measure: Callable[[str, Callable[[], object]], None]) -> None:
+    """グラフ系メソッドは1つの検証器で順に、validate() は新しい検証器で計測する"""
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, phase2)
+    measure("build_graph", validator.build_graph)
+    measure("detect_cycles", validator.detect_cycles)
+    measure("topological_sort", validator.topological_sort)
+    measure("get_operation_execution_order", validator.get_operation_execution_order)
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, phase2)
+    measure("validate", validator.validate)
+
+
+def bench_plan(family: str, size: int, seed: int, memory: bool) -> List[dict]:
+    phase1, phase2 = FAMILIES[family](size, seed)
+    seconds: Dict[str, float] = {}
+    peaks: Dict[str, int] = {}
+
+    def timed(name, fn):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        seconds[name] = time.perf_counter() - started
+
+    def traced(name, fn):
+        gc.collect()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peaks[name] = tracemalloc.get_traced_memory()[1] - before
+
+    _run_methods(phase1, phase2, timed)
+    # メモリは別の実行で計測する（tracemalloc は処理を遅くするため）
+    if memory:
+        tracemalloc.start()
+        try:
+            _run_methods(phase1, phase2, traced)
+        finally:
+            tracemalloc.stop()
+
+    return [
+        {
+            "family": family,
+            "size": size,
+            "method": name,
+            "seconds": round(seconds[name], 6),
+            "peak_bytes": peaks.get(name),
+        }
+        for name in METHODS
+    ]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: List[dict], baseline_path: Path, threshold: float) -> int:
+    """基準の結果と比べ、threshold 倍以上遅くなった計測の数を返す"""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    previous = {(r["family"], r["size"], r["method"]): r for r in baseline["results"]}
+    print(f"\n# compare with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    regressions = 0
+    for r in results:
+        old = previous.get((r["family"], r["size"], r["method"]))
+        if not old or not old["seconds"]:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        slower = ratio >= threshold and r["seconds"] >= 0.01  # 10ms 未満はノイズとして扱う
+        regressions += slower
+        mark = "  REGRESSION" if slower else ""
+        print(
+            f"{r['family']:<8} {r['size']:>8} {r['method']:<30} "
+            f"{old['seconds']:>9.4f} -> {r['seconds']:>9.4f} s  x{ratio:.2f}{mark}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DAGValidator benchmark suite")
+    parser.add_argument("--families", nargs="+", choices=list(FAMILIES), default=list(FAMILIES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000], help="Operations per plan")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory pass")
+    parser.add_argument("--json", type=Path, help="Write machine-readable results to this file")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON from a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'family':<8} {'size':>8} {'method':<30} {'seconds':>9} {'peak MiB':>9}")
+    for family in args.families:
+        for size in args.sizes:
+            for r in bench_plan(family, size, args.seed, memory=not args.no_memory):
+                results.append(r)
+                peak = "-" if r["peak_bytes"] is None else f"{r['peak_bytes'] / 2**20:.2f}"
+                print(f"{family:<8} {size:>8} {r['method']:<30} {r['seconds']:>9.4f} {peak:>9}")
+
+    if args.json:
+        meta = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": args.seed,
+        }
+        args.json.write_text(json.dumps({"meta": meta, "results": results}, indent=2), encoding="utf-8")
+        print(f"\nSaved {len(results)} results to {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{regressions} regression(s) at x{args.threshold} or worse")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+ローカルのモックOpenAIサーバーを使ったエンドツーエンドのスループットベンチマーク
+
+APIキーもネットワークも使わずに main.py のランナー（run_tasks / run_pipeline）を実行し、
+同時実行数ごとの tasks/minute を計測する。参考文献の取得はオフラインのキャッシュのみを使う。
+
+Usage:
+    python benchmarks/bench_throughput.py [--tasks 16] [--concurrency 1 2 4 8] [--latency lognormal:0.5:0.4]
+                                          [--rate-429 0.05] [--rate-5xx 0.02] [--invalid-plan-rate 0.2] [--pipeline]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import main as runner
+from agents.agent_with_dag_validation import ExperimentPlanningAgent
+from tools.jsonl_checkpoint import is_error_record
+from tools.mock_openai_server import LatencyModel, MockConfig, MockOpenAIServer
+from tools.reference_store import ReferenceStore, set_reference_store
+
+DEFAULT_INPUT = Path(__file__).resolve().parent.parent / "data" / "public_test.jsonl"
+
+
+def load_tasks(path: Path, n: int) -> list:
+    """入力JSONLのタスクを n 件になるまで繰り返し、IDを一意にする"""
+    samples = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    return [{**samples[i % len(samples)], "id": f"{samples[i % len(samples)]['id']}_{i}"} for i in range(n)]
+
+
+def bench(tasks: list, concurrency: int, pipeline: bool, workspace: Path) -> dict:
+    agent = ExperimentPlanningAgent(api_key="mock", workspace_dir=str(workspace))
+    started = time.perf_counter()
+    # エージェントの進捗表示は計測結果の邪魔になるので捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        if pipeline:
+            results = runner.run_pipeline(agent, tasks, concurrency=concurrency)
+        else:
+            results = runner.run_tasks(agent, tasks, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": "pipeline" if pipeline else "pool",
+        "concurrency": concurrency,
+        "tasks": len(tasks),
+        "seconds": round(elapsed, 2),
+        "tasks_per_minute": round(len(tasks) / elapsed * 60, 1),
+        "errors": sum(1 for r in results if is_error_record(r)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end throughput benchmark")
+    parser.add_argument("--input", type=Path, default=DEFAULT_INPUT, help="Task JSONL to draw inputs from")
+    parser.add_argument("--tasks", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", default="lognormal:0.5:0.4", help="Mock latency distribution")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--invalid-plan-rate", type=float, default=0.0)
+    parser.add_argument("--pipeline", action="store_true", help="Also run the stage pipeline at each concurrency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=LatencyModel.parse(args.latency),
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        retry_after=0.1,
+        invalid_plan_rate=args.invalid_plan_rate,
+        seed=args.seed,
+    )
+    tasks = load_tasks(args.input, args.tasks)
+
+    rows = []
+    with MockOpenAIServer(config) as server, tempfile.TemporaryDirectory() as tmp:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        set_reference_store(ReferenceStore(Path(tmp) / "references", offline=True))
+        print(f"mock server {server.base_url}  latency={args.latency}  tasks={len(tasks)}")
+
+        for concurrency in args.concurrency:
+            for pipeline in (False, True) if args.pipeline else (False,):
+                row = bench(tasks, concurrency, pipeline, Path(tmp) / "workspace")
+                rows.append(row)
+                print(
+                    f"{row['mode']:<8} concurrency={concurrency:>3}  {row['seconds']:>7.1f} s  "
+                    f"{row['tasks_per_minute']:>7.1f} tasks/min  errors={row['errors']}"
+                )
+        print(f"requests served: {server.counts}")
+
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ BioPlanner × Snakemake エージェント (Experiment Planner)
 
 import os
 import json
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, Optional, List, Any, Tuple
 from openai import OpenAI
@@ -15,98 +19,221 @@ sys.path.append(str(Path(__file__).parent.parent))
 # Import from sibling modules
 # Note: When running as a script, we need to handle imports carefully
 try:
-    from agents.dag_validator import DAGValidator, ValidationResult
+    from agents.dag_repair import DAGRepairer
+    from agents.dag_validator import DAGValidator, apply_operation_patch, ValidationDelta, ValidationResult
     from agents.prompts import (
         PHASE1_DESIGN_PROMPT,
         PHASE1_OBJECTS_PROMPT,
         PHASE2_OP_DEF_PROMPT,
+        PHASE2_PATCH_PROMPT,
         PHASE3_PROC_GEN_PROMPT,
+        PHASE3_RETRY_NOTE,
         FEEDBACK_PROMPT,
     )
 except ImportError:
     # Fallback for when running from root
-    from src.agents.dag_validator import DAGValidator, ValidationResult
+    from src.agents.dag_repair import DAGRepairer
+    from src.agents.dag_validator import DAGValidator, apply_operation_patch, ValidationDelta, ValidationResult
     from src.agents.prompts import (
         PHASE1_DESIGN_PROMPT,
         PHASE1_OBJECTS_PROMPT,
         PHASE2_OP_DEF_PROMPT,
+        PHASE2_PATCH_PROMPT,
         PHASE3_PROC_GEN_PROMPT,
+        PHASE3_RETRY_NOTE,
         FEEDBACK_PROMPT,
     )
 
-from tools.fetch_url import fetch_text
+from tools.fetch_url import extract_url, fetch_many
+from tools.hedging import HedgePolicy
+from tools.llm_cache import LLMCache
+from tools.llm_client import LLMClient, llm_cancel_scope
+from tools.llm_telemetry import LLMTelemetry, llm_context
+from tools.output_constraints import fix_steps
+from tools.reference_retrieval import (
+    DEFAULT_BUDGET_TOKENS,
+    DEFAULT_TOP_K,
+    estimate_text_tokens,
+    format_chunks,
+    select_chunks,
+)
+
+
+@dataclass
+class TaskContext:
+    """1タスク分の実行状態（並行実行時にタスク間で共有しない）"""
+
+    task_id: str
+    workspace_dir: Path
+    validator: DAGValidator = field(default_factory=DAGValidator)
+
+    @property
+    def references_dir(self) -> Path:
+        return self.workspace_dir / "references"
+
+
+@dataclass
+class PlanningJob:
+    """1タスク分の途中結果（パイプラインの段の間で受け渡す）"""
+
+    input_data: dict
+    ctx: Optional[TaskContext] = None
+    references_text: str = ""
+    design_result: Optional[dict] = None
+    phase1_result: Optional[dict] = None
+    phase2_result: Optional[dict] = None
+    validation_result: Optional[ValidationResult] = None
+    result: Optional[dict] = None  # 最終結果（途中で確定した場合は以降の段をスキップする）
+
+    @property
+    def task_id(self) -> str:
+        return self.input_data.get("id", "unknown")
+
+
+# フェーズ3の呼び出し回数の上限（出力制約を手元で直せなかったときだけ再生成する）
+PHASE3_MAX_ATTEMPTS = 2
+
+
+def speculative_temperatures(k: int, low: float = 0.2, high: float = 1.0) -> List[float]:
+    """投機的生成の k 個の候補に使う温度（low から high まで等間隔。1個なら low）"""
+    if k <= 1:
+        return [low]
+    return [round(low + (high - low) * i / (k - 1), 2) for i in range(k)]
 
 
 class ExperimentPlanningAgent:
-    """実験計画エージェント（DAG検証機能付き）"""
+    """実験計画エージェント（DAG検証機能付き）
+
+    エージェント自体はタスク間で共有される設定（クライアント・モデル名）のみを持ち、
+    タスクごとの状態は TaskContext に保持する。そのため複数スレッドから run() を並行に呼び出せる。
+    """
 
     def __init__(
-        self, api_key: str, model_name: str = "gpt-4o", max_retries: int = 3, workspace_dir: str = "workspace"
+        self,
+        api_key: str,
+        model_name: str = "gpt-4o",
+        max_retries: int = 3,
+        workspace_dir: str = "workspace",
+        cache: Optional[LLMCache] = None,
+        fetch_deadline: float = 90.0,
+        telemetry: Optional[LLMTelemetry] = None,
+        hedge: Optional[HedgePolicy] = None,
+        reference_budget_tokens: int = DEFAULT_BUDGET_TOKENS,
+        reference_top_k: int = DEFAULT_TOP_K,
+        repair_mode: str = "patch",
+        local_repair: bool = True,
+        phase2_candidates: int = 1,
     ):
         self.client = OpenAI(api_key=api_key)
+        self.llm = LLMClient(self.client, cache=cache, telemetry=telemetry, hedge=hedge)
         self.model_name = model_name
         self.max_retries = max_retries
-        self.validator = DAGValidator()
+        # 検証エラーの修正方法: "patch" は差分だけを出力させて手元で適用する（収束しなければ全体を再生成）、
+        # "full" は毎回オペレーション一覧全体を再生成する
+        self.repair_mode = repair_mode
+        # LLMで再試行する前に、機械的に直せる検証エラーを手元で修復する（agents/dag_repair.py）
+        self.local_repair = local_repair
+        # フェーズ2の全体生成で並行に出す候補の数（2以上で投機的生成、最初に検証に通った候補を採用する）
+        self.phase2_candidates = phase2_candidates
+        self._metrics_lock = threading.Lock()
+        self._repair_counters = {"failed_validations": 0, "rewrites": 0, "fixed_locally": 0, "avoided_round_trips": 0}
+        self._speculation_counters = {
+            "rounds": 0,
+            "valid_rounds": 0,
+            "candidates_validated": 0,
+            "candidates_discarded": 0,
+        }
+        self._constraint_counters = {"outputs_checked": 0, "fixed_locally": 0, "llm_recalls": 0}
+        self.fetch_deadline = fetch_deadline  # 1タスクあたりの参考文献取得の制限時間（秒）
+        self.reference_budget_tokens = reference_budget_tokens  # プロンプトに入れる参考文献の token 予算
+        self.reference_top_k = reference_top_k  # プロンプトに入れる参考文献チャンクの最大数
         self.workspace_dir = Path(workspace_dir)
         self.workspace_dir.mkdir(parents=True, exist_ok=True)
 
-        # Sub-directories
-        (self.workspace_dir / "references").mkdir(exist_ok=True)
+    def create_context(self, task_id: str) -> TaskContext:
+        """タスク用のワークスペースを作成し、コンテキストを返す"""
+        ctx = TaskContext(task_id=task_id, workspace_dir=self.workspace_dir / task_id)
+        ctx.references_dir.mkdir(parents=True, exist_ok=True)
+        return ctx
 
-    def _call_llm(self, system_prompt: str, user_prompt: str, response_format=None) -> Any:
-        """LLMを呼び出す共通メソッド"""
+    def _call_llm(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        response_format=None,
+        ctx: Optional[TaskContext] = None,
+        phase: Optional[str] = None,
+        temperature: float = 0.2,
+    ) -> Any:
+        """LLMを呼び出す共通メソッド（ctx と phase は計測イベントのタスクID・フェーズになる）"""
         try:
             messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
 
             kwargs = {
                 "model": self.model_name,
                 "messages": messages,
-                "temperature": 0.2,
+                "temperature": temperature,
             }
 
             if response_format:
                 kwargs["response_format"] = response_format
 
-            response = self.client.chat.completions.create(**kwargs)
-            content = response.choices[0].message.content
+            with llm_context(task_id=ctx.task_id if ctx else None, phase=phase):
+                content = self.llm.chat(**kwargs).text
 
             if response_format:
                 return json.loads(content)
             return content
 
         except Exception as e:
+            # 429/5xx/タイムアウトの再試行は LLMClient（プロセス共有のレート制限器）が済ませている
             print(f"Error calling LLM: {e}")
-            # Retry logic could be added here
             raise
 
-    def fetch_references(self, references: List[Dict]) -> str:
-        """参考文献のURLからテキストを取得"""
+    def fetch_references(self, ctx: TaskContext, references: List[Dict], query: str = "") -> str:
+        """
+        参考文献のURLからテキストを取得し（並行取得、制限時間を超えた分は諦める）、
+        query（指示文・必須物品）に関連するチャンクを token 予算内で選んでプロンプト用のテキストにする
+        """
         print("🌐 参考文献を取得中...")
-        fetched_summary = []
-        for ref in references:
-            # Extract URL from text (simple heuristic)
-            text = ref.get("text", "")
-            url = next((w for w in text.split() if w.startswith("http")), None)
-
+        targets = []
+        for i, ref in enumerate(references, 1):
+            # 参考文献は {"id", "text"} の辞書か、単なる文字列のどちらか
+            if isinstance(ref, str):
+                ref = {"id": i, "text": ref}
+            url = extract_url(ref.get("text", ""))
             if url:
                 print(f"  Fetching: {url}")
-                try:
-                    content = fetch_text(url)
+                targets.append((ref.get("id", "unknown"), url))
+
+        contents = fetch_many([url for _, url in targets], deadline=self.fetch_deadline)
+
+        documents: Dict[str, str] = {}
+        labels: Dict[str, str] = {}
+        failed = []
+        for ref_id, url in targets:
+            content = contents.get(url)
+            if content is None:
+                print(f"  Failed to fetch {url}: deadline exceeded")
+                failed.append(f"Reference [{ref_id}]: Failed to fetch content.")
+                continue
 
-                    # Save to workspace
-                    ref_id = ref.get("id", "unknown")
-                    save_path = self.workspace_dir / "references" / f"ref_{ref_id}.txt"
-                    save_path.write_text(content, encoding="utf-8")
+            # Save to workspace
+            save_path = ctx.references_dir / f"ref_{ref_id}.txt"
+            save_path.write_text(content, encoding="utf-8")
+            documents[str(ref_id)] = content
+            labels[str(ref_id)] = f"Reference [{ref_id}] ({url})"
 
-                    # Summarize for prompt context (first 2000 chars)
-                    fetched_summary.append(f"Reference [{ref_id}] ({url}):\n{content[:2000]}...")
-                except Exception as e:
-                    print(f"  Failed to fetch {url}: {e}")
-                    fetched_summary.append(f"Reference [{ref_id}]: Failed to fetch content.")
+        # 全文ではなく、関連するチャンクだけをプロンプトに入れる
+        chunks = select_chunks(documents, query, budget_tokens=self.reference_budget_tokens, top_k=self.reference_top_k)
+        if documents:
+            total = sum(estimate_text_tokens(content) for content in documents.values())
+            used = sum(estimate_text_tokens(chunk.prompt_text) for chunk in chunks)
+            print(f"  📚 参考文献 {len(documents)}件から {len(chunks)}チャンクを選択（約{used}/{total} tokens）")
 
-        return "\n\n".join(fetched_summary)
+        return "\n\n".join(part for part in [format_chunks(chunks, labels), *failed] if part)
 
-    def phase1_identify_objects(self, input_data: dict, references_text: str) -> dict:
+    def phase1_identify_objects(self, ctx: TaskContext, input_data: dict, references_text: str) -> dict:
         """
         フェーズ1: 実験デザイン抽出とオブジェクト同定
         """
@@ -114,11 +241,18 @@ class ExperimentPlanningAgent:
         print("フェーズ1: 実験デザイン抽出 & オブジェクト同定...")
         print("=" * 60)
 
+        design_result = self.phase1_extract_design(ctx, input_data, references_text)
+        objects_result = self.phase1_define_objects(ctx, input_data, design_result)
+
+        print("✅ フェーズ1完了")
+        return objects_result
+
+    def phase1_extract_design(self, ctx: TaskContext, input_data: dict, references_text: str) -> dict:
+        """Step 1.1: 実験デザイン抽出"""
         instruction = input_data["input"]["instruction"]
         mandatory_objects = input_data["input"]["mandatory_objects"]
         source_protocol = input_data["input"].get("source_protocol_steps", [])
 
-        # Step 1.1: デザイン抽出
         print("  Step 1.1: 実験デザイン抽出中...")
         design_prompt = PHASE1_DESIGN_PROMPT.format(
             instruction=instruction,
@@ -132,14 +266,20 @@ class ExperimentPlanningAgent:
             system_prompt="You are a laboratory automation expert. Output JSON.",
             user_prompt=design_prompt,
             response_format={"type": "json_object"},
+            ctx=ctx,
+            phase="1.1",
         )
 
         # Save design
-        (self.workspace_dir / "1_1_design.json").write_text(
+        (ctx.workspace_dir / "1_1_design.json").write_text(
             json.dumps(design_result, ensure_ascii=False, indent=2), encoding="utf-8"
         )
+        return design_result
+
+    def phase1_define_objects(self, ctx: TaskContext, input_data: dict, design_result: dict) -> dict:
+        """Step 1.2: オブジェクト定義"""
+        mandatory_objects = input_data["input"]["mandatory_objects"]
 
-        # Step 1.2: オブジェクト定義
         print("  Step 1.2: オブジェクト定義中...")
         objects_prompt = PHASE1_OBJECTS_PROMPT.format(
             experimental_design=json.dumps(design_result, ensure_ascii=False),
@@ -150,19 +290,28 @@ class ExperimentPlanningAgent:
             system_prompt="You are a laboratory automation expert. Output JSON.",
             user_prompt=objects_prompt,
             response_format={"type": "json_object"},
+            ctx=ctx,
+            phase="1.2",
         )
 
         # Save objects
-        (self.workspace_dir / "1_2_objects.json").write_text(
+        (ctx.workspace_dir / "1_2_objects.json").write_text(
             json.dumps(objects_result, ensure_ascii=False, indent=2), encoding="utf-8"
         )
-
-        print("✅ フェーズ1完了")
         return objects_result
 
-    def phase2_define_operations(self, input_data: dict, phase1_result: dict, feedback: Optional[str] = None) -> dict:
+    def phase2_define_operations(
+        self,
+        ctx: TaskContext,
+        input_data: dict,
+        phase1_result: dict,
+        feedback: Optional[str] = None,
+        attempt: int = 1,
+        temperature: float = 0.2,
+        save: bool = True,
+    ) -> dict:
         """
-        フェーズ2: オペレーション定義
+        フェーズ2: オペレーション定義（save=False ならワークスペースに保存しない）
         """
         print("=" * 60)
         print("フェーズ2: オペレーション定義エージェント実行中...")
@@ -188,24 +337,147 @@ class ExperimentPlanningAgent:
             system_prompt="You are a laboratory automation expert. Output JSON.",
             user_prompt=prompt,
             response_format={"type": "json_object"},
+            ctx=ctx,
+            phase=f"2-attempt-{attempt}",
+            temperature=temperature,
         )
 
         # ワークスペースに保存
-        (self.workspace_dir / "2_operations.json").write_text(
-            json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        if save:
+            (ctx.workspace_dir / "2_operations.json").write_text(
+                json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
 
         print("✅ フェーズ2完了")
         return result
 
+    def phase2_speculate(
+        self,
+        ctx: TaskContext,
+        input_data: dict,
+        phase1_result: dict,
+        feedback: Optional[str] = None,
+        attempt: int = 1,
+    ) -> dict:
+        """
+        フェーズ2（投機的生成）: 温度を変えた phase2_candidates 個の候補を並行に生成し、届いた順にDAG検証する。
+        最初に検証に通った候補を採用して残りを打ち切る。どれも通らなければエラーの最も少ない候補を返す。
+        """
+        temperatures = speculative_temperatures(self.phase2_candidates)
+        print(f"🎲 フェーズ2: {len(temperatures)}個の候補を並行に生成中（temperature {temperatures}）")
+        cancel = threading.Event()
+
+        def generate(temperature: float) -> dict:
+            with llm_cancel_scope(cancel):
+                return self.phase2_define_operations(
+                    ctx, input_data, phase1_result, feedback, attempt=attempt, temperature=temperature, save=False
+                )
+
+        executor = ThreadPoolExecutor(max_workers=len(temperatures))
+        # 計測のコンテキスト（429の記録など）を候補のスレッドにも引き継ぐ
+        futures = {
+            executor.submit(contextvars.copy_context().run, generate, temperature): (i, temperature)
+            for i, temperature in enumerate(temperatures, 1)
+        }
+        best = None  # (エラー数, 候補番号, 結果)
+        validated = 0
+        try:
+            for future in as_completed(futures):
+                i, temperature = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"  候補{i} (temperature {temperature}): 生成に失敗 ({type(e).__name__}: {e})")
+                    continue
+                validator = DAGValidator()
+                validator.load_from_phases(phase1_result, result)
+                errors = validator.validate().errors
+                validated += 1
+                print(f"  候補{i} (temperature {temperature}): エラー {len(errors)}個")
+                if best is None or len(errors) < best[0]:
+                    best = (len(errors), i, result)
+                if not errors:
+                    break
+        finally:
+            # 残りの候補は送信・再試行をやめさせ、届いた応答は捨てる
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self._count(
+            self._speculation_counters,
+            rounds=1,
+            valid_rounds=int(best is not None and best[0] == 0),
+            candidates_validated=validated,
+            candidates_discarded=len(temperatures) - validated,
+        )
+        if best is None:
+            raise RuntimeError("Phase 2: all speculative candidates failed")
+
+        print(f"✅ 候補{best[1]}を採用（エラー {best[0]}個）")
+        (ctx.workspace_dir / "2_operations.json").write_text(
+            json.dumps(best[2], ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        return best[2]
+
+    def phase2_repair_operations(
+        self,
+        ctx: TaskContext,
+        input_data: dict,
+        phase1_result: dict,
+        phase2_result: dict,
+        feedback: str,
+        attempt: int,
+    ) -> dict:
+        """
+        フェーズ2（パッチ修正）: 現在のオペレーション一覧に対する差分だけをLLMに出力させ、手元で適用する
+        """
+        print("=" * 60)
+        print("フェーズ2: オペレーションをパッチで修正中...")
+        print("=" * 60)
+
+        operations = phase2_result.get("operations", [])
+        prompt = PHASE2_PATCH_PROMPT.format(
+            instruction=input_data["input"]["instruction"],
+            identified_objects=json.dumps(phase1_result["identified_objects"], ensure_ascii=False),
+            operations=json.dumps(operations, ensure_ascii=False),
+            feedback=feedback,
+        )
+
+        patch = self._call_llm(
+            system_prompt="You are a laboratory automation expert. Output JSON.",
+            user_prompt=prompt,
+            response_format={"type": "json_object"},
+            ctx=ctx,
+            phase=f"2-patch-attempt-{attempt}",
+        )
+        if not isinstance(patch, dict):
+            patch = {}
+
+        # ワークスペースに保存
+        (ctx.workspace_dir / f"2_patch_attempt_{attempt}.json").write_text(
+            json.dumps(patch, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+        print(
+            f"✅ パッチ適用: 追加 {len(patch.get('add_operations') or [])}件, "
+            f"削除 {len(patch.get('remove_operation_ids') or [])}件, 置換 {len(patch.get('replace_operations') or [])}件"
+        )
+        return {**phase2_result, "operations": apply_operation_patch(operations, patch)}
+
     def validate_with_retry(
-        self, input_data: dict, phase1_result: dict
+        self, ctx: TaskContext, input_data: dict, phase1_result: dict
     ) -> Tuple[Optional[dict], Optional[ValidationResult]]:
         """
-        フェーズ2の出力をDAG検証し、エラーがあれば修正を試みる
+        フェーズ2の出力をDAG検証し、エラーがあれば修正を試みる。
+        機械的に直せるエラーはLLMを呼ぶ前に手元で修復し（local_repair）、残ったエラーだけをLLMに戻す。
+        phase2_candidates が2以上なら、全体の生成は候補を並行に出して最初に検証に通ったものを使う（phase2_speculate）。
+        repair_mode="patch" の場合、2回目以降は差分（パッチ）で修正し、パッチでエラーが減らなければ
+        パッチ適用前の計画に戻して次の試行で全体を再生成する。
         """
         phase2_result = None
         validation_result = None
+        delta = None
+        use_patch = False
 
         for attempt in range(self.max_retries):
             print(f"\n{'=' * 60}")
@@ -215,14 +487,51 @@ class ExperimentPlanningAgent:
             # フィードバックを生成（2回目以降）
             feedback = None
             if attempt > 0 and validation_result:
-                feedback = self._generate_feedback(validation_result)
+                # 初回の検証には比較対象がないため、エラーの増減は2回目の検証結果から伝える
+                feedback = self._generate_feedback(validation_result, delta if attempt > 1 else None)
 
             # フェーズ2を実行
-            phase2_result = self.phase2_define_operations(input_data, phase1_result, feedback)
+            if use_patch:
+                candidate = self.phase2_repair_operations(
+                    ctx, input_data, phase1_result, phase2_result, feedback, attempt=attempt + 1
+                )
+            elif self.phase2_candidates > 1:
+                candidate = self.phase2_speculate(ctx, input_data, phase1_result, feedback, attempt=attempt + 1)
+            else:
+                candidate = self.phase2_define_operations(ctx, input_data, phase1_result, feedback, attempt=attempt + 1)
+
+            # DAG検証（2回目以降は前回のオペレーションとの差分だけを再検証する）
+            if attempt == 0:
+                ctx.validator.load_from_phases(phase1_result, {})
+            candidate_delta = ctx.validator.validate_incremental(candidate.get("operations", []))
+
+            if (
+                use_patch
+                and not candidate_delta.result.valid
+                and len(candidate_delta.result.errors) >= len(validation_result.errors)
+            ):
+                # パッチで収束しない: 適用前の計画に戻し、次の試行では全体を再生成する
+                print(f"\n❌ パッチでエラーが減りませんでした（{len(candidate_delta.result.errors)}個のエラー）")
+                ctx.validator.validate_incremental(phase2_result.get("operations", []))
+                use_patch = False
+                delta = None
+                if attempt < self.max_retries - 1:
+                    print("→ パッチ適用前の計画に戻し、全体を再生成します...")
+                continue
 
-            # DAG検証
-            self.validator.load_from_phases(phase1_result, phase2_result)
-            validation_result = self.validator.validate()
+            phase2_result, delta = candidate, candidate_delta
+            validation_result = delta.result
+            # LLMに戻す前に、機械的に直せるエラーを手元で修復する
+            repaired = None
+            if not validation_result.valid and self.local_repair:
+                repaired = self._repair_locally(ctx, input_data, phase1_result, phase2_result, delta, attempt + 1)
+                if repaired is not None:
+                    phase2_result, delta = repaired
+                    validation_result = delta.result
+            if use_patch or repaired is not None:
+                (ctx.workspace_dir / "2_operations.json").write_text(
+                    json.dumps(phase2_result, ensure_ascii=False, indent=2), encoding="utf-8"
+                )
 
             print("\n" + "=" * 60)
             print("DAG検証結果:")
@@ -231,17 +540,90 @@ class ExperimentPlanningAgent:
 
             if validation_result.valid:
                 print("\n✅ 検証成功！")
+                if repaired is not None and attempt < self.max_retries - 1:
+                    self._count_repair(avoided_round_trips=1)
                 break
             else:
                 print(f"\n❌ 検証失敗（{len(validation_result.errors)}個のエラー）")
+                use_patch = self.repair_mode == "patch"
                 if attempt < self.max_retries - 1:
                     print("→ エラーをフィードバックして再試行します...")
 
         return phase2_result, validation_result
 
-    def _generate_feedback(self, validation_result: ValidationResult) -> str:
-        """検証結果から、LLMに渡すフィードバックメッセージを生成"""
-        feedback_lines = ["前回生成したオペレーションには以下のエラーがありました。修正してください:\n"]
+    def _repair_locally(
+        self,
+        ctx: TaskContext,
+        input_data: dict,
+        phase1_result: dict,
+        phase2_result: dict,
+        delta: ValidationDelta,
+        attempt: int,
+    ) -> Optional[Tuple[dict, ValidationDelta]]:
+        """
+        機械的に直せる検証エラー（名前のゆれ・重複出力など）を手元で修復する。
+        書き換えを1件以上採用した場合は (修復後のフェーズ2結果, 検証結果) を、なければ None を返す。
+        """
+        repairer = DAGRepairer(ctx.validator, input_data["input"].get("mandatory_objects", []))
+        repair = repairer.repair(phase2_result.get("operations", []), delta)
+        self._count_repair(
+            failed_validations=1, rewrites=len(repair.rewrites), fixed_locally=int(repair.delta.result.valid)
+        )
+        if not repair.rewrites:
+            return None
+
+        print(f"\n🔧 局所修復: {len(repair.rewrites)}件の書き換え（残りのエラー {len(repair.delta.result.errors)}個）")
+        for rewrite in repair.rewrites:
+            print(f"  - {rewrite}")
+        if repair.declared_initial:
+            # 以降のプロンプト（パッチ修正など）でも初期オブジェクトとして扱う
+            phase1_result["identified_objects"].setdefault("initial", []).extend(repair.declared_initial)
+
+        log_path = ctx.workspace_dir / "2_repairs.json"
+        log = json.loads(log_path.read_text(encoding="utf-8")) if log_path.exists() else []
+        log += [{"attempt": attempt, **rewrite.to_dict()} for rewrite in repair.rewrites]
+        log_path.write_text(json.dumps(log, ensure_ascii=False, indent=2), encoding="utf-8")
+        return {**phase2_result, "operations": repair.operations}, repair.delta
+
+    def _count(self, counters: Dict[str, int], **increments: int) -> None:
+        with self._metrics_lock:
+            for key, value in increments.items():
+                counters[key] += value
+
+    def _count_repair(self, **increments: int) -> None:
+        self._count(self._repair_counters, **increments)
+
+    def repair_metrics(self) -> Dict[str, Any]:
+        """局所修復の累計（avoided_rate は検証失敗のうち、LLMでの再試行を省けた割合）"""
+        with self._metrics_lock:
+            counters = dict(self._repair_counters)
+        failed = counters["failed_validations"]
+        return {**counters, "avoided_rate": round(counters["avoided_round_trips"] / failed, 3) if failed else 0.0}
+
+    def speculation_metrics(self) -> Dict[str, Any]:
+        """投機的生成の累計（valid_rounds は検証に通る候補が得られた回数、discarded は打ち切った・捨てた候補の数）"""
+        with self._metrics_lock:
+            return dict(self._speculation_counters)
+
+    def constraint_metrics(self) -> Dict[str, Any]:
+        """フェーズ3の出力制約の累計（fixed_locally は手元の修正で済んだ出力、llm_recalls は再生成した回数）"""
+        with self._metrics_lock:
+            return dict(self._constraint_counters)
+
+    def _generate_feedback(self, validation_result: ValidationResult, delta: Optional[ValidationDelta] = None) -> str:
+        """検証結果から、LLMに渡すフィードバックメッセージを生成（delta があれば前回の修正での増減も伝える）"""
+        feedback_lines = []
+        if delta is not None:
+            if delta.resolved:
+                feedback_lines.append("前回の修正で以下のエラーは解消されました（この部分は変更しないでください）:")
+                feedback_lines += [f"- {error.message}" for error in delta.resolved]
+                feedback_lines.append("")
+            if delta.introduced:
+                feedback_lines.append("前回の修正で以下のエラーが新たに発生しました:")
+                feedback_lines += [f"- {error.message}" for error in delta.introduced]
+                feedback_lines.append("")
+
+        feedback_lines.append("前回生成したオペレーションには以下のエラーがありました。修正してください:\n")
 
         for i, error in enumerate(validation_result.errors, 1):
             feedback_lines.append(f"{i}. {error.message}")
@@ -251,6 +633,7 @@ class ExperimentPlanningAgent:
 
     def phase3_generate_procedure(
         self,
+        ctx: TaskContext,
         input_data: dict,
         phase1_result: dict,
         phase2_result: dict,
@@ -279,58 +662,114 @@ class ExperimentPlanningAgent:
             instruction=instruction, operations=json.dumps(ordered_ops, ensure_ascii=False), references=references_text
         )
 
-        # LLM呼び出し
-        result = self._call_llm(
-            system_prompt="You are a laboratory automation expert. Output JSON.",
-            user_prompt=prompt,
-            response_format={"type": "json_object"},
-        )
+        # 出力制約（50ステップ・各10文）は手元で直し、直せない（使えるステップが1つもない）場合だけ再生成する
+        for attempt in range(1, PHASE3_MAX_ATTEMPTS + 1):
+            result = self._call_llm(
+                system_prompt="You are a laboratory automation expert. Output JSON.",
+                user_prompt=prompt,
+                response_format={"type": "json_object"},
+                ctx=ctx,
+                phase="3" if attempt == 1 else f"3-attempt-{attempt}",
+            )
+            steps = result.get("procedure_steps") if isinstance(result, dict) else None
+            fixed = fix_steps(steps)
+            self._count(self._constraint_counters, outputs_checked=1, fixed_locally=int(fixed.ok and bool(fixed.fixes)))
+            if fixed.ok:
+                break
+            if attempt == PHASE3_MAX_ATTEMPTS:
+                raise RuntimeError(f"フェーズ3の出力から手順を取り出せませんでした: {fixed.violations[0].message}")
+            print(f"⚠️ 手順書を手元で修正できないため再生成します: {fixed.violations[0].message}")
+            self._count(self._constraint_counters, llm_recalls=1)
+            prompt += PHASE3_RETRY_NOTE
+
+        if fixed.fixes:
+            print(f"🔧 出力制約に合わせて修正: {'、'.join(fixed.fixes)}")
+            (ctx.workspace_dir / "3_constraint_fixes.json").write_text(
+                json.dumps(fixed.fixes, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
 
         print("✅ フェーズ3完了")
-        return result
-
-    def run(self, input_data: dict) -> dict:
-        """エージェント全体を実行"""
-        task_id = input_data.get("id", "unknown")
+        return {**result, "procedure_steps": fixed.steps}
+
+    # ------------------------------------------------------------------
+    # 段（パイプライン実行時は段ごとに別のワーカープールで実行される）
+    # ------------------------------------------------------------------
+
+    def pipeline_stages(self) -> List[Tuple[str, Any]]:
+        """タスク処理を構成する段（名前, PlanningJob を受け取って返す関数）を実行順に返す"""
+        return [
+            ("fetch", self.stage_fetch),
+            ("design", self.stage_design),
+            ("objects", self.stage_objects),
+            ("operations", self.stage_operations),
+            ("procedure", self.stage_procedure),
+        ]
+
+    def stage_fetch(self, job: PlanningJob) -> PlanningJob:
+        """参考文献取得（I/O待ちが主）"""
         print("\n" + "🚀" * 30)
-        print(f"実験計画エージェント開始: {task_id}")
+        print(f"実験計画エージェント開始: {job.task_id}")
         print("🚀" * 30 + "\n")
 
         # Workspace setup for this task
-        self.workspace_dir = Path(f"workspace/{task_id}")
-        self.workspace_dir.mkdir(parents=True, exist_ok=True)
-        (self.workspace_dir / "references").mkdir(exist_ok=True)
-
-        # 参考文献取得
-        references = input_data["input"].get("references", [])
-        references_text = self.fetch_references(references)
-
-        # フェーズ1: オブジェクト同定
-        phase1_result = self.phase1_identify_objects(input_data, references_text)
+        job.ctx = self.create_context(job.task_id)
+        task_input = job.input_data["input"]
+        query = "\n".join([task_input.get("instruction", ""), *task_input.get("mandatory_objects", [])])
+        job.references_text = self.fetch_references(job.ctx, task_input.get("references", []), query)
+        return job
+
+    def stage_design(self, job: PlanningJob) -> PlanningJob:
+        """フェーズ1.1: 実験デザイン抽出"""
+        job.design_result = self.phase1_extract_design(job.ctx, job.input_data, job.references_text)
+        return job
+
+    def stage_objects(self, job: PlanningJob) -> PlanningJob:
+        """フェーズ1.2: オブジェクト定義"""
+        job.phase1_result = self.phase1_define_objects(job.ctx, job.input_data, job.design_result)
+        print("✅ フェーズ1完了")
+        return job
 
-        # フェーズ2: オペレーション定義（DAG検証付き）
-        phase2_result, validation_result = self.validate_with_retry(input_data, phase1_result)
+    def stage_operations(self, job: PlanningJob) -> PlanningJob:
+        """フェーズ2: オペレーション定義（DAG検証付き）"""
+        job.phase2_result, job.validation_result = self.validate_with_retry(job.ctx, job.input_data, job.phase1_result)
 
-        if phase2_result is None or validation_result is None:
-            return {
-                "id": task_id,
+        if job.phase2_result is None or job.validation_result is None:
+            job.result = {
+                "id": job.task_id,
                 "output": {"procedure_steps": [{"id": 1, "text": "Error: Phase 2 failed to produce results."}]},
             }
-
-        if not validation_result.valid:
+        elif not job.validation_result.valid:
             print("\n❌ 最大試行回数に達しましたが、検証に失敗しました。")
             print("⚠️ 検証失敗のままフェーズ3に進みます（ベストエフォート）")
+        return job
+
+    def stage_procedure(self, job: PlanningJob) -> PlanningJob:
+        """フェーズ3: 手順書生成"""
+        if job.result is not None:
+            return job
 
-        # フェーズ3: 手順書生成
         phase3_result = self.phase3_generate_procedure(
-            input_data, phase1_result, phase2_result, validation_result, references_text
+            job.ctx,
+            job.input_data,
+            job.phase1_result,
+            job.phase2_result,
+            job.validation_result,
+            job.references_text,
         )
 
         print("\n" + "🎉" * 30)
         print("実験計画エージェント完了")
         print("🎉" * 30 + "\n")
 
-        return {"id": task_id, "output": phase3_result}
+        job.result = {"id": job.task_id, "output": phase3_result}
+        return job
+
+    def run(self, input_data: dict) -> dict:
+        """エージェント全体を実行（全ての段を順に実行する）"""
+        job = PlanningJob(input_data=input_data)
+        for _name, stage in self.pipeline_stages():
+            job = stage(job)
+        return job.result
 
 
 def main():
@@ -0,0 +1,261 @@
+"""
+DAG検証エラーの局所修復（LLMを呼ばずに機械的に直せるものだけを直す）
+
+- MISSING_INPUT: 入力名が初期オブジェクト・他のオペレーションの出力とほぼ一致する → その名前に書き換える
+                 必須物品とほぼ一致する → 初期オブジェクトとして扱う
+- MISSING_FINAL_OUTPUT: 最終成果物と接尾辞（拡張子など）だけが異なる出力がある → 最終成果物の名前に書き換える
+- DUPLICATE_OUTPUT: 複数のオペレーションが同じオブジェクトを生成している → 版番号を付けて区別する
+
+書き換えは1件ずつ差分検証し、エラーが減って新しいエラーが生じない場合だけ採用する。
+"""
+
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from agents.dag_validator import DAGValidator, ValidationDelta, ValidationError
+
+# あいまい一致とみなす類似度の下限と、2番目の候補との差の下限（候補が1つに絞れない場合は直さない）
+DEFAULT_MIN_SIMILARITY = 0.88
+MIN_MARGIN = 0.05
+
+_SEPARATORS = re.compile(r"[\s_\-.・]+")
+_PARENTHESES = re.compile(r"[（(][^）)]*[）)]")
+_DIGITS = re.compile(r"\d+")
+
+
+def _name(path: str) -> str:
+    """オブジェクトパスの最後の要素（"objects/initial/buffer.reagent" → "buffer.reagent"）"""
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _key(text: str) -> str:
+    """比較用の正規化: 小文字化し、括弧書きと区切り文字を除く"""
+    return _SEPARATORS.sub("", _PARENTHESES.sub("", text).lower())
+
+
+def _stem_key(path: str) -> str:
+    """拡張子を除いた名前の正規化"""
+    name = _name(path)
+    return _key(name.rsplit(".", 1)[0] if "." in name else name)
+
+
+def _best_match(target: str, candidates: Dict[str, str], min_similarity: float) -> Optional[str]:
+    """
+    正規化したキー（candidates は 元の名前 → キー）で target に最も近い候補を返す。
+    完全一致が1つだけならそれを、なければ類似度が min_similarity 以上で2番目と十分に差がある候補を返す。
+    数字が異なる候補（sample_rep1 と sample_rep2 など）は別物として扱う。
+    """
+    exact = [name for name, key in candidates.items() if key == target]
+    if exact:
+        return exact[0] if len(exact) == 1 else None
+    digits = _DIGITS.findall(target)
+    scored = sorted(
+        (
+            (difflib.SequenceMatcher(None, target, key).ratio(), name)
+            for name, key in candidates.items()
+            if _DIGITS.findall(key) == digits
+        ),
+        reverse=True,
+    )
+    if not scored or scored[0][0] < min_similarity:
+        return None
+    if len(scored) > 1 and scored[0][0] - scored[1][0] < MIN_MARGIN:
+        return None
+    return scored[0][1]
+
+
+@dataclass
+class Rewrite:
+    """採用した書き換え1件"""
+
+    rule: str  # "match_input" / "declare_initial" / "rename_final_output" / "version_output"
+    error_type: str
+    old: str
+    new: str
+    operation_ids: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "rule": self.rule,
+            "error_type": self.error_type,
+            "old": self.old,
+            "new": self.new,
+            "operation_ids": self.operation_ids,
+        }
+
+    def __str__(self) -> str:
+        where = f" in {', '.join(self.operation_ids)}" if self.operation_ids else ""
+        return f"{self.rule}: {self.old} → {self.new}{where}"
+
+
+@dataclass
+class RepairResult:
+    """局所修復の結果"""
+
+    operations: List[Dict]
+    delta: ValidationDelta  # 修復後の検証結果（修復前の検証からの増減）
+    rewrites: List[Rewrite] = field(default_factory=list)
+    declared_initial: List[str] = field(default_factory=list)  # 初期オブジェクトとして扱うことにしたもの
+
+
+def _rename(operations: List[Dict], old: str, new: str, op_ids: Optional[Set[str]] = None, key: str = "") -> List[Dict]:
+    """
+    オブジェクト old を new に書き換えた新しい一覧を返す（元の辞書は変更しない）。
+    op_ids を指定した場合はそのオペレーションだけ、key（"input" / "output"）を指定した場合はその側だけを書き換える。
+    """
+    renamed = []
+    for op in operations:
+        if op_ids is not None and op.get("operation_id") not in op_ids:
+            renamed.append(op)
+            continue
+        new_op = dict(op)
+        for side in [key] if key else ["input", "output"]:
+            if old in op.get(side, []):
+                new_op[side] = [new if obj == old else obj for obj in op[side]]
+        renamed.append(new_op)
+    return renamed
+
+
+class DAGRepairer:
+    """1つの計画に対する局所修復（validator は直前に validate_incremental() した状態であること）"""
+
+    def __init__(
+        self,
+        validator: DAGValidator,
+        mandatory_objects: Iterable[str] = (),
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+    ):
+        self.validator = validator
+        self.mandatory_keys = {name: _key(name) for name in mandatory_objects}
+        self.min_similarity = min_similarity
+
+    def repair(self, operations: List[Dict], delta: ValidationDelta) -> RepairResult:
+        """エラーを1件ずつ修復し、修復した計画と最終的な検証結果を返す"""
+        result = RepairResult(operations=operations, delta=delta)
+        # 1件直すと他のエラーの前提が変わることがあるため、最新の検証結果から次の候補を選び直す
+        attempted: Set[tuple] = set()
+        while not result.delta.result.valid:
+            error = next(
+                (e for e in result.delta.result.errors if (e.type, e.operation_id, e.object_path) not in attempted),
+                None,
+            )
+            if error is None:
+                break
+            attempted.add((error.type, error.operation_id, error.object_path))
+            self._try_fix(result, error)
+        return result
+
+    def _try_fix(self, result: RepairResult, error: ValidationError) -> None:
+        if error.type == "MISSING_INPUT":
+            candidate = self._fix_missing_input(result.operations, error)
+        elif error.type == "MISSING_FINAL_OUTPUT":
+            candidate = self._fix_missing_final_output(result.operations, error)
+        elif error.type == "DUPLICATE_OUTPUT":
+            candidate = self._fix_duplicate_output(result.operations, error)
+        else:
+            return
+        if candidate is None:
+            return
+
+        operations, rewrite = candidate
+        if rewrite.rule == "declare_initial":
+            # 初期オブジェクトを増やしても MISSING_INPUT が消えるだけで、他のエラーは生じない
+            self.validator.add_initial_objects([rewrite.old])
+            result.delta = self.validator.validate_incremental(operations)
+            result.rewrites.append(rewrite)
+            result.declared_initial.append(rewrite.old)
+            return
+
+        before = len(result.delta.result.errors)
+        delta = self.validator.validate_incremental(operations)
+        if len(delta.result.errors) < before and not delta.introduced:
+            result.operations = operations
+            result.delta = delta
+            result.rewrites.append(rewrite)
+        else:
+            # 元に戻す
+            self.validator.validate_incremental(result.operations)
+
+    def _fix_missing_input(self, operations: List[Dict], error: ValidationError):
+        missing = error.object_path
+        consumer = next(op for op in operations if op.get("operation_id") == error.operation_id)
+        own_outputs = set(consumer.get("output", []))
+        candidates = set(self.validator.initial_objects) | {
+            obj for op in operations for obj in op.get("output", []) if obj not in own_outputs
+        }
+        candidates.discard(missing)
+        match = _best_match(_key(_name(missing)), {c: _key(_name(c)) for c in candidates}, self.min_similarity)
+        if match is not None:
+            rewrite = Rewrite("match_input", error.type, missing, match, [error.operation_id])
+            return _rename(operations, missing, match, {error.operation_id}, "input"), rewrite
+
+        mandatory = _best_match(_stem_key(missing), self.mandatory_keys, self.min_similarity)
+        if mandatory is not None:
+            return operations, Rewrite("declare_initial", error.type, missing, mandatory)
+        return None
+
+    def _fix_missing_final_output(self, operations: List[Dict], error: ValidationError):
+        final = error.object_path
+        matches = sorted(
+            {
+                obj
+                for op in operations
+                for obj in op.get("output", [])
+                if obj not in self.validator.final_objects and _differs_by_suffix(obj, final)
+            }
+        )
+        if len(matches) != 1:
+            return None
+        producers = [op["operation_id"] for op in operations if matches[0] in op.get("output", [])]
+        return _rename(operations, matches[0], final), Rewrite(
+            "rename_final_output", error.type, matches[0], final, producers
+        )
+
+    def _fix_duplicate_output(self, operations: List[Dict], error: ValidationError):
+        obj = error.object_path
+        producers = [op for op in operations if obj in op.get("output", [])]
+        # 自分の出力を入力にもするオペレーション（その場で状態を変える操作）の版の付け方は決められない
+        if len(producers) < 2 or any(obj in op.get("input", []) for op in producers):
+            return None
+        if len({op.get("operation_id") for op in producers}) != len(producers):
+            return None
+
+        # 一覧の順で最後の生成元が元の名前を引き継ぎ、それ以前の生成元の出力に版番号を付ける。
+        # 消費先は、一覧上で直前にある生成元の版を読む
+        name, dot, ext = _name(obj).rpartition(".")
+        prefix = obj[: len(obj) - len(_name(obj))]
+        existing = {o for op in operations for side in ("input", "output") for o in op.get(side, [])}
+        versions = {}
+        for n, op in enumerate(producers[:-1], 1):
+            versioned = f"{prefix}{name}_v{n}{dot}{ext}" if dot else f"{obj}_v{n}"
+            if versioned in existing:
+                return None
+            versions[op["operation_id"]] = versioned
+
+        renamed = []
+        latest = None
+        for op in operations:
+            op_id = op.get("operation_id")
+            if op_id in versions:
+                op = _rename([op], obj, versions[op_id], key="output")[0]
+                latest = versions[op_id]
+            elif obj in op.get("output", []):
+                latest = None
+            elif latest is not None and obj in op.get("input", []):
+                op = _rename([op], obj, latest, key="input")[0]
+            renamed.append(op)
+        rewrite = Rewrite(
+            "version_output", error.type, obj, ", ".join(versions.values()), [op["operation_id"] for op in producers]
+        )
+        return renamed, rewrite
+
+
+def _differs_by_suffix(path: str, final: str) -> bool:
+    """拡張子だけが違う、またはどちらかの名前が他方に区切り文字付きの接尾辞を足したものか"""
+    if _stem_key(path) == _stem_key(final):
+        return True
+    shorter, longer = sorted((_name(path), _name(final)), key=len)
+    shorter = shorter.rsplit(".", 1)[0] if "." in shorter else shorter
+    return bool(shorter) and re.match(re.escape(shorter) + r"[_\-.]", longer) is not None
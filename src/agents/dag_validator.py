@@ -3,21 +3,105 @@ DAG Validation Engine for BioPlanner × Snakemake
 実験計画の論理的整合性を検証するエンジン
 """
 
-from typing import List, Dict, Set, Optional, Tuple
+from typing import Iterable, List, Dict, Sequence, Set, Optional, Tuple
 from dataclasses import dataclass, field
-from collections import defaultdict, deque
+from collections import deque
+from array import array
 import json
 
 
-@dataclass
-class ValidationError:
-    """検証エラーを表すクラス"""
+def _join_cycle(e: "ValidationError") -> str:
+    return " -> ".join(e.details)
+
+
+def _join_producers(e: "ValidationError") -> str:
+    return ", ".join(e.details)
+
+
+# エラー種別ごとのメッセージ・提案テンプレート（to_dict() などで参照されたときに初めて整形する）
+_MESSAGE_TEMPLATES = {
+    "CIRCULAR_DEPENDENCY": (
+        lambda e: f"循環参照が検出されました: {_join_cycle(e)}",
+        lambda e: "オペレーションの依存関係を見直し、循環を解消してください。",
+    ),
+    "MISSING_INPUT": (
+        lambda e: f"オペレーション '{e.operation_id}' の入力 '{e.object_path}' は、どのオペレーションでも生成されていません。",
+        lambda e: f"'{e.object_path}' を生成するオペレーションを追加するか、初期オブジェクトとして定義してください。",
+    ),
+    "UNUSED_OUTPUT": (
+        lambda e: f"オペレーション '{e.operation_id}' の出力 '{e.object_path}' は、どのオペレーションでも使用されていません。",
+        lambda e: f"'{e.object_path}' を使用するオペレーションを追加するか、最終成果物として定義してください。",
+    ),
+    "MISSING_FINAL_OUTPUT": (
+        lambda e: f"最終成果物 '{e.object_path}' を生成するオペレーションがありません。",
+        lambda e: f"'{e.object_path}' を出力として生成するオペレーションを追加してください。",
+    ),
+    "DUPLICATE_OUTPUT": (
+        lambda e: f"オブジェクト '{e.object_path}' が複数のオペレーションで生成されています: {_join_producers(e)}",
+        lambda e: "各オブジェクトは1つのオペレーションのみで生成されるべきです。重複を解消してください。",
+    ),
+    "TOPOLOGICAL_SORT_FAILED": (
+        lambda e: "オペレーションの実行順序を決定できませんでした。循環参照または孤立したオペレーションが存在する可能性があります。",
+        lambda e: "オペレーション間の依存関係を確認してください。",
+    ),
+}
+
 
-    type: str
-    operation_id: Optional[str] = None
-    object_path: Optional[str] = None
-    message: str = ""
-    suggestion: str = ""
+class ValidationError:
+    """検証エラーを表すクラス
+
+    message / suggestion を省略した場合は、参照されたときに type と details から
+    テンプレートで整形する（大量のエラー・警告を生成しても文字列を作らない）。
+    """
+
+    __slots__ = ("type", "operation_id", "object_path", "details", "_message", "_suggestion")
+
+    def __init__(
+        self,
+        type: str,
+        operation_id: Optional[str] = None,
+        object_path: Optional[str] = None,
+        message: str = "",
+        suggestion: str = "",
+        details: Tuple[str, ...] = (),
+    ):
+        self.type = type
+        self.operation_id = operation_id
+        self.object_path = object_path
+        self.details = details
+        self._message = message
+        self._suggestion = suggestion
+
+    @property
+    def message(self) -> str:
+        if not self._message and self.type in _MESSAGE_TEMPLATES:
+            return _MESSAGE_TEMPLATES[self.type][0](self)
+        return self._message
+
+    @message.setter
+    def message(self, value: str) -> None:
+        self._message = value
+
+    @property
+    def suggestion(self) -> str:
+        if not self._suggestion and self.type in _MESSAGE_TEMPLATES:
+            return _MESSAGE_TEMPLATES[self.type][1](self)
+        return self._suggestion
+
+    @suggestion.setter
+    def suggestion(self, value: str) -> None:
+        self._suggestion = value
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ValidationError):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return (
+            f"ValidationError(type={self.type!r}, operation_id={self.operation_id!r}, "
+            f"object_path={self.object_path!r}, message={self.message!r})"
+        )
 
     def to_dict(self) -> dict:
         return {
@@ -50,22 +134,155 @@ class ValidationResult:
         return json.dumps(self.to_dict(), ensure_ascii=False, indent=indent)
 
 
+@dataclass
+class OperationDiff:
+    """前回のオペレーション集合との差分（operation_id で対応付ける）"""
+
+    added: List[Dict] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    changed: List[Dict] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+
+@dataclass
+class ValidationDelta:
+    """差分検証の結果: 最新の検証結果と、前回の検証からのエラーの増減"""
+
+    result: ValidationResult
+    resolved: List[ValidationError] = field(default_factory=list)
+    introduced: List[ValidationError] = field(default_factory=list)
+    diff: OperationDiff = field(default_factory=OperationDiff)
+
+
+def _operation_id(op: Dict) -> str:
+    return op.get("operation_id", "unknown")
+
+
+def diff_operations(old_operations: List[Dict], new_operations: List[Dict]) -> OperationDiff:
+    """2つのオペレーション一覧の差分を operation_id 単位で求める"""
+    old_by_id = {_operation_id(op): op for op in old_operations}
+    new_ids = set()
+    diff = OperationDiff()
+    for op in new_operations:
+        op_id = _operation_id(op)
+        new_ids.add(op_id)
+        if op_id not in old_by_id:
+            diff.added.append(op)
+        elif old_by_id[op_id] != op:
+            diff.changed.append(op)
+    diff.removed = [op_id for op_id in old_by_id if op_id not in new_ids]
+    return diff
+
+
+def apply_operation_patch(operations: List[Dict], patch: Dict) -> List[Dict]:
+    """
+    パッチ（add_operations / remove_operation_ids / replace_operations）を適用した新しいオペレーション一覧を返す。
+    置換は元の位置で行い、追加は末尾に並べる。既存の operation_id への追加は置換として扱い、
+    存在しない operation_id の置換は追加として扱う（削除と同時に指定された場合も置換を優先する）。
+    """
+    removed = set(patch.get("remove_operation_ids") or [])
+    updates: Dict[str, Dict] = {}
+    for op in (patch.get("replace_operations") or []) + (patch.get("add_operations") or []):
+        if isinstance(op, dict):
+            updates[_operation_id(op)] = op
+
+    patched = []
+    for op in operations:
+        op_id = _operation_id(op)
+        if op_id in removed and op_id not in updates:
+            continue
+        patched.append(updates.pop(op_id, op))
+    patched.extend(updates.values())
+    return patched
+
+
+def _error_key(error: ValidationError) -> tuple:
+    return (error.type, error.operation_id, error.object_path, error.details)
+
+
+# 差分検証の結果を並べる順序（validate() と同じ種別順）
+_ERROR_ORDER = {"CIRCULAR_DEPENDENCY": 0, "MISSING_INPUT": 1, "MISSING_FINAL_OUTPUT": 2, "DUPLICATE_OUTPUT": 3}
+
+
+def _build_csr(num_rows: int, rows: Sequence[int], cols: Sequence[int]) -> Tuple[array, array]:
+    """(行, 列) の組からCSR形式の (indptr, indices) を作る。行内の順序は入力順を保つ"""
+    offsets = [0] * (num_rows + 1)
+    for r in rows:
+        offsets[r + 1] += 1
+    for i in range(num_rows):
+        offsets[i + 1] += offsets[i]
+
+    indices = array("i", bytes(4 * len(cols)))
+    cursor = offsets[:-1]
+    for r, c in zip(rows, cols):
+        indices[cursor[r]] = c
+        cursor[r] += 1
+    return array("i", offsets), indices
+
+
 class DAGValidator:
-    """実験計画のDAG検証エンジン"""
+    """実験計画のDAG検証エンジン
+
+    内部ではオブジェクトとオペレーションを整数IDにインターンし、
+    隣接関係をCSR（圧縮行格納）形式の配列で保持する。
+    オペレーションは1件ずつのレコード（__slots__ のオブジェクト）にせず、項目ごとの配列に分けて持つ。
+    """
+
+    # 報告する循環参照の最大数（巨大な不正グラフでエラーが爆発しないように）
+    MAX_REPORTED_CYCLES = 20
 
     def __init__(self):
         self.operations: List[Dict] = []
         self.initial_objects: Set[str] = set()
         self.final_objects: Set[str] = set()
 
-        # グラフ構造
-        self.graph: Dict[str, Set[str]] = defaultdict(
-            set
-        )  # オブジェクト → 依存するオブジェクト
-        self.producers: Dict[str, str] = {}  # オブジェクト → 生成するオペレーションID
-        self.consumers: Dict[str, List[str]] = defaultdict(
-            list
-        )  # オブジェクト → 消費するオペレーションID
+        # インターン表: オブジェクトパス ↔ 整数ID
+        self._object_ids: Dict[str, int] = {}
+        self._object_names: List[str] = []
+
+        # オペレーション（整数ID k は self.operations の位置）と、その入出力のオブジェクトID。
+        # 入力は (オペレーションごとの開始位置, 入力を連結した列, 各入力が属するオペレーション) で持つ。
+        # k 番目のレコード (operation_id, 入力, 出力) は
+        # (_op_ids[k], _op_inputs[_input_ptr[k]:_input_ptr[k + 1]], _output_owner が k の _op_outputs) にあたる。
+        # オペレーションごとにオブジェクトを作ると、10万件規模では生成とGCだけで validate() が3〜5割遅くなる
+        self._op_ids: List[str] = []
+        self._input_ptr = array("i", [0])
+        self._op_inputs = array("i")
+        self._input_owner = array("i")
+        self._op_outputs = array("i")
+        self._output_owner = array("i")
+
+        # CSR: オブジェクト → 生成/消費するオペレーション
+        self._producer_ptr = array("i", [0])
+        self._producer_ops = array("i")
+        # CSR: オブジェクト → 依存するオブジェクト（出力 → 入力）
+        self._dep_ptr = array("i", [0])
+        self._dep_objs = array("i")
+        # 以下は validate() が常には使わないため、参照されたときに作る
+        # CSR: オブジェクト → 消費するオペレーション
+        self._consumer_csr: Optional[Tuple[array, array]] = None
+        # CSR: オペレーション → 後続オペレーション、および各オペレーションの入次数
+        self._succ_csr: Optional[Tuple[array, array, array]] = None
+
+        # 差分検証（apply_diff）用の索引: operation_id とオブジェクトパスをキーとする
+        self._reset_incremental()
+        self._last_errors: List[ValidationError] = []
+
+    def _reset_incremental(self) -> None:
+        self._inc_ops: Dict[str, Dict] = {}
+        self._inc_position: Dict[str, int] = {}
+        self._inc_next_position = 0
+        # オブジェクト → 生成/消費するオペレーションID → 出現回数
+        self._inc_producers: Dict[str, Dict[str, int]] = {}
+        self._inc_consumers: Dict[str, Dict[str, int]] = {}
+        # オペレーション → 依存する（入力を生成する）オペレーションの数
+        self._inc_in_degree: Dict[str, int] = {}
+        # オブジェクト → そのオブジェクトに関する (エラー, 警告)
+        self._inc_diagnostics: Dict[str, Tuple[List[ValidationError], List[ValidationError]]] = {}
+        self._inc_cycle_errors: List[ValidationError] = []
+        self._inc_primed = False
 
     def load_from_phases(self, phase1_output: dict, phase2_output: dict) -> None:
         """フェーズ1とフェーズ2の出力からデータをロード"""
@@ -76,223 +293,357 @@ class DAGValidator:
 
         # フェーズ2: オペレーション定義結果
         self.operations = phase2_output.get("operations", [])
+        self._reset_incremental()
+
+    def add_initial_objects(self, objects: Iterable[str]) -> None:
+        """初期オブジェクトを追加し、差分検証で保持している診断を更新する（次の validate_incremental() に反映される）"""
+        for obj in objects:
+            self.initial_objects.add(obj)
+            if not self._inc_primed:
+                continue
+            diagnostics = self._diagnose_object(obj)
+            if diagnostics[0] or diagnostics[1]:
+                self._inc_diagnostics[obj] = diagnostics
+            else:
+                self._inc_diagnostics.pop(obj, None)
 
     def build_graph(self) -> None:
-        """オペレーションからDAGを構築"""
-        self.graph.clear()
-        self.producers.clear()
-        self.consumers.clear()
-
-        for op in self.operations:
-            op_id = op.get("operation_id", "unknown")
-            inputs = op.get("input", [])
-            outputs = op.get("output", [])
-
-            # 各出力について、それを生成するオペレーションを記録
-            for out_obj in outputs:
-                if out_obj in self.producers:
-                    # 既に別のオペレーションが同じオブジェクトを生成している（重複）
-                    pass  # エラーは後で検出
-                self.producers[out_obj] = op_id
-
-            # 各入力について、それを消費するオペレーションを記録
-            for in_obj in inputs:
-                self.consumers[in_obj].append(op_id)
-
-                # グラフのエッジを追加: 入力オブジェクト → 出力オブジェクト
-                for out_obj in outputs:
-                    self.graph[out_obj].add(in_obj)
-
-    def detect_cycles(self) -> List[List[str]]:
-        """循環参照を検出（DFSベース）"""
-        visited = set()
-        rec_stack = set()
-        cycles = []
-
-        def dfs(node: str, path: List[str]) -> None:
-            visited.add(node)
-            rec_stack.add(node)
-            path.append(node)
-
-            for neighbor in self.graph.get(node, []):
-                if neighbor not in visited:
-                    dfs(neighbor, path.copy())
-                elif neighbor in rec_stack:
-                    # サイクル検出
-                    cycle_start = path.index(neighbor)
-                    cycles.append(path[cycle_start:] + [neighbor])
-
-            rec_stack.remove(node)
-
-        for obj in self.graph.keys():
-            if obj not in visited:
-                dfs(obj, [])
-
-        return cycles
+        """
+        オペレーションからDAGを構築（整数IDへのインターンとCSR配列の作成）
+
+        validate() が常には使わない索引（消費側のCSR・オペレーション間の依存）は参照されたときに作る。
+        """
+        ids: Dict[str, int] = {}
+        op_ids: List[str] = []
+        input_ptr = array("i", [0])
+        op_inputs, input_owner = array("i"), array("i")
+        op_outputs, output_owner = array("i"), array("i")
+
+        for k, op in enumerate(self.operations):
+            op_ids.append(op.get("operation_id", "unknown"))
+            # オブジェクトの整数IDは初出順（オペレーション順に、入力 → 出力）
+            for name in op.get("input", []):
+                op_inputs.append(ids.setdefault(name, len(ids)))
+                input_owner.append(k)
+            input_ptr.append(len(op_inputs))
+            for name in op.get("output", []):
+                op_outputs.append(ids.setdefault(name, len(ids)))
+                output_owner.append(k)
+
+        self._object_ids = ids
+        self._object_names = list(ids)
+        self._op_ids = op_ids
+        self._input_ptr = input_ptr
+        self._op_inputs, self._input_owner = op_inputs, input_owner
+        self._op_outputs, self._output_owner = op_outputs, output_owner
+        self._producer_ptr, self._producer_ops = _build_csr(len(ids), op_outputs, output_owner)
+
+        # グラフのエッジ: 出力オブジェクト → 入力オブジェクト。
+        # オブジェクトの行は、それを生成するオペレーションの入力を生成順に連結したもの（生成元のCSRから直接作る）
+        dep_ptr, dep_objs = array("i", [0]), array("i")
+        for k in self._producer_ops:
+            dep_objs.extend(op_inputs[input_ptr[k] : input_ptr[k + 1]])
+            dep_ptr.append(len(dep_objs))
+        # 上の dep_ptr は生成元ごとの区切りなので、オブジェクトごとの区切りに間引く
+        self._dep_ptr = array("i", [dep_ptr[i] for i in self._producer_ptr])
+        self._dep_objs = dep_objs
+        self._consumer_csr = None
+        self._succ_csr = None
+
+    def _consumers_csr(self) -> Tuple[array, array]:
+        """CSR: オブジェクト → 消費するオペレーション"""
+        if self._consumer_csr is None:
+            self._consumer_csr = _build_csr(len(self._object_names), self._op_inputs, self._input_owner)
+        return self._consumer_csr
+
+    def _operation_graph(self) -> Tuple[array, array, array]:
+        """オペレーション間の依存（入力を生成するオペレーション → そのオペレーション）のCSRと入次数"""
+        if self._succ_csr is None:
+            producer_ptr, producer_ops = self._producer_ptr, self._producer_ops
+            num_ops = len(self._op_ids)
+            last_seen = [-1] * num_ops
+            in_degree = array("i", bytes(4 * num_ops))
+            rows, cols = array("i"), array("i")
+
+            for obj, k in zip(self._op_inputs, self._input_owner):
+                for i in range(producer_ptr[obj], producer_ptr[obj + 1]):
+                    producer = producer_ops[i]
+                    if producer != k and last_seen[producer] != k:
+                        last_seen[producer] = k
+                        rows.append(producer)
+                        cols.append(k)
+                        in_degree[k] += 1
+
+            self._succ_csr = (*_build_csr(num_ops, rows, cols), in_degree)
+        return self._succ_csr
+
+    # ------------------------------------------------------------------
+    # 互換用ビュー（従来の文字列キーの辞書。参照時に生成する）
+    # ------------------------------------------------------------------
+
+    @property
+    def graph(self) -> Dict[str, Set[str]]:
+        """オブジェクト → 依存するオブジェクト"""
+        names, ptr, deps = self._object_names, self._dep_ptr, self._dep_objs
+        return {
+            names[obj]: {names[deps[i]] for i in range(ptr[obj], ptr[obj + 1])}
+            for obj in range(len(names))
+            if ptr[obj + 1] > ptr[obj]
+        }
+
+    @property
+    def producers(self) -> Dict[str, str]:
+        """オブジェクト → 生成するオペレーションID（重複時は最後のもの）"""
+        names, ptr, ops, op_ids = self._object_names, self._producer_ptr, self._producer_ops, self._op_ids
+        return {names[obj]: op_ids[ops[ptr[obj + 1] - 1]] for obj in range(len(names)) if ptr[obj + 1] > ptr[obj]}
+
+    @property
+    def consumers(self) -> Dict[str, List[str]]:
+        """オブジェクト → 消費するオペレーションID"""
+        names, op_ids = self._object_names, self._op_ids
+        ptr, ops = self._consumers_csr()
+        return {
+            names[obj]: [op_ids[ops[i]] for i in range(ptr[obj], ptr[obj + 1])]
+            for obj in range(len(names))
+            if ptr[obj + 1] > ptr[obj]
+        }
+
+    # ------------------------------------------------------------------
+    # グラフアルゴリズム
+    # ------------------------------------------------------------------
+
+    def detect_cycles(self, max_cycles: Optional[int] = None) -> List[List[str]]:
+        """
+        循環参照を検出（反復版Tarjanの強連結成分分解）
+
+        循環を含む強連結成分ごとに代表的な循環を1つだけ報告する。
+        再帰を使わないため、長い直列プロトコルでも再帰上限に達しない。
+        """
+        if max_cycles is None:
+            max_cycles = self.MAX_REPORTED_CYCLES
+
+        names = self._object_names
+        return [
+            [names[obj] for obj in self._find_cycle_in_component(component)]
+            for component in self._cyclic_components()[:max_cycles]
+        ]
+
+    def _cyclic_components(self) -> List[List[int]]:
+        """
+        循環を含む強連結成分（2ノード以上、または自己ループ）を返す。
+        Tarjanのアルゴリズムを明示的なスタックで反復実装したもの（O(V+E)）。
+        """
+        indptr, targets = self._dep_ptr, self._dep_objs
+        n = len(self._object_names)
+        index = [-1] * n
+        lowlink = [0] * n
+        on_stack = bytearray(n)
+        edge_pos = list(indptr[:-1])
+        stack: List[int] = []
+        components: List[List[int]] = []
+        counter = 0
+
+        for root in range(n):
+            if index[root] != -1:
+                continue
+
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [root]
+
+            while work:
+                node = work[-1]
+                pos = edge_pos[node]
+                if pos < indptr[node + 1]:
+                    edge_pos[node] = pos + 1
+                    neighbor = targets[pos]
+                    if index[neighbor] == -1:
+                        index[neighbor] = lowlink[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack[neighbor] = 1
+                        work.append(neighbor)
+                    elif on_stack[neighbor] and index[neighbor] < lowlink[node]:
+                        lowlink[node] = index[neighbor]
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+
+                if lowlink[node] != index[node]:
+                    continue
+                if stack[-1] == node:
+                    # 単独ノードの成分: 自己ループがある場合のみ循環
+                    stack.pop()
+                    on_stack[node] = 0
+                    if node in targets[indptr[node] : indptr[node + 1]]:
+                        components.append([node])
+                    continue
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+        return components
+
+    def _find_cycle_in_component(self, component: List[int]) -> List[int]:
+        """強連結成分内で、最小名のノードから自身へ戻る最短の循環をBFSで求める"""
+        names, indptr, targets = self._object_names, self._dep_ptr, self._dep_objs
+        members = set(component)
+        start = min(component, key=names.__getitem__)
+        parent: Dict[int, Optional[int]] = {start: None}
+        queue = deque([start])
+
+        while queue:
+            node = queue.popleft()
+            neighbors = targets[indptr[node] : indptr[node + 1]]
+            if start in neighbors:
+                path = [node]
+                while parent[path[-1]] is not None:
+                    path.append(parent[path[-1]])
+                path.reverse()
+                return path + [start]
+            # 報告内容を決定的にするため名前順に辿る
+            for neighbor in sorted(neighbors, key=names.__getitem__) if len(neighbors) > 1 else neighbors:
+                if neighbor in members and neighbor not in parent:
+                    parent[neighbor] = node
+                    queue.append(neighbor)
+
+        return [start, start]  # 到達しない（強連結成分なので必ず戻る経路がある）
 
     def topological_sort(self) -> Tuple[bool, List[str]]:
         """トポロジカルソート（Kahnのアルゴリズム）"""
-        # 入次数を計算
-        in_degree = defaultdict(int)
-        all_nodes = set(self.graph.keys())
-        for node in self.graph:
-            for neighbor in self.graph[node]:
-                in_degree[neighbor] += 1
-                all_nodes.add(neighbor)
+        indptr, targets = self._dep_ptr, self._dep_objs
+        n = len(self._object_names)
+
+        # 入次数を計算（エッジを持つノードのみが対象）
+        in_degree = [0] * n
+        has_edge = bytearray(n)
+        for node in range(n):
+            if indptr[node + 1] > indptr[node]:
+                has_edge[node] = 1
+        for neighbor in targets:
+            in_degree[neighbor] += 1
+            has_edge[neighbor] = 1
 
         # 入次数0のノードをキューに追加
-        queue = deque([node for node in all_nodes if in_degree[node] == 0])
+        queue = deque(node for node in range(n) if has_edge[node] and in_degree[node] == 0)
         sorted_objects = []
 
         while queue:
             node = queue.popleft()
-            sorted_objects.append(node)
-
-            # このノードを出力するオペレーションを実行順序に追加
-            # （ノード=オブジェクト、オペレーションの順序はオブジェクトの順序から導出）
+            sorted_objects.append(self._object_names[node])
 
             # 隣接ノードの入次数を減らす
-            for neighbor in self.graph.get(node, []):
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = targets[i]
                 in_degree[neighbor] -= 1
                 if in_degree[neighbor] == 0:
                     queue.append(neighbor)
 
         # 全てのノードがソートされたか確認
-        success = len(sorted_objects) == len(all_nodes)
+        success = len(sorted_objects) == sum(has_edge)
         return success, sorted_objects
 
     def get_operation_execution_order(self) -> List[str]:
-        """オペレーションの実行順序を取得"""
-        # オペレーションの依存関係を構築
-        op_graph = defaultdict(set)
-        op_in_degree = defaultdict(int)
-
-        # 全オペレーションを初期化
-        for op in self.operations:
-            op_id = op["operation_id"]
-            op_in_degree[op_id] = 0
-
-        # 依存関係を構築
-        for op in self.operations:
-            op_id = op["operation_id"]
-            inputs = op.get("input", [])
-
-            # このオペレーションの入力を生成するオペレーションに依存
-            for in_obj in inputs:
-                if in_obj in self.producers:
-                    producer_op = self.producers[in_obj]
-                    if producer_op != op_id:
-                        if op_id not in op_graph[producer_op]:
-                            op_graph[producer_op].add(op_id)
-                            op_in_degree[op_id] += 1
-
-        # トポロジカルソート
-        queue = deque([op_id for op_id in op_in_degree if op_in_degree[op_id] == 0])
+        """オペレーションの実行順序を取得（オペレーショングラフ上のKahnのアルゴリズム）"""
+        succ_ptr, succ_ops, in_degree = self._operation_graph()
+        in_degree = list(in_degree)
+        op_ids = self._op_ids
+
+        queue = deque(k for k in range(len(op_ids)) if in_degree[k] == 0)
         execution_order = []
 
         while queue:
-            op_id = queue.popleft()
-            execution_order.append(op_id)
+            k = queue.popleft()
+            execution_order.append(op_ids[k])
 
-            for dependent_op in op_graph[op_id]:
-                op_in_degree[dependent_op] -= 1
-                if op_in_degree[dependent_op] == 0:
-                    queue.append(dependent_op)
+            for i in range(succ_ptr[k], succ_ptr[k + 1]):
+                dependent = succ_ops[i]
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
 
         return execution_order
 
+    def _object_flags(self, objects: Set[str]) -> bytearray:
+        """オブジェクトIDごとに、与えられたパス集合に含まれるかを表すフラグ"""
+        flags = bytearray(len(self._object_names))
+        ids = self._object_ids
+        for name in objects:
+            obj = ids.get(name)
+            if obj is not None:
+                flags[obj] = 1
+        return flags
+
     def validate(self) -> ValidationResult:
-        """完全な検証を実行"""
+        """完全な検証を実行
+
+        build_graph() の索引（インターン済みのオペレーションとCSR配列）を1度だけ作り、
+        全ての診断をそこから導出する。メッセージ文字列は to_dict() などで参照されるまで整形しない。
+        """
         errors = []
         warnings = []
 
-        # グラフを構築
+        # グラフを構築（オペレーションを走査するのはここだけ）
         self.build_graph()
+        names = self._object_names
+        ids = self._object_ids
+        op_ids = self._op_ids
+        producer_ptr, producer_ops = self._producer_ptr, self._producer_ops
 
         # 1. 循環参照の検出
-        cycles = self.detect_cycles()
-        if cycles:
-            for cycle in cycles:
-                errors.append(
+        for cycle in self.detect_cycles():
+            errors.append(ValidationError(type="CIRCULAR_DEPENDENCY", details=tuple(cycle)))
+
+        # 2. 入力の検証: 初期オブジェクトでもなく、どのオペレーションでも生成されていない
+        is_initial = self._object_flags(self.initial_objects)
+        for obj, k in zip(self._op_inputs, self._input_owner):
+            if producer_ptr[obj + 1] == producer_ptr[obj] and not is_initial[obj]:
+                errors.append(ValidationError(type="MISSING_INPUT", operation_id=op_ids[k], object_path=names[obj]))
+
+        # 3・5. 出力の未使用・重複出力を1回の走査で検出
+        is_final = self._object_flags(self.final_objects)
+        consumed = set(self._op_inputs)
+        duplicates = []
+        reported = bytearray(len(names))
+        for obj, k in zip(self._op_outputs, self._output_owner):
+            # 最終成果物でもなく、どのオペレーションでも使用されていない
+            if obj not in consumed and not is_final[obj]:
+                warnings.append(ValidationError(type="UNUSED_OUTPUT", operation_id=op_ids[k], object_path=names[obj]))
+            # 複数のオペレーションが生成している（オブジェクトが最初に出力された順に報告）
+            if producer_ptr[obj + 1] - producer_ptr[obj] > 1 and not reported[obj]:
+                reported[obj] = 1
+                duplicates.append(
                     ValidationError(
-                        type="CIRCULAR_DEPENDENCY",
-                        message=f"循環参照が検出されました: {' -> '.join(cycle)}",
-                        suggestion="オペレーションの依存関係を見直し、循環を解消してください。",
+                        type="DUPLICATE_OUTPUT",
+                        object_path=names[obj],
+                        details=tuple(op_ids[producer_ops[i]] for i in range(producer_ptr[obj], producer_ptr[obj + 1])),
                     )
                 )
 
-        # 2. 入力の検証: 全ての入力が生成されているか
-        for op in self.operations:
-            op_id = op["operation_id"]
-            for in_obj in op.get("input", []):
-                # 初期オブジェクトでもなく、どのオペレーションでも生成されていない
-                if in_obj not in self.initial_objects and in_obj not in self.producers:
-                    errors.append(
-                        ValidationError(
-                            type="MISSING_INPUT",
-                            operation_id=op_id,
-                            object_path=in_obj,
-                            message=f"オペレーション '{op_id}' の入力 '{in_obj}' は、どのオペレーションでも生成されていません。",
-                            suggestion=f"'{in_obj}' を生成するオペレーションを追加するか、初期オブジェクトとして定義してください。",
-                        )
-                    )
-
-        # 3. 出力の検証: 全ての出力が使用されているか（最終成果物を除く）
-        for op in self.operations:
-            op_id = op["operation_id"]
-            for out_obj in op.get("output", []):
-                # 最終成果物でもなく、どのオペレーションでも使用されていない
-                if out_obj not in self.final_objects and out_obj not in self.consumers:
-                    warnings.append(
-                        ValidationError(
-                            type="UNUSED_OUTPUT",
-                            operation_id=op_id,
-                            object_path=out_obj,
-                            message=f"オペレーション '{op_id}' の出力 '{out_obj}' は、どのオペレーションでも使用されていません。",
-                            suggestion=f"'{out_obj}' を使用するオペレーションを追加するか、最終成果物として定義してください。",
-                        )
-                    )
-
         # 4. 最終成果物の検証: 全ての最終成果物が生成されているか
         for final_obj in self.final_objects:
-            if final_obj not in self.producers:
-                errors.append(
-                    ValidationError(
-                        type="MISSING_FINAL_OUTPUT",
-                        object_path=final_obj,
-                        message=f"最終成果物 '{final_obj}' を生成するオペレーションがありません。",
-                        suggestion=f"'{final_obj}' を出力として生成するオペレーションを追加してください。",
-                    )
-                )
+            obj = ids.get(final_obj)
+            if obj is None or producer_ptr[obj + 1] == producer_ptr[obj]:
+                errors.append(ValidationError(type="MISSING_FINAL_OUTPUT", object_path=final_obj))
 
-        # 5. 重複出力の検証
-        output_count = defaultdict(list)
-        for op in self.operations:
-            op_id = op["operation_id"]
-            for out_obj in op.get("output", []):
-                output_count[out_obj].append(op_id)
+        errors.extend(duplicates)
 
-        for obj, producers in output_count.items():
-            if len(producers) > 1:
-                errors.append(
-                    ValidationError(
-                        type="DUPLICATE_OUTPUT",
-                        object_path=obj,
-                        message=f"オブジェクト '{obj}' が複数のオペレーションで生成されています: {', '.join(producers)}",
-                        suggestion="各オブジェクトは1つのオペレーションのみで生成されるべきです。重複を解消してください。",
-                    )
-                )
-
-        # 6. 実行順序の取得
-        execution_order = self.get_operation_execution_order()
-        if not errors and len(execution_order) != len(self.operations):
-            errors.append(
-                ValidationError(
-                    type="TOPOLOGICAL_SORT_FAILED",
-                    message="オペレーションの実行順序を決定できませんでした。循環参照または孤立したオペレーションが存在する可能性があります。",
-                    suggestion="オペレーション間の依存関係を確認してください。",
-                )
-            )
+        # 6. 実行順序の取得（エラーがあれば結果に含めないため、求めない）
+        # operation_id が重複していると実行順序の中でオペレーションを区別できないため、順序を決定できなかったものとする
+        execution_order = [] if errors else self.get_operation_execution_order()
+        if not errors and (len(execution_order) != len(op_ids) or len(set(op_ids)) != len(op_ids)):
+            errors.append(ValidationError(type="TOPOLOGICAL_SORT_FAILED"))
 
         # 結果を返す
         valid = len(errors) == 0
@@ -303,6 +654,227 @@ class DAGValidator:
             execution_order=execution_order if valid else [],
         )
 
+    # ------------------------------------------------------------------
+    # 差分検証
+    # ------------------------------------------------------------------
+
+    def validate_incremental(self, operations: List[Dict]) -> ValidationDelta:
+        """
+        新しいオペレーション一覧を、前回の一覧との差分だけ反映して再検証する。
+        初回はすべてのオペレーションが追加扱いになる。
+        """
+        op_ids = [_operation_id(op) for op in operations]
+        if len(set(op_ids)) != len(op_ids):
+            # operation_id が重複していると差分を対応付けられないため、全体を検証し直す
+            diff = diff_operations(list(self._inc_ops.values()), operations)
+            self._reset_incremental()
+            self.operations = operations
+            return self._make_delta(self.validate(), diff)
+        return self.apply_diff(diff_operations(list(self._inc_ops.values()), operations))
+
+    def apply_diff(self, diff: OperationDiff) -> ValidationDelta:
+        """
+        オペレーションの追加・削除・変更を索引に反映し、影響を受けたオブジェクトの診断だけを更新する。
+        フェーズ1のオブジェクト定義（初期オブジェクト・最終成果物）は変わらないものとする。
+        """
+        touched_objects: Set[str] = set()
+        touched_ops: Set[str] = set()
+        if not self._inc_primed:
+            # どのオペレーションにも現れない最終成果物も診断対象にする
+            touched_objects.update(self.final_objects)
+            self._inc_primed = True
+
+        for op_id in diff.removed:
+            if op_id in self._inc_ops:
+                self._unlink_operation(self._inc_ops.pop(op_id), touched_objects)
+                del self._inc_position[op_id]
+                del self._inc_in_degree[op_id]
+        for op in diff.changed:
+            op_id = _operation_id(op)
+            if op_id in self._inc_ops:
+                self._unlink_operation(self._inc_ops[op_id], touched_objects)
+        new_edges = diff.added + diff.changed
+        for op in new_edges:
+            op_id = _operation_id(op)
+            if op_id not in self._inc_position:
+                self._inc_position[op_id] = self._inc_next_position
+                self._inc_next_position += 1
+            self._inc_ops[op_id] = op
+            self._link_operation(op, touched_objects)
+            touched_ops.add(op_id)
+
+        # 生成元が変わったオブジェクトを入力とするオペレーションの入次数を更新
+        for obj in touched_objects:
+            touched_ops.update(self._inc_consumers.get(obj, ()))
+        for op_id in touched_ops:
+            if op_id in self._inc_ops:
+                self._inc_in_degree[op_id] = len(self._operation_dependencies(op_id))
+
+        for obj in touched_objects:
+            diagnostics = self._diagnose_object(obj)
+            if diagnostics[0] or diagnostics[1]:
+                self._inc_diagnostics[obj] = diagnostics
+            else:
+                self._inc_diagnostics.pop(obj, None)
+
+        self.operations = list(self._inc_ops.values())
+        # 循環は追加されたエッジを含む場合にのみ新たに生じる
+        if self._inc_cycle_errors or self._may_close_cycle(new_edges):
+            self.build_graph()
+            self._inc_cycle_errors = [
+                ValidationError(type="CIRCULAR_DEPENDENCY", details=tuple(cycle)) for cycle in self.detect_cycles()
+            ]
+
+        return self._make_delta(self._incremental_result(), diff)
+
+    def _link_operation(self, op: Dict, touched_objects: Set[str]) -> None:
+        op_id = _operation_id(op)
+        for obj in op.get("input", []):
+            consumers = self._inc_consumers.setdefault(obj, {})
+            consumers[op_id] = consumers.get(op_id, 0) + 1
+            touched_objects.add(obj)
+        for obj in op.get("output", []):
+            producers = self._inc_producers.setdefault(obj, {})
+            producers[op_id] = producers.get(op_id, 0) + 1
+            touched_objects.add(obj)
+
+    def _unlink_operation(self, op: Dict, touched_objects: Set[str]) -> None:
+        op_id = _operation_id(op)
+        for index, key in ((self._inc_consumers, "input"), (self._inc_producers, "output")):
+            for obj in op.get(key, []):
+                entries = index[obj]
+                entries[op_id] -= 1
+                if entries[op_id] == 0:
+                    del entries[op_id]
+                if not entries:
+                    del index[obj]
+                touched_objects.add(obj)
+
+    def _operation_dependencies(self, op_id: str) -> Dict[str, None]:
+        """入力を生成するオペレーション（自身を除く、重複なし）"""
+        producers = self._inc_producers
+        return {
+            producer: None
+            for obj in self._inc_ops[op_id].get("input", [])
+            for producer in producers.get(obj, ())
+            if producer != op_id
+        }
+
+    def _diagnose_object(self, obj: str) -> Tuple[List[ValidationError], List[ValidationError]]:
+        """1オブジェクトの生成元・消費先から validate() と同じ診断を導出する"""
+        producers = self._inc_producers.get(obj, {})
+        consumers = self._inc_consumers.get(obj, {})
+        errors: List[ValidationError] = []
+        warnings: List[ValidationError] = []
+
+        if not producers:
+            if obj not in self.initial_objects:
+                for op_id, count in consumers.items():
+                    errors += [
+                        ValidationError(type="MISSING_INPUT", operation_id=op_id, object_path=obj) for _ in range(count)
+                    ]
+            if obj in self.final_objects:
+                errors.append(ValidationError(type="MISSING_FINAL_OUTPUT", object_path=obj))
+        elif sum(producers.values()) > 1:
+            ordered = sorted(producers, key=self._inc_position.__getitem__)
+            details = tuple(op_id for op_id in ordered for _ in range(producers[op_id]))
+            errors.append(ValidationError(type="DUPLICATE_OUTPUT", object_path=obj, details=details))
+
+        if not consumers and obj not in self.final_objects:
+            for op_id, count in producers.items():
+                warnings += [
+                    ValidationError(type="UNUSED_OUTPUT", operation_id=op_id, object_path=obj) for _ in range(count)
+                ]
+        return errors, warnings
+
+    def _may_close_cycle(self, operations: List[Dict]) -> bool:
+        """
+        追加・変更されたオペレーションの入力から依存関係を遡り、いずれかの出力に到達するかを調べる。
+        到達しなければ新しい循環はない（到達した場合は全体の循環検出で確認する）。
+        """
+        targets = {obj for op in operations for obj in op.get("output", [])}
+        stack = [obj for op in operations for obj in op.get("input", [])]
+        visited = set(stack)
+        while stack:
+            obj = stack.pop()
+            if obj in targets:
+                return True
+            for producer in self._inc_producers.get(obj, ()):
+                for dep in self._inc_ops[producer].get("input", []):
+                    if dep not in visited:
+                        visited.add(dep)
+                        stack.append(dep)
+        return False
+
+    def _incremental_result(self) -> ValidationResult:
+        """索引に保持している診断から ValidationResult を組み立てる"""
+        position = self._inc_position
+
+        def sort_key(error: ValidationError) -> tuple:
+            if error.operation_id is not None:
+                order = position[error.operation_id]
+            elif error.details:
+                order = position[error.details[0]]
+            else:
+                order = -1
+            return (_ERROR_ORDER[error.type], order, error.object_path or "")
+
+        errors = sorted((e for errs, _ in self._inc_diagnostics.values() for e in errs), key=sort_key)
+        warnings = sorted(
+            (w for _, warns in self._inc_diagnostics.values() for w in warns),
+            key=lambda w: (position[w.operation_id], w.object_path),
+        )
+        errors = self._inc_cycle_errors + errors
+
+        execution_order: List[str] = []
+        if not errors:
+            execution_order = self._incremental_execution_order()
+            if len(execution_order) != len(self._inc_ops):
+                errors.append(ValidationError(type="TOPOLOGICAL_SORT_FAILED"))
+
+        valid = len(errors) == 0
+        return ValidationResult(
+            valid=valid,
+            errors=errors,
+            warnings=warnings,
+            execution_order=execution_order if valid else [],
+        )
+
+    def _incremental_execution_order(self) -> List[str]:
+        """保持している入次数を使ったKahnのアルゴリズム"""
+        in_degree = dict(self._inc_in_degree)
+        position = self._inc_position
+        queue = deque(sorted((k for k, d in in_degree.items() if d == 0), key=position.__getitem__))
+        execution_order = []
+
+        while queue:
+            op_id = queue.popleft()
+            execution_order.append(op_id)
+            successors = {
+                consumer: None
+                for obj in self._inc_ops[op_id].get("output", [])
+                for consumer in self._inc_consumers.get(obj, ())
+                if consumer != op_id
+            }
+            for dependent in sorted(successors, key=position.__getitem__):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+
+        return execution_order
+
+    def _make_delta(self, result: ValidationResult, diff: OperationDiff) -> ValidationDelta:
+        """前回の検証結果と比べて、解消されたエラーと新たに生じたエラーを求める"""
+        previous = {_error_key(e): e for e in self._last_errors}
+        current = {_error_key(e): e for e in result.errors}
+        self._last_errors = result.errors
+        return ValidationDelta(
+            result=result,
+            resolved=[e for key, e in previous.items() if key not in current],
+            introduced=[e for key, e in current.items() if key not in previous],
+            diff=diff,
+        )
+
 
 def main():
     """使用例"""
@@ -0,0 +1,253 @@
+"""
+段ごとにワーカープールとキューを持つパイプラインスケジューラ
+
+タスクの処理（参考文献取得 → フェーズ1.1 → 1.2 → フェーズ2+検証 → フェーズ3）を段に分け、
+段ごとに同時実行数を設定する。あるタスクがフェーズ3を実行している間に、
+別のタスクが参考文献を取得したりフェーズ1を実行したりできる。
+段の間のキューは容量付きで、下流が詰まると上流のワーカーが待つ（バックプレッシャー）。
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 段の間のキュー容量の既定値（下流の同時実行数に対する倍率）
+DEFAULT_QUEUE_FACTOR = 2
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    """パイプラインの1段"""
+
+    name: str
+    fn: Callable[[Any], Any]
+    concurrency: int = 1
+    queue_size: Optional[int] = None  # None の場合は concurrency * DEFAULT_QUEUE_FACTOR
+
+
+@dataclass
+class StageMetrics:
+    """1段分の計測値"""
+
+    name: str
+    workers: int
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    blocked_seconds: float = 0.0  # 下流のキューが満杯で待った時間
+    max_queue_depth: int = 0
+    mean_queue_depth: float = 0.0
+    utilization: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "max_queue_depth": self.max_queue_depth,
+            "mean_queue_depth": round(self.mean_queue_depth, 3),
+            "utilization": round(self.utilization, 3),
+        }
+
+
+class _MeteredQueue(queue.Queue):
+    """
+    キューの深さを時間加重で記録する容量付きキュー。
+    深さは queue.Queue の _put / _get（キュー自身のロックの内側）で数えるため、実際の要素数と常に一致する
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._max_depth = 0
+        self._area = 0.0
+        self._last_change = time.monotonic()
+
+    def _record(self, change: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._area += self._depth * (now - self._last_change)
+            self._last_change = now
+            self._depth += change
+            self._max_depth = max(self._max_depth, self._depth)
+
+    def _put(self, item) -> None:
+        super()._put(item)
+        if item is not _STOP:
+            self._record(+1)
+
+    def _get(self):
+        item = super()._get()
+        if item is not _STOP:
+            self._record(-1)
+        return item
+
+    def snapshot(self, elapsed: float) -> Tuple[int, float]:
+        """(最大深さ, 平均深さ)"""
+        with self._lock:
+            area = self._area + self._depth * (time.monotonic() - self._last_change)
+            return self._max_depth, area / elapsed if elapsed > 0 else 0.0
+
+
+class StagePipeline:
+    """
+    段ごとのワーカープールでアイテムを流すパイプライン。
+
+    各段の関数はアイテムを受け取り、次の段へ渡すアイテムを返す。
+    例外が発生したアイテムは on_error(item, exc) の戻り値を結果として、以降の段をスキップする。
+    on_error 自身が例外を送出した場合は、残りのアイテムを処理し終えてから run() がその例外を送出する。
+    """
+
+    def __init__(self, stages: List[Stage], on_error: Callable[[Any, Exception], Any]):
+        if not stages:
+            raise ValueError("pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+        self._queues = [
+            _MeteredQueue(stage.queue_size or max(1, stage.concurrency) * DEFAULT_QUEUE_FACTOR) for stage in stages
+        ]
+        self._metrics = [StageMetrics(name=stage.name, workers=max(1, stage.concurrency)) for stage in stages]
+        self._metrics_lock = threading.Lock()
+        self._results: queue.Queue = queue.Queue()
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+
+    def _worker(self, index: int) -> None:
+        stage, metrics = self.stages[index], self._metrics[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            entry = inbox.get()
+            if entry is _STOP:
+                return
+            position, item = entry
+
+            started = time.monotonic()
+            error = None
+            try:
+                output = stage.fn(item)
+                failed = False
+            except Exception as e:
+                failed = True
+                try:
+                    output = self.on_error(item, e)
+                except Exception as handler_error:
+                    # ワーカーを止めずにアイテムを結果へ回し、run() で送出する
+                    output, error = None, handler_error
+            busy = time.monotonic() - started
+
+            blocked = 0.0
+            if failed or outbox is None:
+                self._results.put((position, output, error))
+            else:
+                # 下流のキューが満杯ならここで待つ（バックプレッシャー）
+                waiting_since = time.monotonic()
+                outbox.put((position, output))
+                blocked = time.monotonic() - waiting_since
+
+            with self._metrics_lock:
+                metrics.processed += 1
+                metrics.failed += int(failed)
+                metrics.busy_seconds += busy
+                metrics.blocked_seconds += blocked
+
+    def run(self, items: Iterable[Any], on_result: Optional[Callable[[Any], None]] = None) -> List[Any]:
+        """
+        全アイテムを処理し、入力順の結果リストを返す。
+        on_result は各アイテムの処理が終わった時点で（完了順に）呼ばれる。
+        """
+        items = list(items)
+        self._started = time.monotonic()
+
+        workers = []
+        for index, stage in enumerate(self.stages):
+            for _ in range(max(1, stage.concurrency)):
+                thread = threading.Thread(target=self._worker, args=(index,), daemon=True)
+                thread.start()
+                workers.append((index, thread))
+
+        # 先頭の段のキューも容量付きなので、投入もバックプレッシャーを受ける
+        feeder = threading.Thread(
+            target=lambda: [self._queues[0].put((position, item)) for position, item in enumerate(items)],
+            daemon=True,
+        )
+        feeder.start()
+
+        results: List[Any] = [None] * len(items)
+        first_error: Optional[Exception] = None
+        for _ in range(len(items)):
+            position, output, error = self._results.get()
+            if error is not None:
+                first_error = first_error or error
+                continue
+            results[position] = output
+            if on_result:
+                on_result(output)
+
+        feeder.join()
+        for index, _thread in workers:
+            self._queues[index].put(_STOP)
+        for _index, thread in workers:
+            thread.join()
+
+        self._finished = time.monotonic()
+        if first_error is not None:
+            raise first_error
+        return results
+
+    def metrics(self) -> List[StageMetrics]:
+        """段ごとの計測値（キューの深さは実行時間全体の時間加重平均）"""
+        end = self._finished or time.monotonic()
+        elapsed = end - self._started if self._started is not None else 0.0
+        with self._metrics_lock:
+            snapshot = []
+            for metrics, inbox in zip(self._metrics, self._queues):
+                max_depth, mean_depth = inbox.snapshot(elapsed)
+                utilization = metrics.busy_seconds / (metrics.workers * elapsed) if elapsed > 0 else 0.0
+                snapshot.append(
+                    StageMetrics(
+                        name=metrics.name,
+                        workers=metrics.workers,
+                        processed=metrics.processed,
+                        failed=metrics.failed,
+                        busy_seconds=metrics.busy_seconds,
+                        blocked_seconds=metrics.blocked_seconds,
+                        max_queue_depth=max_depth,
+                        mean_queue_depth=mean_depth,
+                        utilization=utilization,
+                    )
+                )
+            return snapshot
+
+
+def format_metrics(metrics: List[StageMetrics]) -> str:
+    """段ごとの計測値を表形式の文字列にする（キューが深く稼働率が高い段がボトルネック）"""
+    lines = [
+        f"{'stage':<12} {'workers':>7} {'done':>6} {'failed':>6} {'util':>6} {'queue avg/max':>14} {'blocked s':>10}"
+    ]
+    for m in metrics:
+        lines.append(
+            f"{m.name:<12} {m.workers:>7} {m.processed:>6} {m.failed:>6} {m.utilization:>6.0%} "
+            f"{m.mean_queue_depth:>8.2f}/{m.max_queue_depth:<5} {m.blocked_seconds:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_stage_limits(spec: str) -> Dict[str, int]:
+    """段ごとの同時実行数の指定（例: "fetch=8,procedure=2"）を段名 → 同時実行数の辞書にする"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        if not value:
+            raise ValueError(f"invalid stage limit: {part!r} (expected name=count)")
+        limits[name.strip()] = int(value)
+    return limits
@@ -1,16 +1,16 @@
 """
 Prompts for the 3-phase Experiment Planning Agent.
+
+各プロンプトは、タスクによらない指示・出力形式を先頭に、タスク固有の入力情報を末尾に置く。
+プロンプトの先頭が呼び出し間で一致するほど、プロバイダのプレフィックスキャッシュが効く
+（OpenAI は 1024 tokens 以上の一致した先頭部分をキャッシュする）。
+参考文献・フィードバックなど呼び出しごとに変わる部分は、さらにその後ろに追記すること。
 """
 
 PHASE1_DESIGN_PROMPT = """
 あなたは生命科学実験の専門家です。
 与えられた「実験指示」と「必須物品」から、実験の論理的なデザイン（Experimental Design）を抽出してください。
 
-## 入力情報
-実験指示: {instruction}
-必須物品: {mandatory_objects}
-元プロトコル（参考）: {source_protocol}
-
 ## タスク
 実験の構成要素を論理的に整理してください。
 1. **比較条件**: 何と何を比較するのか（例：濃度系列、時間経過、処理の有無）。
@@ -27,16 +27,17 @@ PHASE1_DESIGN_PROMPT = """
     "sample_logic": "説明..."
   }}
 }}
+
+## 入力情報
+実験指示: {instruction}
+必須物品: {mandatory_objects}
+元プロトコル（参考）: {source_protocol}
 """
 
 PHASE1_OBJECTS_PROMPT = """
 あなたは生命科学実験の専門家です。
 「実験デザイン」と「必須物品」に基づき、この実験で使用・生成されるすべての「オブジェクト（物質、サンプル、データ）」を具体的に定義してください。
 
-## 入力情報
-実験デザイン: {experimental_design}
-必須物品: {mandatory_objects}
-
 ## タスク
 実験デザインを実現するために必要な物理的なオブジェクトを網羅してください。
 1. **初期オブジェクト (initial)**: 実験開始時に存在する試薬、器具、サンプル。
@@ -58,17 +59,16 @@ PHASE1_OBJECTS_PROMPT = """
     "final": ["objects/final/result_data", ...]
   }}
 }}
+
+## 入力情報
+実験デザイン: {experimental_design}
+必須物品: {mandatory_objects}
 """
 
 PHASE2_OP_DEF_PROMPT = """
 あなたは生命科学実験の専門家です。
 実験の「オブジェクトリスト」と「指示」に基づき、実験操作の流れ（オペレーション）を定義してください。
 
-## 入力情報
-実験指示: {instruction}
-オブジェクトリスト: {identified_objects}
-元プロトコル（参考）: {source_protocol}
-
 ## タスク
 実験を構成する一連の「オペレーション」を定義してください。
 各オペレーションは、入力オブジェクトを受け取り、出力オブジェクトを生成する処理です。
@@ -84,17 +84,17 @@ PHASE2_OP_DEF_PROMPT = """
 - text_description: 操作の簡潔な説明 (例: "試薬AとBを混合する")
 - input: 入力オブジェクトのIDリスト
 - output: 出力オブジェクトのIDリスト
+
+## 入力情報
+実験指示: {instruction}
+オブジェクトリスト: {identified_objects}
+元プロトコル（参考）: {source_protocol}
 """
 
 PHASE3_PROC_GEN_PROMPT = """
 あなたは生命科学実験の専門家です。
 定義された「オペレーションフロー」に基づき、学部生が実行可能な詳細な「実験手順書」を作成してください。
 
-## 入力情報
-実験指示: {instruction}
-オペレーションフロー: {operations}
-参考文献: {references}
-
 ## タスク
 自然言語による詳細な実験手順（ステップのリスト）を生成してください。
 
@@ -109,22 +109,66 @@ PHASE3_PROC_GEN_PROMPT = """
 4. **フォーマット**:
    - ステップIDは1から始まる連番。
    - テキストは日本語で記述。
+   - JSON形式 {{"procedure_steps": [{{"id": 1, "text": "..."}}, ...]}} で出力すること。
 
 ## 出力例
 ステップ1: 1.5 mLマイクロチューブを2本用意し、それぞれに「Sample A」「Sample B」とラベルを貼る。
 ステップ2: Sample Aのチューブに、試薬X (10 mM) を 50 µL、試薬Y (5 mM) を 50 µL 加え、ボルテックスで5秒間撹拌する。
 ...
+
+## 入力情報
+実験指示: {instruction}
+オペレーションフロー: {operations}
+参考文献: {references}
 """
 
-FEEDBACK_PROMPT = """
-前回の出力には以下の論理的エラー（DAG不整合など）がありました。
-これらを修正して、再度オペレーションを定義してください。
+# フェーズ3の出力から手順を読み取れなかったときに、プロンプトの末尾に付けて再生成する
+PHASE3_RETRY_NOTE = """
+
+## 前回の出力について
+手順を読み取れませんでした。{"procedure_steps": [{"id": 1, "text": "..."}]} の形式の JSON で、ステップを1つ以上出力してください。
+"""
+
+PHASE2_PATCH_PROMPT = """
+あなたは生命科学実験の専門家です。
+検証でエラーが見つかった「現在のオペレーション一覧」を、差分（パッチ）だけで修正してください。
+
+## タスク
+エラーを解消するのに必要なオペレーションだけを追加・削除・置換してください。
+オペレーション一覧全体を出力し直す必要はありません。
+
+## 制約
+- エラーに関係しないオペレーションは変更しないこと（パッチに含めない）。
+- 修正後もオペレーションは有向非巡回グラフ (DAG) を構成し、すべての「最終オブジェクト」が生成されること。
+- 追加・置換するオペレーションの形式は元のオペレーションと同じ（operation_id, text_description, input, output）。
+- 置換するオペレーションは operation_id で対象を指定し、オペレーション全体を書くこと。
+
+## 出力フォーマット (JSON)
+{{
+  "add_operations": [{{"operation_id": "...", "text_description": "...", "input": [...], "output": [...]}}],
+  "remove_operation_ids": ["..."],
+  "replace_operations": [{{"operation_id": "...", "text_description": "...", "input": [...], "output": [...]}}]
+}}
+
+## 入力情報
+実験指示: {instruction}
+オブジェクトリスト: {identified_objects}
+現在のオペレーション一覧: {operations}
 
 ## エラー内容
 {feedback}
+"""
+
+FEEDBACK_PROMPT = """
+## 修正依頼
+前回の出力には論理的エラー（DAG不整合など）がありました。
+以下のエラー内容を修正して、再度オペレーションを定義してください。
 
 ## 修正のヒント
 - 入力オブジェクトが存在しない場合は、それを作成する前のステップを追加するか、初期オブジェクトを確認してください。
 - 循環参照がある場合は、順序を見直してください。
 - 未使用の必須オブジェクトがある場合は、それを使用するステップを追加してください。
+
+## エラー内容
+{feedback}
 """
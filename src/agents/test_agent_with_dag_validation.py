@@ -0,0 +1,164 @@
+"""
+エージェントのフェーズ2修正ループ（局所修復・パッチ修正・全体再生成へのフォールバック）とフェーズ3の出力制約のテスト
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+from agents.agent_with_dag_validation import ExperimentPlanningAgent
+
+PHASE1 = {
+    "identified_objects": {
+        "initial": ["objects/initial/stock.reagent"],
+        "intermediate": [],
+        "final": ["objects/final/result.data"],
+    }
+}
+INPUT = {"id": "t1", "input": {"instruction": "x", "mandatory_objects": []}}
+
+DILUTE = {
+    "operation_id": "dilute",
+    "input": ["objects/initial/stock.reagent"],
+    "output": ["objects/intermediate/diluted.sample"],
+}
+MEASURE = {
+    "operation_id": "measure",
+    "input": ["objects/intermediate/diluted.sample"],
+    "output": ["objects/final/result.data"],
+}
+
+
+def make_agent(tmp_path, responses, **kwargs):
+    """フェーズ名 → 応答（呼び出しごとに先頭から取り出す）で LLM を置き換えたエージェント"""
+    agent = ExperimentPlanningAgent(api_key="test", workspace_dir=str(tmp_path), **kwargs)
+    calls = []
+
+    def fake_call_llm(system_prompt, user_prompt, response_format=None, ctx=None, phase=None, temperature=0.2):
+        calls.append(phase)
+        return responses[phase.split("-attempt")[0]].pop(0)
+
+    agent._call_llm = fake_call_llm
+    return agent, calls
+
+
+def test_patch_repair_fixes_missing_input(tmp_path):
+    """2回目以降はパッチだけを出力させ、手元で適用した計画を再検証する"""
+    agent, calls = make_agent(
+        tmp_path,
+        {"2": [{"operations": [MEASURE]}], "2-patch": [{"add_operations": [DILUTE]}]},
+    )
+    ctx = agent.create_context("t1")
+    result, validation = agent.validate_with_retry(ctx, INPUT, PHASE1)
+
+    assert calls == ["2-attempt-1", "2-patch-attempt-2"]
+    assert validation.valid and validation.execution_order == ["dilute", "measure"]
+    assert [op["operation_id"] for op in result["operations"]] == ["measure", "dilute"]
+    assert (ctx.workspace_dir / "2_patch_attempt_2.json").exists()
+
+
+def test_non_converging_patch_falls_back_to_full_regeneration(tmp_path):
+    """パッチでエラーが減らなければ適用前の計画に戻し、次の試行で全体を再生成する"""
+    stray = {"operation_id": "stray", "input": ["objects/intermediate/missing.sample"], "output": []}
+    agent, calls = make_agent(
+        tmp_path,
+        {
+            "2": [{"operations": [MEASURE]}, {"operations": [DILUTE, MEASURE]}],
+            "2-patch": [{"add_operations": [stray]}],
+        },
+        max_retries=3,
+    )
+    ctx = agent.create_context("t1")
+    result, validation = agent.validate_with_retry(ctx, INPUT, PHASE1)
+
+    assert calls == ["2-attempt-1", "2-patch-attempt-2", "2-attempt-3"]
+    assert validation.valid and result["operations"] == [DILUTE, MEASURE]
+
+
+def test_full_repair_mode_regenerates(tmp_path):
+    agent, calls = make_agent(
+        tmp_path, {"2": [{"operations": [MEASURE]}, {"operations": [DILUTE, MEASURE]}]}, repair_mode="full"
+    )
+    _, validation = agent.validate_with_retry(agent.create_context("t1"), INPUT, PHASE1)
+    assert calls == ["2-attempt-1", "2-attempt-2"] and validation.valid
+
+
+def test_local_repair_avoids_llm_round_trip(tmp_path):
+    """機械的に直せるエラーはLLMを呼ばずに修復し、省けた再試行を数える"""
+    typo = {**MEASURE, "input": ["objects/intermediate/diluted_sample"]}
+    agent, calls = make_agent(tmp_path, {"2": [{"operations": [DILUTE, typo]}]})
+    ctx = agent.create_context("t1")
+    result, validation = agent.validate_with_retry(ctx, INPUT, PHASE1)
+
+    assert calls == ["2-attempt-1"]
+    assert validation.valid and result["operations"] == [DILUTE, MEASURE]
+    assert (ctx.workspace_dir / "2_repairs.json").exists()
+    metrics = agent.repair_metrics()
+    assert (metrics["failed_validations"], metrics["avoided_round_trips"], metrics["avoided_rate"]) == (1, 1, 1.0)
+
+
+def test_speculative_candidates_first_valid_wins(tmp_path):
+    """候補を並行に生成し、最初に検証に通った候補を採用して、遅い候補の完了を待たない"""
+    agent = ExperimentPlanningAgent(api_key="test", workspace_dir=str(tmp_path), phase2_candidates=3)
+    plans = {0.2: ([MEASURE], 0.05), 0.6: ([DILUTE, MEASURE], 0.1), 1.0: ([DILUTE, MEASURE], 2.0)}
+    finished = threading.Event()
+
+    def fake_call_llm(system_prompt, user_prompt, response_format=None, ctx=None, phase=None, temperature=0.2):
+        operations, delay = plans[temperature]
+        time.sleep(delay)
+        if temperature == 1.0:
+            finished.set()
+        return {"operations": operations}
+
+    agent._call_llm = fake_call_llm
+    started = time.perf_counter()
+    result, validation = agent.validate_with_retry(agent.create_context("t1"), INPUT, PHASE1)
+
+    assert validation.valid and result["operations"] == [DILUTE, MEASURE]
+    assert time.perf_counter() - started < 1.0 and not finished.is_set()
+    assert agent.speculation_metrics() == {
+        "rounds": 1,
+        "valid_rounds": 1,
+        "candidates_validated": 2,
+        "candidates_discarded": 1,
+    }
+
+
+def test_speculative_fewest_errors_seeds_feedback(tmp_path):
+    """どの候補も検証に通らなければ、エラーの最も少ない候補をパッチ修正の元にする"""
+    agent = ExperimentPlanningAgent(
+        api_key="test", workspace_dir=str(tmp_path), phase2_candidates=2, local_repair=False
+    )
+    stray = {"operation_id": "stray", "input": ["objects/intermediate/missing.sample"], "output": []}
+    plans = {0.2: [MEASURE, stray], 1.0: [MEASURE]}
+    calls = []
+
+    def fake_call_llm(system_prompt, user_prompt, response_format=None, ctx=None, phase=None, temperature=0.2):
+        calls.append(phase)
+        if phase.startswith("2-patch"):
+            assert '"stray"' not in user_prompt
+            return {"add_operations": [DILUTE]}
+        return {"operations": plans[temperature]}
+
+    agent._call_llm = fake_call_llm
+    result, validation = agent.validate_with_retry(agent.create_context("t1"), INPUT, PHASE1)
+
+    assert sorted(calls) == ["2-attempt-1", "2-attempt-1", "2-patch-attempt-2"]
+    assert validation.valid and result["operations"] == [MEASURE, DILUTE]
+
+
+def test_phase3_fixes_constraints_locally_and_recalls_only_when_unusable(tmp_path):
+    """出力制約の違反は手元で直し、手順を読み取れない出力のときだけ再生成する"""
+    steps = [{"id": i, "text": f"操作{i}を行う。"} for i in range(1, 56)]
+    agent, calls = make_agent(tmp_path, {"3": [{"procedure": "..."}, {"procedure_steps": steps}]})
+    ctx = agent.create_context("t1")
+    validation = SimpleNamespace(execution_order=[])  # 実行順序だけを使う
+    result = agent.phase3_generate_procedure(ctx, INPUT, PHASE1, {"operations": []}, validation, "")
+
+    assert calls == ["3", "3-attempt-2"]
+    assert len(result["procedure_steps"]) == 50 and result["procedure_steps"][0]["text"] == "操作1を行う。操作2を行う。"
+    assert (ctx.workspace_dir / "3_constraint_fixes.json").exists()
+    assert agent.constraint_metrics() == {"outputs_checked": 2, "fixed_locally": 1, "llm_recalls": 1}
@@ -0,0 +1,82 @@
+"""
+DAG検証エラーの局所修復（dag_repair）のテスト
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from agents.dag_repair import DAGRepairer
+from agents.dag_validator import DAGValidator
+
+
+def repair(initial, final, operations, mandatory=()):
+    validator = DAGValidator()
+    validator.load_from_phases({"identified_objects": {"initial": initial, "final": final}}, {})
+    delta = validator.validate_incremental(operations)
+    assert not delta.result.valid
+    return DAGRepairer(validator, mandatory).repair(operations, delta)
+
+
+def op(op_id, inputs, outputs):
+    return {"operation_id": op_id, "text_description": op_id, "input": inputs, "output": outputs}
+
+
+def test_near_match_input_and_mandatory_object():
+    """入力名のゆれは既存の名前に合わせ、必須物品と一致する入力は初期オブジェクトとして扱う"""
+    result = repair(
+        ["objects/initial/buffer.reagent"],
+        ["objects/final/result.data"],
+        [
+            op(
+                "mix", ["objects/initial/Buffer_reagent", "objects/initial/伸び計"], ["objects/intermediate/mix.sample"]
+            ),
+            op("measure", ["objects/intermediate/mix-sample"], ["objects/final/result.data"]),
+        ],
+        mandatory=["伸び計（非接触または接触式）"],
+    )
+
+    assert result.delta.result.valid
+    assert [(r.rule, r.old, r.new) for r in result.rewrites] == [
+        ("match_input", "objects/initial/Buffer_reagent", "objects/initial/buffer.reagent"),
+        ("declare_initial", "objects/initial/伸び計", "伸び計（非接触または接触式）"),
+        ("match_input", "objects/intermediate/mix-sample", "objects/intermediate/mix.sample"),
+    ]
+    assert result.declared_initial == ["objects/initial/伸び計"]
+    assert result.operations[1]["input"] == ["objects/intermediate/mix.sample"]
+
+
+def test_final_output_suffix_and_duplicate_versioning():
+    """接尾辞だけが違う出力は最終成果物の名前にし、重複出力は版番号を付けて消費先を付け替える"""
+    sample = "objects/intermediate/wash.sample"
+    result = repair(
+        ["objects/initial/cells.sample"],
+        ["objects/final/image.tiff"],
+        [
+            op("wash1", ["objects/initial/cells.sample"], [sample]),
+            op("stain", [sample], ["objects/intermediate/stained.sample"]),
+            op("wash2", ["objects/intermediate/stained.sample"], [sample]),
+            op("image", [sample], ["objects/final/image_raw.tiff"]),
+        ],
+    )
+
+    assert result.delta.result.valid, result.delta.result.to_json()
+    assert [r.rule for r in result.rewrites] == ["rename_final_output", "version_output"]
+    assert result.operations[0]["output"] == ["objects/intermediate/wash_v1.sample"]
+    assert result.operations[1]["input"] == ["objects/intermediate/wash_v1.sample"]
+    assert result.operations[2]["output"] == [sample] and result.operations[3]["input"] == [sample]
+    assert result.operations[3]["output"] == ["objects/final/image.tiff"]
+    assert result.delta.result.execution_order == ["wash1", "stain", "wash2", "image"]
+
+
+def test_ambiguous_or_numbered_names_are_escalated():
+    """番号だけが違う名前や、候補が絞れない名前は書き換えずに残す"""
+    result = repair(
+        ["objects/initial/sample_rep2.sample", "objects/initial/tube_a.tube", "objects/initial/tube_b.tube"],
+        ["objects/final/out.data"],
+        [
+            op("a", ["objects/initial/sample_rep1.sample", "objects/initial/tube.tube"], ["objects/final/out.data"]),
+        ],
+    )
+    assert not result.rewrites
+    assert [e.type for e in result.delta.result.errors] == ["MISSING_INPUT", "MISSING_INPUT"]
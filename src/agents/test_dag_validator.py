@@ -3,7 +3,7 @@ DAG Validator のテストケース
 様々なエラーケースを検証
 """
 
-from dag_validator import DAGValidator
+from dag_validator import DAGValidator, apply_operation_patch
 import json
 
 
@@ -320,6 +320,244 @@ def test_case_6_complex_valid():
     print()
 
 
+def _chain_operations(n: int, prefix: str = "chain") -> list:
+    """n個のオペレーションが直列につながったプロトコル"""
+    return [
+        {
+            "operation_id": f"{prefix}_op_{i}",
+            "input": [f"objects/intermediate/{prefix}_{i}.sample"],
+            "output": [f"objects/intermediate/{prefix}_{i + 1}.sample"],
+        }
+        for i in range(n)
+    ]
+
+
+def test_case_7_long_linear_protocol():
+    """テストケース7: 長い直列プロトコルでも再帰上限に達しない"""
+    print("=" * 60)
+    print("テストケース7: 20000ステップの直列プロトコル")
+    print("=" * 60)
+
+    n = 20000
+    phase1 = {
+        "identified_objects": {
+            "initial": ["objects/intermediate/chain_0.sample"],
+            "intermediate": [],
+            "final": [f"objects/intermediate/chain_{n}.sample"],
+        }
+    }
+    phase2 = {"operations": _chain_operations(n)}
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, phase2)
+    result = validator.validate()
+    print(f"valid={result.valid}, execution_order={len(result.execution_order)} ops")
+    print()
+
+    assert result.valid
+    assert result.execution_order == [f"chain_op_{i}" for i in range(n)]
+
+
+def test_case_8_each_cycle_reported_once():
+    """テストケース8: 循環ごとに1回だけ報告され、報告数には上限がある"""
+    print("=" * 60)
+    print("テストケース8: 複数の循環参照")
+    print("=" * 60)
+
+    operations = []
+    for c in range(30):
+        # 3オブジェクトの循環（a -> b -> c -> a）に、循環への入口を複数持たせる
+        a, b, d = (f"objects/intermediate/cycle{c}_{x}.sample" for x in "abc")
+        operations += [
+            {"operation_id": f"cycle{c}_1", "input": [a, "objects/initial/x.reagent"], "output": [b]},
+            {"operation_id": f"cycle{c}_2", "input": [b, "objects/initial/x.reagent"], "output": [d]},
+            {"operation_id": f"cycle{c}_3", "input": [d], "output": [a]},
+        ]
+    phase1 = {"identified_objects": {"initial": ["objects/initial/x.reagent"], "intermediate": [], "final": []}}
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, {"operations": operations[:9]})
+    cycles = validator.validate().errors
+    print(json.dumps([e.message for e in cycles], ensure_ascii=False, indent=2))
+    print()
+
+    assert [e.type for e in cycles] == ["CIRCULAR_DEPENDENCY"] * 3
+    assert len({e.message for e in cycles}) == 3
+
+    validator.load_from_phases(phase1, {"operations": operations})
+    result = validator.validate()
+    circular = [e for e in result.errors if e.type == "CIRCULAR_DEPENDENCY"]
+    assert len(circular) == DAGValidator.MAX_REPORTED_CYCLES
+
+
+def test_case_9_incremental_revalidation():
+    """テストケース9: 差分検証が全体の再検証と同じ結果になり、エラーの増減を報告する"""
+    print("=" * 60)
+    print("テストケース9: 差分による再検証")
+    print("=" * 60)
+
+    phase1 = {
+        "identified_objects": {
+            "initial": ["objects/initial/stock.reagent"],
+            "intermediate": [],
+            "final": ["objects/final/result.image"],
+        }
+    }
+    attempt1 = [
+        {
+            "operation_id": "dilute",
+            "input": ["objects/initial/stock.reagent"],
+            "output": ["objects/intermediate/diluted.sample"],
+        },
+        {
+            "operation_id": "react",
+            "input": ["objects/intermediate/mix.sample"],
+            "output": ["objects/intermediate/product.sample"],
+        },
+        {
+            "operation_id": "image",
+            "input": ["objects/intermediate/product.sample"],
+            "output": ["objects/final/result.image"],
+        },
+    ]
+    # react の入力を修正し、新しいオペレーションで重複出力を作る
+    attempt2 = [
+        attempt1[0],
+        {
+            "operation_id": "react",
+            "input": ["objects/intermediate/diluted.sample"],
+            "output": ["objects/intermediate/product.sample"],
+        },
+        attempt1[2],
+        {
+            "operation_id": "react_again",
+            "input": ["objects/initial/stock.reagent"],
+            "output": ["objects/intermediate/product.sample"],
+        },
+    ]
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, {})
+    first = validator.validate_incremental(attempt1)
+    second = validator.validate_incremental(attempt2)
+    print(json.dumps([e.to_dict() for e in second.introduced + second.resolved], ensure_ascii=False, indent=2))
+    print()
+
+    assert [e.type for e in first.result.errors] == ["MISSING_INPUT"]
+    assert [d.get("operation_id") for d in second.diff.changed] == ["react"]
+    assert [d.get("operation_id") for d in second.diff.added] == ["react_again"]
+    assert [e.type for e in second.resolved] == ["MISSING_INPUT"]
+    assert [e.type for e in second.introduced] == ["DUPLICATE_OUTPUT"]
+
+    full = DAGValidator()
+    full.load_from_phases(phase1, {"operations": attempt2})
+    assert second.result.to_dict() == full.validate().to_dict()
+
+    # 重複を取り除くと検証に成功し、実行順序も得られる
+    third = validator.validate_incremental(attempt2[:3])
+    assert third.result.valid
+    assert [e.type for e in third.resolved] == ["DUPLICATE_OUTPUT"]
+    assert third.result.execution_order == ["dilute", "react", "image"]
+
+
+def test_case_10_operation_patch():
+    """テストケース10: パッチ（追加・削除・置換）を適用して修正した計画が検証に通る"""
+    print("=" * 60)
+    print("テストケース10: パッチによる修正")
+    print("=" * 60)
+
+    phase1 = {
+        "identified_objects": {
+            "initial": ["objects/initial/stock.reagent"],
+            "intermediate": [],
+            "final": ["objects/final/result.image"],
+        }
+    }
+    operations = [
+        {
+            "operation_id": "react",
+            "input": ["objects/intermediate/diluted.sample"],
+            "output": ["objects/intermediate/product.sample"],
+        },
+        {
+            "operation_id": "stray",
+            "input": ["objects/initial/stock.reagent"],
+            "output": ["objects/intermediate/product.sample"],
+        },
+        {
+            "operation_id": "image",
+            "input": ["objects/intermediate/product.sample"],
+            "output": ["objects/final/raw.image"],
+        },
+    ]
+    patch = {
+        "add_operations": [
+            {
+                "operation_id": "dilute",
+                "input": ["objects/initial/stock.reagent"],
+                "output": ["objects/intermediate/diluted.sample"],
+            }
+        ],
+        "remove_operation_ids": ["stray", "unknown"],
+        "replace_operations": [
+            {
+                "operation_id": "image",
+                "input": ["objects/intermediate/product.sample"],
+                "output": ["objects/final/result.image"],
+            }
+        ],
+    }
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, {})
+    before = validator.validate_incremental(operations)
+    patched = apply_operation_patch(operations, patch)
+    after = validator.validate_incremental(patched)
+    print(after.result.to_json())
+    print()
+
+    assert not before.result.valid
+    assert [op["operation_id"] for op in patched] == ["react", "image", "dilute"]
+    assert patched[1] is patch["replace_operations"][0]
+    assert after.result.valid
+    assert after.result.execution_order == ["dilute", "react", "image"]
+    assert apply_operation_patch(operations, {}) == operations
+
+
+def test_case_11_duplicate_operation_id():
+    """テストケース11: 同じ operation_id のオペレーションが複数あると、実行順序を決定できずに検証に失敗する"""
+    print("=" * 60)
+    print("テストケース11: オペレーションIDの重複")
+    print("=" * 60)
+
+    phase1 = {
+        "identified_objects": {
+            "initial": ["objects/initial/stock.reagent"],
+            "intermediate": [],
+            "final": ["objects/final/result.image"],
+        }
+    }
+    operations = [
+        {"operation_id": "x", "input": ["objects/initial/stock.reagent"], "output": ["objects/intermediate/a.sample"]},
+        {"operation_id": "x", "input": ["objects/intermediate/a.sample"], "output": ["objects/final/result.image"]},
+    ]
+
+    validator = DAGValidator()
+    validator.load_from_phases(phase1, {"operations": operations})
+    result = validator.validate()
+    print(result.to_json())
+    print()
+
+    assert not result.valid and result.execution_order == []
+    # 専用のエラー種別は設けず、従来どおり TOPOLOGICAL_SORT_FAILED を報告する
+    assert [e.type for e in result.errors] == ["TOPOLOGICAL_SORT_FAILED"]
+
+    # 差分検証も同じ結果になる
+    incremental = DAGValidator()
+    incremental.load_from_phases(phase1, {})
+    assert incremental.validate_incremental(operations).result.to_dict() == result.to_dict()
+
+
 if __name__ == "__main__":
     test_case_1_missing_input()
     test_case_2_unused_output()
@@ -327,3 +565,8 @@ if __name__ == "__main__":
     test_case_4_missing_final_output()
     test_case_5_duplicate_output()
     test_case_6_complex_valid()
+    test_case_7_long_linear_protocol()
+    test_case_8_each_cycle_reported_once()
+    test_case_9_incremental_revalidation()
+    test_case_10_operation_patch()
+    test_case_11_duplicate_operation_id()
@@ -0,0 +1,113 @@
+"""
+パイプラインスケジューラのテスト
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from agents.pipeline import Stage, StagePipeline, format_metrics, parse_stage_limits
+
+
+def test_results_in_input_order_and_stages_overlap():
+    """結果は入力順に返り、異なるアイテムが異なる段を同時に実行できる"""
+    active = set()
+    overlapped = threading.Event()
+    lock = threading.Lock()
+
+    def make_stage(name, delay):
+        def fn(item):
+            with lock:
+                active.add(name)
+                if len(active) > 1:
+                    overlapped.set()
+            time.sleep(delay)
+            with lock:
+                active.discard(name)
+            return item + [name]
+
+        return fn
+
+    pipeline = StagePipeline(
+        [Stage("fetch", make_stage("fetch", 0.02), 1), Stage("llm", make_stage("llm", 0.02), 1)],
+        on_error=lambda item, e: None,
+    )
+    finished = []
+    results = pipeline.run([[i] for i in range(6)], on_result=finished.append)
+
+    assert results == [[i, "fetch", "llm"] for i in range(6)]
+    assert len(finished) == 6
+    assert overlapped.is_set()
+    assert [m.processed for m in pipeline.metrics()] == [6, 6]
+
+
+def test_failed_item_skips_remaining_stages():
+    """例外が発生したアイテムは on_error の戻り値が結果になり、以降の段は実行されない"""
+    seen = []
+
+    def flaky(item):
+        if item == 2:
+            raise RuntimeError("boom")
+        return item
+
+    pipeline = StagePipeline(
+        [Stage("first", flaky, 2), Stage("second", lambda item: seen.append(item) or item * 10, 2)],
+        on_error=lambda item, e: f"error {item}: {e}",
+    )
+    results = pipeline.run(range(4))
+
+    assert results == [0, 10, "error 2: boom", 30]
+    assert sorted(seen) == [0, 1, 3]
+    assert pipeline.metrics()[0].failed == 1
+
+
+def test_error_handler_failure_is_raised_from_run():
+    """on_error 自身が例外を送出しても run() は止まらずに残りを処理し、その例外を送出する"""
+    finished = []
+
+    def broken_handler(item, e):
+        raise ValueError(f"handler failed on {item}")
+
+    pipeline = StagePipeline(
+        [Stage("first", lambda item: item / (item - 1), 2), Stage("second", lambda item: item, 1)],
+        on_error=broken_handler,
+    )
+    outcome = {}
+    runner = threading.Thread(target=lambda: outcome.update(error=_raised(pipeline.run, range(4), finished.append)))
+    runner.start()
+    runner.join(5)
+
+    assert not runner.is_alive()
+    assert str(outcome["error"]) == "handler failed on 1"
+    assert len(finished) == 3
+    assert pipeline.metrics()[0].failed == 1
+
+
+def _raised(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        return e
+    return None
+
+
+def test_backpressure_bounds_queue_depth():
+    """下流が遅いとキューの深さは容量で頭打ちになり、上流は待たされる"""
+    pipeline = StagePipeline(
+        [Stage("fast", lambda item: item, 1), Stage("slow", lambda item: time.sleep(0.01) or item, 1, queue_size=2)],
+        on_error=lambda item, e: None,
+    )
+    pipeline.run(range(20))
+    fast, slow = pipeline.metrics()
+
+    print(format_metrics([fast, slow]))
+    assert slow.max_queue_depth <= 2
+    assert fast.blocked_seconds > 0
+    assert slow.utilization > fast.utilization
+
+
+def test_parse_stage_limits():
+    assert parse_stage_limits("fetch=8, procedure=2") == {"fetch": 8, "procedure": 2}
+    assert parse_stage_limits("") == {}
@@ -6,13 +6,144 @@ import os
 import sys
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
 # Add src to path
 sys.path.append(str(Path(__file__).parent))
 
-from agents.agent_with_dag_validation import ExperimentPlanningAgent
+from agents.agent_with_dag_validation import ExperimentPlanningAgent, PlanningJob
+from agents.pipeline import Stage, StagePipeline, format_metrics, parse_stage_limits
+from tools.adaptive_concurrency import AdaptiveConcurrency, run_adaptive
+from tools.hedging import HedgePolicy
+from tools.jsonl_checkpoint import JsonlCheckpoint
+from tools.llm_cache import DEFAULT_CACHE_PATH, LLMCache
+from tools.llm_telemetry import DEFAULT_TELEMETRY_PATH, LLMTelemetry
+from tools.output_constraints import fix_steps
+from tools.rate_limiter import DEFAULT_MAX_RETRIES, RateLimiter, get_rate_limiter, set_rate_limiter
+from tools.reference_retrieval import DEFAULT_BUDGET_TOKENS, DEFAULT_TOP_K
+from tools.reference_store import DEFAULT_TTL, ReferenceStore, set_reference_store
+
+
+def error_result(task_id: str, error: Exception) -> dict:
+    """Fallback result for a task whose agent run raised."""
+    return {
+        "id": task_id,
+        "output": {"procedure_steps": [{"id": 1, "text": f"Error: Agent failed to process task. {str(error)}"}]},
+    }
+
+
+def enforce_output_constraints(result: dict) -> dict:
+    """
+    Last local check of the 50-step / 10-sentence rule before a result is written.
+
+    Phase 3 already fixes its own output; this also covers error results and any other path
+    that produces steps. Results whose steps cannot be fixed are written unchanged.
+    """
+    output = result.get("output") or {}
+    fixed = fix_steps(output.get("procedure_steps"))
+    if not fixed.ok:
+        return result
+    if fixed.fixes:
+        print(f"🔧 {result.get('id')}: {', '.join(fixed.fixes)}")
+    return {**result, "output": {**output, "procedure_steps": fixed.steps}}
+
+
+def run_task(agent: ExperimentPlanningAgent, input_data: dict, position: int, total_tasks: int) -> dict:
+    """Run a single task, converting any exception into an error result."""
+    task_id = input_data.get("id", "unknown")
+    print(f"\nProcessing task {position}/{total_tasks} (ID: {task_id})...")
+
+    try:
+        return agent.run(input_data)
+    except Exception as e:
+        print(f"❌ Error processing task {task_id}: {e}")
+        return error_result(task_id, e)
+
+
+def run_tasks(
+    agent: ExperimentPlanningAgent,
+    tasks: List[dict],
+    concurrency: int = 1,
+    on_result: Optional[Callable[[dict], None]] = None,
+    controller: Optional[AdaptiveConcurrency] = None,
+) -> List[dict]:
+    """
+    Run all tasks and return their results in input order.
+
+    With concurrency > 1 tasks are executed on a thread pool; each agent run keeps its
+    state in its own TaskContext, so tasks do not interfere with each other.
+    With a controller the number of tasks in flight is adjusted by AIMD instead
+    (concurrency is ignored).
+    on_result is called with each result as soon as its task finishes (completion order).
+    """
+    total_tasks = len(tasks)
+
+    if controller is not None:
+        return run_adaptive(
+            list(enumerate(tasks, start=1)),
+            lambda item: run_task(agent, item[1], item[0], total_tasks),
+            controller,
+            on_result=on_result,
+        )
+
+    if concurrency <= 1:
+        results = []
+        for i, task in enumerate(tasks):
+            result = run_task(agent, task, i + 1, total_tasks)
+            if on_result:
+                on_result(result)
+            results.append(result)
+        return results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_task, agent, task, i + 1, total_tasks) for i, task in enumerate(tasks)]
+        if on_result:
+            for future in as_completed(futures):
+                on_result(future.result())
+        # Collect in submission order so the output order matches the input order
+        return [future.result() for future in futures]
+
+
+def run_pipeline(
+    agent: ExperimentPlanningAgent,
+    tasks: List[dict],
+    concurrency: int = 1,
+    stage_limits: Optional[Dict[str, int]] = None,
+    on_result: Optional[Callable[[dict], None]] = None,
+) -> List[dict]:
+    """
+    Run all tasks through a stage pipeline and return their results in input order.
+
+    Every agent stage (reference fetch, Phase 1.1, 1.2, Phase 2 + validation, Phase 3) gets
+    its own worker pool of `concurrency` threads unless overridden in stage_limits, so
+    different tasks can be in different stages at the same time. Per-stage metrics are
+    printed once all tasks are done.
+    """
+    stage_limits = stage_limits or {}
+    names = [name for name, _ in agent.pipeline_stages()]
+    unknown = set(stage_limits) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(sorted(unknown))} (stages: {', '.join(names)})")
+
+    def on_error(job: PlanningJob, e: Exception) -> PlanningJob:
+        print(f"❌ Error processing task {job.task_id}: {e}")
+        return PlanningJob(job.input_data, result=error_result(job.task_id, e))
+
+    pipeline = StagePipeline(
+        [Stage(name, fn, stage_limits.get(name, concurrency)) for name, fn in agent.pipeline_stages()],
+        on_error=on_error,
+    )
+    jobs = pipeline.run(
+        [PlanningJob(input_data=task) for task in tasks],
+        on_result=(lambda job: on_result(job.result)) if on_result else None,
+    )
+
+    print("\nPipeline stage metrics:")
+    print(format_metrics(pipeline.metrics()))
+    return [job.result for job in jobs]
 
 
 def main():
@@ -20,8 +151,100 @@ def main():
     parser.add_argument("input_file", help="Path to input JSONL file")
     parser.add_argument("output_file", help="Path to output JSONL file")
     parser.add_argument("--model", default="gpt-4o", help="Model name to use")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of tasks to run in parallel")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adjust the number of tasks in flight with AIMD, starting from --concurrency (not with --pipeline)",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=32, help="Upper bound for --adaptive concurrency")
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run tasks through a stage pipeline with a worker pool per agent stage",
+    )
+    parser.add_argument(
+        "--stage-concurrency",
+        default="",
+        help="Per-stage worker counts for --pipeline, e.g. fetch=8,procedure=2 (default: --concurrency)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep tasks already completed in the output file and only re-run missing or errored ones",
+    )
+    parser.add_argument("--llm-cache", default=str(DEFAULT_CACHE_PATH), help="Path to the LLM response cache")
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Bypass cached LLM responses (fresh responses are still written to the cache)",
+    )
+    parser.add_argument(
+        "--telemetry",
+        default=str(DEFAULT_TELEMETRY_PATH),
+        help="JSONL file that receives one event per LLM call (summarize with src/tools/llm_telemetry.py)",
+    )
+    parser.add_argument("--no-telemetry", action="store_true", help="Do not record LLM call events")
+    parser.add_argument("--rpm", type=float, help="Requests-per-minute budget shared by all LLM calls")
+    parser.add_argument("--tpm", type=float, help="Tokens-per-minute budget shared by all LLM calls")
+    parser.add_argument(
+        "--llm-max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Retries per LLM call on 429/5xx/timeouts (jittered exponential backoff, honours Retry-After)",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        help="Send a duplicate LLM request when a call is slower than this percentile of its phase (off by default)",
+    )
+    parser.add_argument(
+        "--hedge-max-extra",
+        type=float,
+        default=0.1,
+        help="Cap on hedged (duplicate) requests as a fraction of all LLM calls",
+    )
+    parser.add_argument(
+        "--reference-ttl-hours",
+        type=float,
+        default=DEFAULT_TTL / 3600,
+        help="How long cached reference documents are used without revalidation",
+    )
+    parser.add_argument(
+        "--offline-references", action="store_true", help="Serve reference documents from the cache only"
+    )
+    parser.add_argument(
+        "--reference-budget",
+        type=int,
+        default=DEFAULT_BUDGET_TOKENS,
+        help="Token budget for reference excerpts in prompts (most relevant chunks are selected with BM25)",
+    )
+    parser.add_argument(
+        "--reference-top-k", type=int, default=DEFAULT_TOP_K, help="Maximum number of reference chunks per task"
+    )
+    parser.add_argument(
+        "--repair-mode",
+        choices=["patch", "full"],
+        default="patch",
+        help="How Phase 2 fixes validation errors: ask for a patch against the current plan "
+        "(falls back to full regeneration if it does not converge), or regenerate every operation",
+    )
+    parser.add_argument(
+        "--no-local-repair",
+        action="store_true",
+        help="Send every Phase 2 validation error back to the LLM instead of fixing mechanical ones locally first",
+    )
+    parser.add_argument(
+        "--phase2-candidates",
+        type=int,
+        default=1,
+        help="Generate this many Phase 2 plans concurrently at spread temperatures and keep the first valid one "
+        "(1 = sequential attempts)",
+    )
 
     args = parser.parse_args()
+    if args.adaptive and args.pipeline:
+        parser.error("--adaptive cannot be combined with --pipeline")
 
     # Load environment variables
     load_dotenv()
@@ -33,10 +256,25 @@ def main():
     print(f"Starting agent with model: {args.model}")
     print(f"Input: {args.input_file}")
     print(f"Output: {args.output_file}")
+    print(f"Concurrency: {args.concurrency}")
 
-    agent = ExperimentPlanningAgent(api_key=api_key, model_name=args.model)
-
-    results = []
+    cache = LLMCache(args.llm_cache, bypass=args.no_llm_cache)
+    set_rate_limiter(RateLimiter(rpm=args.rpm, tpm=args.tpm, max_retries=args.llm_max_retries))
+    set_reference_store(ReferenceStore(ttl=args.reference_ttl_hours * 3600, offline=args.offline_references))
+    telemetry = None if args.no_telemetry else LLMTelemetry(args.telemetry)
+    hedge = HedgePolicy(args.hedge_percentile, args.hedge_max_extra) if args.hedge_percentile else None
+    agent = ExperimentPlanningAgent(
+        api_key=api_key,
+        model_name=args.model,
+        cache=cache,
+        telemetry=telemetry,
+        hedge=hedge,
+        reference_budget_tokens=args.reference_budget,
+        reference_top_k=args.reference_top_k,
+        repair_mode=args.repair_mode,
+        local_repair=not args.no_local_repair,
+        phase2_candidates=args.phase2_candidates,
+    )
 
     # Read input file
     try:
@@ -46,41 +284,52 @@ def main():
         print(f"❌ Error: Input file not found: {args.input_file}")
         sys.exit(1)
 
-    total_tasks = len(lines)
-    print(f"Found {total_tasks} tasks.")
+    tasks = [json.loads(line) for line in lines if line.strip()]
+    print(f"Found {len(tasks)} tasks.")
 
-    for i, line in enumerate(lines):
-        if not line.strip():
-            continue
+    # Each result is appended to the output file as soon as its task finishes
+    checkpoint = JsonlCheckpoint(args.output_file)
 
-        input_data = json.loads(line)
-        task_id = input_data.get("id", "unknown")
-        print(f"\nProcessing task {i + 1}/{total_tasks} (ID: {task_id})...")
+    def save_result(result: dict) -> None:
+        checkpoint.append(enforce_output_constraints(result))
 
-        try:
-            result = agent.run(input_data)
-            results.append(result)
-        except Exception as e:
-            print(f"❌ Error processing task {task_id}: {e}")
-            # Fallback error result
-            results.append(
-                {
-                    "id": task_id,
-                    "output": {
-                        "procedure_steps": [{"id": 1, "text": f"Error: Agent failed to process task. {str(e)}"}]
-                    },
-                }
-            )
-
-    # Save results
-    output_path = Path(args.output_file)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        for res in results:
-            f.write(json.dumps(res, ensure_ascii=False) + "\n")
+    if args.resume:
+        completed = checkpoint.completed_ids()
+        pending = [task for task in tasks if str(task.get("id", "unknown")) not in completed]
+        print(f"Resuming: {len(tasks) - len(pending)} tasks already completed, {len(pending)} to run.")
+    else:
+        checkpoint.reset()
+        pending = tasks
+
+    if args.pipeline:
+        run_pipeline(
+            agent,
+            pending,
+            concurrency=args.concurrency,
+            stage_limits=parse_stage_limits(args.stage_concurrency),
+            on_result=save_result,
+        )
+    elif args.adaptive:
+        controller = AdaptiveConcurrency(initial=args.concurrency, max_limit=args.max_concurrency)
+        run_tasks(agent, pending, on_result=save_result, controller=controller)
+        print(f"\nAdaptive concurrency: {controller.metrics()}")
+    else:
+        run_tasks(agent, pending, concurrency=args.concurrency, on_result=save_result)
+
+    # Rewrite the output in input order (drops superseded error records)
+    checkpoint.finalize(str(task.get("id", "unknown")) for task in tasks)
 
     print(f"\n✅ All tasks completed. Results saved to {args.output_file}")
+    print(f"LLM cache: {cache.stats()}")
+    print(f"Rate limiter: {get_rate_limiter().metrics()}")
+    print(f"Local DAG repair: {agent.repair_metrics()}")
+    print(f"Output constraints: {agent.constraint_metrics()}")
+    if args.phase2_candidates > 1:
+        print(f"Speculative Phase 2: {agent.speculation_metrics()}")
+    if hedge:
+        print(f"Hedging: {hedge.metrics()}")
+    if telemetry:
+        print(f"LLM call events: {telemetry.path} (run {telemetry.run_id})")
 
 
 if __name__ == "__main__":
@@ -7,11 +7,15 @@ GitHub: https://github.com/lasa-or-jp/la-bench.git
 Usage:
     export OPENAI_API_KEY="your-api-key"
     python baseline_responses_api.py
+    python baseline_responses_api.py --resume outputs/runs/generated_responses_<ts>.jsonl
+    python baseline_responses_api.py --batch   # submit generation and judging through the Batch API
 """
 
 import os
+import sys
 import json
 import time
+import argparse
 from datetime import datetime
 from typing import Dict, List, Optional, Set, Any
 from pathlib import Path
@@ -38,6 +42,26 @@ except ImportError:
 # Progress bar
 from tqdm.auto import tqdm
 
+# Shared tools (src/tools)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from tools.adaptive_concurrency import AdaptiveConcurrency, run_adaptive
+from tools.jsonl_checkpoint import JsonlCheckpoint
+from tools.judge_pool import (
+    DEFAULT_JUDGE_WORKERS,
+    DEFAULT_VERDICT_CACHE_PATH,
+    JudgePool,
+    JudgeTask,
+    VerdictCache,
+    VotePolicy,
+    verdict_key,
+)
+from tools.llm_batch import BatchBackend, BatchItem, LocalBatchBackend, OpenAIBatchBackend, client_handler, run_batch
+from tools.llm_cache import DEFAULT_CACHE_PATH, LLMCache
+from tools.llm_client import LLMClient
+from tools.llm_telemetry import DEFAULT_TELEMETRY_PATH, LLMTelemetry, llm_context
+from tools.output_constraints import fix_steps
+from tools.rate_limiter import RateLimiter, get_rate_limiter, set_rate_limiter
+
 # Logging
 import logging
 
@@ -53,11 +77,17 @@ logger = logging.getLogger(__name__)
 MODEL_NAME = "gpt-5.1"
 REASONING_EFFORT = "medium"  # none, minimal, low, medium, high
 MAX_OUTPUT_TOKENS = 16384  # Max tokens for Responses API (GPT-5.1 supports up to 128k)
+# Output constraints (50 steps / 10 sentences) are fixed locally; the model is asked again only
+# when no steps can be read from its output
+GENERATE_MAX_ATTEMPTS = 2
+RETRY_NOTE = "\n\n前回の出力から手順を読み取れませんでした。procedure_steps にステップを1つ以上入れて、完全な JSON で出力してください。"
 
 # Judge model settings
 JUDGE_MODEL = "gpt-4.1-mini"
 JUDGE_TEMPERATURE = 0.2
 JUDGE_MAX_TOKENS = 2048
+# Bump when the judge prompt (build_judge_messages) changes; it is part of the verdict cache key
+JUDGE_PROMPT_VERSION = "1"
 
 # Input/Output paths
 JSONL_PATH = "data/public_test.jsonl"
@@ -281,84 +311,178 @@ def build_input_text(sample: ExampleSample) -> str:
     return "\n".join(lines)
 
 
-def generate_outputs(samples: list[ExampleSample], api_key: str) -> list[dict]:
+def build_generate_request(sample: ExampleSample, retry_note: str = "") -> dict:
+    """
+    Build the Responses API request for one sample (shared by the synchronous and batch paths)
+
+    retry_note is appended to the input when the previous output could not be used.
+    """
+    # Responses API with reasoning effort control for GPT-5.1
+    # Note: GPT-5.1 defaults to reasoning_effort="none"
+    # We explicitly set it to "medium" for better quality
+    return dict(
+        model=MODEL_NAME,
+        input=[
+            {"role": "system", "content": "あなたは生命科学実験の専門家です。"},
+            {"role": "user", "content": build_input_text(sample) + retry_note},
+        ],
+        reasoning={"effort": REASONING_EFFORT},
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "generated_output",
+                "schema": GeneratedOutput.model_json_schema(),
+                "strict": True,
+            }
+        },
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+    )
+
+
+def parse_generated_text(sample_id: str, output_text: str) -> List[Step]:
+    """
+    Parse the structured output text into steps that satisfy the output constraints
+
+    Steps are put in id order, over-long steps are split, overflowing steps are merged and ids are
+    renumbered locally (see tools/output_constraints.py). Raises ValueError on empty or invalid
+    output, or when the output contains no usable step.
+    """
+    if not output_text:
+        raise ValueError("Could not extract output text from response")
+
+    # Parse JSON with better error handling
+    try:
+        parsed_dict = json.loads(output_text)
+    except json.JSONDecodeError as json_err:
+        logger.error(f"JSON parse error for {sample_id}: {json_err}")
+        logger.error(f"output_text length: {len(output_text)}")
+        logger.error(f"output_text: {output_text}")
+        # Save to file for debugging
+        debug_file = OUTPUT_DIR / f"debug_json_error_{sample_id}.txt"
+        debug_file.parent.mkdir(parents=True, exist_ok=True)
+        debug_file.write_text(output_text, encoding="utf-8")
+        logger.error(f"Saved problematic output to: {debug_file}")
+        raise
+
+    fixed = fix_steps(parsed_dict.get("procedure_steps") if isinstance(parsed_dict, dict) else None)
+    if not fixed.ok:
+        raise ValueError(fixed.violations[0].message)
+    if fixed.fixes:
+        logger.info(f"🔧 {sample_id}: {', '.join(fixed.fixes)}")
+    return [Step(id=s["id"], text=s["text"]) for s in fixed.steps]
+
+
+def generate_outputs(
+    samples: list[ExampleSample],
+    api_key: str,
+    checkpoint: Optional[JsonlCheckpoint] = None,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    controller: Optional[AdaptiveConcurrency] = None,
+) -> list[dict]:
     """
     Generate experimental procedures using Responses API with GPT-5.1
+
+    If a checkpoint is given, samples already completed in it are reused and every newly
+    generated sample is appended to it as soon as it finishes.
+    With a controller, samples are generated concurrently and the number of in-flight
+    requests is adjusted by AIMD.
     """
-    client = OpenAI(api_key=api_key)
-    results: list[dict] = []
+    llm = LLMClient(OpenAI(api_key=api_key), cache=cache, telemetry=telemetry)
+    completed = checkpoint.load() if checkpoint else {}
+    completed_ids = checkpoint.completed_ids() if checkpoint else set()
+
+    def generate_one(sm: ExampleSample) -> dict:
+        if sm.id in completed_ids:
+            return {"id": sm.id, "procedure_steps": completed[sm.id]["output"]["procedure_steps"]}
 
-    for sm in tqdm(samples, desc="Generating procedures (Responses API)"):
-        input_text = build_input_text(sm)
         try:
-            # Responses API with reasoning effort control for GPT-5.1
-            # Note: GPT-5.1 defaults to reasoning_effort="none"
-            # We explicitly set it to "medium" for better quality
-            response = client.responses.create(
-                model=MODEL_NAME,
-                input=[
-                    {"role": "system", "content": "あなたは生命科学実験の専門家です。"},
-                    {"role": "user", "content": input_text}
-                ],
-                reasoning={"effort": REASONING_EFFORT},
-                text={
-                    "format": {
-                        "type": "json_schema",
-                        "name": "generated_output",
-                        "schema": GeneratedOutput.model_json_schema(),
-                        "strict": True,
-                    }
-                },
-                max_output_tokens=MAX_OUTPUT_TOKENS,
-            )
+            for attempt in range(1, GENERATE_MAX_ATTEMPTS + 1):
+                phase = "generate" if attempt == 1 else f"generate-attempt-{attempt}"
+                with llm_context(task_id=sm.id, phase=phase):
+                    response = llm.responses(**build_generate_request(sm, RETRY_NOTE if attempt > 1 else ""))
+                try:
+                    steps = parse_generated_text(sm.id, response.text)
+                    break
+                except ValueError as e:
+                    if attempt == GENERATE_MAX_ATTEMPTS:
+                        raise
+                    logger.warning(f"⚠️ {sm.id}: 手順を読み取れないため再生成します: {e}")
+
+            # Debug: Print response structure for first sample (not available for cached responses)
+            if sm.id == samples[0].id and response.raw is not None:
+                raw = response.raw
+                logger.info(f"Response type: {type(raw)}")
+                logger.info(f"Response attributes: {dir(raw)}")
+                if hasattr(raw, "output_text"):
+                    logger.info(f"output_text type: {type(raw.output_text)}")
+                    logger.info(f"output_text preview: {raw.output_text[:200] if raw.output_text else 'None'}")
+                if hasattr(raw, "output"):
+                    logger.info(f"output type: {type(raw.output)}")
+                    logger.info(f"output length: {len(raw.output) if raw.output else 0}")
 
-            # Parse structured output from response
-            # Debug: Print response structure for first sample
-            if sm.id == samples[0].id:
-                logger.info(f"Response type: {type(response)}")
-                logger.info(f"Response attributes: {dir(response)}")
-                if hasattr(response, 'output_text'):
-                    logger.info(f"output_text type: {type(response.output_text)}")
-                    logger.info(f"output_text preview: {response.output_text[:200] if response.output_text else 'None'}")
-                if hasattr(response, 'output'):
-                    logger.info(f"output type: {type(response.output)}")
-                    logger.info(f"output length: {len(response.output) if response.output else 0}")
-
-            # Try to get output text
-            output_text = None
-            if hasattr(response, 'output_text') and response.output_text:
-                output_text = response.output_text
-            elif hasattr(response, 'output') and response.output:
-                # Extract text from output array
-                for item in response.output:
-                    if hasattr(item, 'content'):
-                        for content in item.content:
-                            if hasattr(content, 'text'):
-                                output_text = content.text
-                                break
-                    if output_text:
-                        break
-
-            if not output_text:
-                raise ValueError("Could not extract output text from response")
-
-            # Parse JSON with better error handling
-            try:
-                parsed_dict = json.loads(output_text)
-            except json.JSONDecodeError as json_err:
-                logger.error(f"JSON parse error for {sm.id}: {json_err}")
-                logger.error(f"output_text length: {len(output_text)}")
-                logger.error(f"output_text: {output_text}")
-                # Save to file for debugging
-                debug_file = OUTPUT_DIR / f"debug_json_error_{sm.id}.txt"
-                debug_file.parent.mkdir(parents=True, exist_ok=True)
-                debug_file.write_text(output_text, encoding="utf-8")
-                logger.error(f"Saved problematic output to: {debug_file}")
-                raise
-
-            parsed = GeneratedOutput(**parsed_dict)
-            steps = [Step(id=s.id, text=s.text) for s in sorted(parsed.procedure_steps, key=lambda x: x.id)][:50]
+        except Exception as e:
+            logger.error(f"❌ 生成失敗: {sm.id}: {e}")
+            print(f"❌ 生成失敗: {sm.id}: {e}")
+            steps = []
 
+        result = {
+            "id": sm.id,
+            "procedure_steps": [{"id": s.id, "text": s.text} for s in steps],
+        }
+        if checkpoint:
+            checkpoint.append({"id": sm.id, "output": {"procedure_steps": result["procedure_steps"]}})
+        return result
+
+    results = _run_samples(samples, generate_one, controller, desc="Generating procedures (Responses API)")
+    print(f"✅ 生成完了: {len(results)} samples (reasoning={REASONING_EFFORT})")
+    return results
+
+
+def _run_samples(samples: list, fn, controller: Optional[AdaptiveConcurrency], desc: str) -> list:
+    """
+    Run fn for every sample, sequentially or with the controller's adaptive concurrency (results in input order)
+    """
+    if controller is None:
+        return [fn(sm) for sm in tqdm(samples, desc=desc)]
+    with tqdm(total=len(samples), desc=desc) as bar:
+        return run_adaptive(samples, fn, controller, on_result=lambda _: bar.update())
+
+
+def generate_outputs_batch(
+    samples: list[ExampleSample],
+    backend: BatchBackend,
+    workdir: Path,
+    checkpoint: Optional[JsonlCheckpoint] = None,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    poll_interval: float = 30.0,
+) -> list[dict]:
+    """
+    Same as generate_outputs, but submits every pending sample as one Batch API job
+
+    Results are mapped back to samples by custom_id (= sample id) once the batch finishes.
+    """
+    completed = checkpoint.load() if checkpoint else {}
+    completed_ids = checkpoint.completed_ids() if checkpoint else set()
+    items = [
+        BatchItem(sm.id, "responses.create", build_generate_request(sm), phase="generate")
+        for sm in samples
+        if sm.id not in completed_ids
+    ]
+    batch_results = run_batch(items, backend, workdir, cache=cache, telemetry=telemetry, poll_interval=poll_interval)
+
+    results: list[dict] = []
+    for sm in samples:
+        if sm.id in completed_ids:
+            results.append({"id": sm.id, "procedure_steps": completed[sm.id]["output"]["procedure_steps"]})
+            continue
+
+        result = batch_results[sm.id]
+        try:
+            if not result.ok:
+                raise RuntimeError(result.error)
+            steps = parse_generated_text(sm.id, result.text)
         except Exception as e:
             logger.error(f"❌ 生成失敗: {sm.id}: {e}")
             print(f"❌ 生成失敗: {sm.id}: {e}")
@@ -370,8 +494,10 @@ def generate_outputs(samples: list[ExampleSample], api_key: str) -> list[dict]:
                 "procedure_steps": [{"id": s.id, "text": s.text} for s in steps],
             }
         )
+        if checkpoint:
+            checkpoint.append({"id": sm.id, "output": {"procedure_steps": results[-1]["procedure_steps"]}})
 
-    print(f"✅ 生成完了: {len(results)} samples (reasoning={REASONING_EFFORT})")
+    print(f"✅ 生成完了 (batch): {len(results)} samples (reasoning={REASONING_EFFORT})")
     return results
 
 
@@ -430,67 +556,149 @@ def build_judge_messages(sample: ExampleSample, steps: List[Step]) -> list[dict]
     ]
 
 
-def judge_with_llm(samples: List[ExampleSample], generated: list[dict], api_key: str) -> pd.DataFrame:
+def build_judge_request(sample: ExampleSample, steps: List[Step]) -> dict:
+    """
+    Build the judge request for one sample (shared by the synchronous and batch paths)
+    """
+    return dict(
+        model=JUDGE_MODEL,
+        messages=build_judge_messages(sample, steps),
+        temperature=JUDGE_TEMPERATURE,
+        max_tokens=JUDGE_MAX_TOKENS,
+        response_format=JudgeOutput,
+    )
+
+
+def _judge_row(sample_id: str, parsed: Optional[JudgeOutput] = None, notes: str = "") -> dict:
+    if parsed is None:
+        return {"id": sample_id, "general_score": 0.0, "specific_score": 0.0, "total_score": 0.0, "notes": notes}
+    return {
+        "id": sample_id,
+        "general_score": parsed.general_score,
+        "specific_score": parsed.specific_score,
+        "total_score": parsed.final_score,
+        "notes": parsed.notes or "",
+    }
+
+
+def _verdict_key(sample: ExampleSample, steps: List[Step], mode: str = "") -> str:
+    return verdict_key(
+        JUDGE_MODEL, JUDGE_PROMPT_VERSION, {"input": sample.input, "measurement": sample.measurement}, steps, mode
+    )
+
+
+def _judge_frame(rows: List[dict]) -> pd.DataFrame:
+    """
+    Judge rows as a DataFrame with vote count and score variance columns (verdicts cached before
+    multi-vote judging existed count as a single vote)
+    """
+    return pd.DataFrame(
+        [
+            {**row, "votes": row.get("votes", 1), "score_variance": row.get("score_variance", float("nan"))}
+            for row in rows
+        ]
+    )
+
+
+def judge_with_llm(
+    samples: List[ExampleSample],
+    generated: list[dict],
+    api_key: str,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    controller: Optional[AdaptiveConcurrency] = None,
+    verdicts: Optional[VerdictCache] = None,
+    max_workers: int = DEFAULT_JUDGE_WORKERS,
+    votes: Optional[VotePolicy] = None,
+) -> pd.DataFrame:
     """
     Evaluate generated procedures using LLM-as-a-judge
+
+    Up to max_workers samples are judged concurrently (or as many as the controller allows).
+    Verdicts found in `verdicts` (same judge model, judge prompt version, input and steps) are
+    reused instead of judging the sample again.
+    With a multi-vote policy each sample is judged several times in parallel batches until the
+    confidence interval of total_score is narrow enough, and the votes are averaged; max_workers
+    (or the controller) then bounds the number of votes in flight across all samples.
+    """
+    votes = votes or VotePolicy()
+    pool = JudgePool(verdicts, max_workers=max_workers, controller=controller, votes=votes)
+    llm = LLMClient(OpenAI(api_key=api_key), cache=cache, telemetry=telemetry)
+    proc_map = {g["id"]: [Step(id=it["id"], text=it["text"]) for it in g["procedure_steps"]] for g in generated}
+
+    def make_task(sm: ExampleSample) -> JudgeTask:
+        steps = proc_map.get(sm.id, [])
+
+        def vote(i: int) -> dict:
+            request = build_judge_request(sm, steps)
+            if i:
+                # Later votes use a different seed so they are distinct requests (not served from the LLM cache)
+                request["seed"] = i
+            with llm_context(task_id=sm.id, phase="judge"):
+                completion = llm.parse(**request)
+            return _judge_row(sm.id, JudgeOutput.model_validate_json(completion.text))
+
+        return JudgeTask(sm.id, _verdict_key(sm, steps, votes.tag()), lambda: pool.vote(vote))
+
+    with tqdm(total=len(samples), desc="Evaluating procedures") as bar:
+        rows = pool.run(
+            [make_task(sm) for sm in samples],
+            fallback=lambda sample_id, notes: {**_judge_row(sample_id, notes=notes), "votes": 0},
+            on_result=lambda _: bar.update(),
+        )
+    print(f"⚖️ Judge: {pool.metrics()}")
+    return _judge_frame(rows)
+
+
+def judge_with_llm_batch(
+    samples: List[ExampleSample],
+    generated: list[dict],
+    backend: BatchBackend,
+    workdir: Path,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    poll_interval: float = 30.0,
+    verdicts: Optional[VerdictCache] = None,
+) -> pd.DataFrame:
+    """
+    Same as judge_with_llm, but submits every judge request as one Batch API job
+
+    Samples whose verdict is already in `verdicts` are left out of the batch.
     """
-    client = OpenAI(api_key=api_key)
     proc_map = {g["id"]: [Step(id=it["id"], text=it["text"]) for it in g["procedure_steps"]] for g in generated}
+    keys = {sm.id: _verdict_key(sm, proc_map.get(sm.id, [])) for sm in samples}
+    cached = {}
+    if verdicts is not None:
+        cached = {sm.id: verdict for sm in samples if (verdict := verdicts.get(keys[sm.id])) is not None}
+    items = [
+        BatchItem(sm.id, "chat.completions.parse", build_judge_request(sm, proc_map.get(sm.id, [])), phase="judge")
+        for sm in samples
+        if sm.id not in cached
+    ]
+    batch_results = {}
+    if items:
+        batch_results = run_batch(
+            items, backend, workdir, cache=cache, telemetry=telemetry, poll_interval=poll_interval
+        )
+    print(f"⚖️ Judge (batch): {len(items)} submitted, {len(cached)} cached verdicts reused")
+
     rows = []
-    quota_exhausted = False
-
-    def _is_insufficient_quota(err: Exception) -> bool:
-        s = str(err)
-        return "insufficient_quota" in s or "You exceeded your current quota" in s
-
-    for sm in tqdm(samples, desc="Evaluating procedures"):
-        if quota_exhausted:
-            print(f"⏭️ スキップ採点: {sm.id}（クォータ不足）")
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": 0.0,
-                    "specific_score": 0.0,
-                    "total_score": 0.0,
-                    "notes": "skipped_due_to_quota",
-                }
-            )
+    for sm in samples:
+        if sm.id in cached:
+            rows.append({**cached[sm.id], "id": sm.id})
             continue
-        steps = proc_map.get(sm.id, [])
-        msgs = build_judge_messages(sm, steps)
+        result = batch_results[sm.id]
         try:
-            completion = client.chat.completions.parse(
-                model=JUDGE_MODEL,
-                messages=msgs,
-                temperature=JUDGE_TEMPERATURE,
-                max_tokens=JUDGE_MAX_TOKENS,
-                response_format=JudgeOutput,
-            )
-            parsed: JudgeOutput = completion.choices[0].message.parsed
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": parsed.general_score,
-                    "specific_score": parsed.specific_score,
-                    "total_score": parsed.final_score,
-                    "notes": parsed.notes or "",
-                }
-            )
+            if not result.ok:
+                raise RuntimeError(result.error)
+            rows.append(_judge_row(sm.id, JudgeOutput.model_validate_json(result.text)))
         except Exception as e:
             print(f"❌ 評価失敗: {sm.id}: {e}")
-            if _is_insufficient_quota(e):
-                print("⚠️ APIクォータ不足のため、以降の採点を中断します。プラン/課金設定をご確認ください。")
-                quota_exhausted = True
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": 0.0,
-                    "specific_score": 0.0,
-                    "total_score": 0.0,
-                    "notes": "evaluation_failed",
-                }
-            )
-    return pd.DataFrame(rows)
+            rows.append({**_judge_row(sm.id, notes="evaluation_failed"), "votes": 0})
+            continue
+        if verdicts is not None:
+            verdicts.put(keys[sm.id], rows[-1])
+    return _judge_frame(rows)
 
 
 # ============================================================================
@@ -499,6 +707,65 @@ def judge_with_llm(samples: List[ExampleSample], generated: list[dict], api_key:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="LA-Bench 2025 Baseline (Responses API)")
+    parser.add_argument(
+        "--resume",
+        metavar="GENERATED_JSONL",
+        help="既存の generated_responses_*.jsonl を再利用し、未完了・失敗したサンプルのみ再生成する",
+    )
+    parser.add_argument("--llm-cache", default=str(DEFAULT_CACHE_PATH), help="LLMレスポンスキャッシュのパス")
+    parser.add_argument("--no-llm-cache", action="store_true", help="キャッシュを読まずにAPIを呼ぶ（結果は書き込む）")
+    parser.add_argument("--telemetry", default=str(DEFAULT_TELEMETRY_PATH), help="LLM呼び出しイベントを追記するJSONL")
+    parser.add_argument("--no-telemetry", action="store_true", help="LLM呼び出しイベントを記録しない")
+    parser.add_argument("--rpm", type=float, help="全LLM呼び出しで共有する1分あたりのリクエスト数上限")
+    parser.add_argument("--tpm", type=float, help="全LLM呼び出しで共有する1分あたりのトークン数上限")
+    parser.add_argument(
+        "--adaptive-concurrency",
+        type=int,
+        default=0,
+        metavar="MAX",
+        help="サンプルを並行処理し、同時実行数を MAX までAIMDで自動調整する（0: 逐次実行）",
+    )
+    parser.add_argument(
+        "--judge-concurrency",
+        type=int,
+        default=DEFAULT_JUDGE_WORKERS,
+        help="同時に実行する採点の数（--adaptive-concurrency を指定した場合はそちらで調整する）",
+    )
+    parser.add_argument(
+        "--judge-max-votes",
+        type=int,
+        default=1,
+        help="1サンプルを最大この回数だけ採点して平均する（1: 単発。--batch とは併用できない）",
+    )
+    parser.add_argument("--judge-vote-batch", type=int, default=3, help="複数回採点で並行に出す票の数")
+    parser.add_argument(
+        "--judge-ci-width",
+        type=float,
+        default=1.0,
+        help="total_score の95%%信頼区間の幅がこの値以下になったら、複数回採点を打ち切る",
+    )
+    parser.add_argument("--judge-cache", default=str(DEFAULT_VERDICT_CACHE_PATH), help="採点結果キャッシュのパス")
+    parser.add_argument(
+        "--no-judge-cache", action="store_true", help="生成手順が変わっていないサンプルも採点し直す（結果は書き込む）"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="生成と採点を Batch API でまとめて実行する（低コスト・高スループット）"
+    )
+    parser.add_argument(
+        "--batch-backend",
+        choices=["openai", "local"],
+        default="openai",
+        help="openai: Batch API に投入 / local: ファイルベースの代替（各リクエストを同期APIで処理。モックサーバー等での確認用）",
+    )
+    parser.add_argument(
+        "--batch-dir", default=str(OUTPUT_DIR / "batches"), help="Batch入力JSONL（とlocalの結果）の保存先"
+    )
+    parser.add_argument("--batch-poll", type=float, default=30.0, help="Batch完了を確認する間隔（秒）")
+    args = parser.parse_args()
+    if args.batch and args.judge_max_votes > 1:
+        parser.error("--judge-max-votes cannot be combined with --batch (votes are stopped early between rounds)")
+
     print("=" * 60)
     print("LA-Bench 2025 Baseline Implementation (Responses API)")
     print(f"実行時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -526,38 +793,102 @@ def main():
         print(f"❌ Load error: {e}")
         exit(1)
 
+    # Generated results are checkpointed to JSONL as each sample finishes
+    ts = time.strftime("%Y%m%d_%H%M%S")
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    if args.resume:
+        jsonl_path = Path(args.resume)
+        checkpoint = JsonlCheckpoint(jsonl_path)
+        print(f"🔁 Resume: {len(checkpoint.completed_ids())} samples already completed in {jsonl_path}")
+    else:
+        jsonl_path = OUTPUT_DIR / f"generated_responses_{ts}.jsonl"
+        checkpoint = JsonlCheckpoint(jsonl_path)
+        checkpoint.reset()
+
     # Generate outputs
     print("\n" + "=" * 60)
     print("Step 1: 実験手順の生成 (Responses API)")
     print("=" * 60)
-    generated_results = generate_outputs(samples, api_key)
+    cache = LLMCache(args.llm_cache, bypass=args.no_llm_cache)
+    telemetry = None if args.no_telemetry else LLMTelemetry(args.telemetry)
+    set_rate_limiter(RateLimiter(rpm=args.rpm, tpm=args.tpm))
+    batch_dir = Path(args.batch_dir)
+    if args.batch:
+        if args.batch_backend == "local":
+            backend = LocalBatchBackend(batch_dir, client_handler(OpenAI(api_key=api_key)))
+        else:
+            backend = OpenAIBatchBackend(OpenAI(api_key=api_key))
+        print(f"📦 Batch mode: backend={args.batch_backend}, poll every {args.batch_poll}s")
+        generated_results = generate_outputs_batch(
+            samples,
+            backend,
+            batch_dir,
+            checkpoint=checkpoint,
+            cache=cache,
+            telemetry=telemetry,
+            poll_interval=args.batch_poll,
+        )
+    else:
+        generate_controller = (
+            AdaptiveConcurrency(max_limit=args.adaptive_concurrency) if args.adaptive_concurrency else None
+        )
+        generated_results = generate_outputs(
+            samples, api_key, checkpoint=checkpoint, cache=cache, telemetry=telemetry, controller=generate_controller
+        )
     if generated_results:
         print(f"例: {generated_results[0]['id']} → {len(generated_results[0]['procedure_steps'])} steps")
 
-    # Save generated results to JSONL
-    ts = time.strftime("%Y%m%d_%H%M%S")
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    jsonl_path = OUTPUT_DIR / f"generated_responses_{ts}.jsonl"
-    with jsonl_path.open("w", encoding="utf-8") as f:
-        for rec in generated_results:
-            obj = {"id": rec["id"], "output": {"procedure_steps": rec["procedure_steps"]}}
-            line = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
-            f.write(line + "\n")
+    checkpoint.finalize(sm.id for sm in samples)
     print(f"📄 Saved JSONL: {jsonl_path}")
 
     # Evaluate with LLM-as-a-judge
     print("\n" + "=" * 60)
     print("Step 2: LLM-as-a-judge 評価")
     print("=" * 60)
-    df = judge_with_llm(samples, generated_results, api_key)
+    verdicts = VerdictCache(args.judge_cache, bypass=args.no_judge_cache)
+    if args.batch:
+        df = judge_with_llm_batch(
+            samples,
+            generated_results,
+            backend,
+            batch_dir,
+            cache=cache,
+            telemetry=telemetry,
+            poll_interval=args.batch_poll,
+            verdicts=verdicts,
+        )
+    else:
+        judge_controller = (
+            AdaptiveConcurrency(max_limit=args.adaptive_concurrency) if args.adaptive_concurrency else None
+        )
+        df = judge_with_llm(
+            samples,
+            generated_results,
+            api_key,
+            cache=cache,
+            telemetry=telemetry,
+            controller=judge_controller,
+            verdicts=verdicts,
+            max_workers=args.judge_concurrency,
+            votes=VotePolicy(args.judge_max_votes, args.judge_vote_batch, args.judge_ci_width),
+        )
+        if judge_controller:
+            print(
+                f"🔧 Adaptive concurrency: generate={generate_controller.metrics()} judge={judge_controller.metrics()}"
+            )
     print(f"✅ LLM-as-a-judge: Scored {len(df)} samples (0-10)")
     print("\n評価結果:")
-    print(df[["id", "general_score", "specific_score", "total_score"]])
+    print(df[["id", "general_score", "specific_score", "total_score", "votes", "score_variance"]])
 
     # Save evaluation results to CSV
     csv_path = OUTPUT_DIR / f"eval_responses_{ts}.csv"
     df.to_csv(csv_path, index=False, encoding="utf_8_sig")
     print(f"\n📄 Saved CSV: {csv_path}")
+    print(f"🗄️ LLM cache: {cache.stats()}")
+    print(f"🗄️ Verdict cache: {verdicts.stats()}")
+    print(f"🚦 Rate limiter: {get_rate_limiter().metrics()}")
+    if telemetry:
+        print(f"⏱️ LLM call events: {telemetry.path} (run {telemetry.run_id})")
 
     print("\n" + "=" * 60)
     print("✅ 処理完了")
@@ -7,9 +7,17 @@ GitHub: https://github.com/lasa-or-jp/la-bench.git
 Usage:
     export OPENAI_API_KEY="your-api-key"
     python baseline.py
+    LLM_CACHE_BYPASS=1 python baseline.py  # キャッシュ済みレスポンスを使わずに再生成
+    LLM_RPM=500 LLM_TPM=200000 python baseline.py  # 全LLM呼び出しで共有するレート上限
+    LLM_ADAPTIVE_MAX=16 python baseline.py  # サンプルを並行処理し、同時実行数を16までAIMDで調整
+    JUDGE_CONCURRENCY=16 python baseline.py  # 採点の同時実行数（LLM_ADAPTIVE_MAX がなければ。既定8）
+    JUDGE_CACHE_BYPASS=1 python baseline.py  # 生成手順が同じでも採点し直す（採点結果は JUDGE_CACHE_PATH に保存）
+    JUDGE_MAX_VOTES=9 python baseline.py  # 1サンプルを最大9回採点して平均（JUDGE_VOTE_BATCH 票ずつ並行に出し、
+                                          # total_score の95%信頼区間の幅が JUDGE_CI_WIDTH 以下になったら打ち切る）
 """
 
 import os
+import sys
 import json
 import time
 from datetime import datetime
@@ -38,6 +46,24 @@ except ImportError:
 # Progress bar
 from tqdm.auto import tqdm
 
+# Shared tools (src/tools)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from tools.adaptive_concurrency import AdaptiveConcurrency, run_adaptive
+from tools.judge_pool import (
+    DEFAULT_JUDGE_WORKERS,
+    DEFAULT_VERDICT_CACHE_PATH,
+    JudgePool,
+    JudgeTask,
+    VerdictCache,
+    VotePolicy,
+    verdict_key,
+)
+from tools.llm_cache import DEFAULT_CACHE_PATH, LLMCache
+from tools.llm_client import LLMClient
+from tools.llm_telemetry import DEFAULT_TELEMETRY_PATH, LLMTelemetry, llm_context
+from tools.output_constraints import FixResult, fix_steps
+from tools.rate_limiter import RateLimiter, get_rate_limiter, set_rate_limiter
+
 # Logging
 import logging
 
@@ -52,10 +78,15 @@ logger = logging.getLogger(__name__)
 # Model settings
 MODEL_NAME = "gpt-5-2025-08-07"
 TEMPERATURE = 1.0
+# 出力制約（50ステップ・各10文）は手元で直し、手順を読み取れない出力のときだけ再生成する
+GENERATE_MAX_ATTEMPTS = 2
+RETRY_NOTE = "前回の出力から手順を読み取れませんでした。procedure_steps にステップを1つ以上入れて出力してください。"
 
 # Judge model settings
 JUDGE_MODEL = "gpt-4.1-mini"
 JUDGE_TEMPERATURE = 0.2
+# 採点プロンプト（build_judge_messages）を変えたら上げる（採点結果のキャッシュキーに含まれる）
+JUDGE_PROMPT_VERSION = "1"
 
 # Input/Output paths
 JSONL_PATH = "data/public_test.jsonl"
@@ -272,33 +303,70 @@ def build_messages(sample: ExampleSample) -> list[dict]:
     ]
 
 
-def generate_outputs(samples: list[ExampleSample], api_key: str) -> list[dict]:
-    client = OpenAI(api_key=api_key)
-    results: list[dict] = []
-    for sm in tqdm(samples, desc="Generating procedures"):
+def parse_generated_steps(output_text: str) -> FixResult:
+    """
+    生成結果の JSON から手順を取り出し、出力制約（50ステップ・各10文・IDは1から連番）に合わせて手元で直す。
+    手順を読み取れない場合は、違反を残した FixResult を返す（呼び出し側で再生成する）
+    """
+    try:
+        data = json.loads(output_text or "")
+    except json.JSONDecodeError:
+        data = None
+    return fix_steps(data.get("procedure_steps") if isinstance(data, dict) else None)
+
+
+def generate_outputs(
+    samples: list[ExampleSample],
+    api_key: str,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    controller: Optional[AdaptiveConcurrency] = None,
+) -> list[dict]:
+    """controller を渡すとサンプルを並行に処理し、同時実行数を AIMD で調整する"""
+    llm = LLMClient(OpenAI(api_key=api_key), cache=cache, telemetry=telemetry)
+
+    def generate_one(sm: ExampleSample) -> dict:
         msgs = build_messages(sm)
         try:
-            completion = client.chat.completions.parse(
-                model=MODEL_NAME,
-                messages=msgs,
-                temperature=TEMPERATURE,
-                response_format=GeneratedOutput,
-            )
-            parsed: GeneratedOutput = completion.choices[0].message.parsed
-            steps = [Step(id=s.id, text=s.text) for s in sorted(parsed.procedure_steps, key=lambda x: x.id)][:50]
+            for attempt in range(1, GENERATE_MAX_ATTEMPTS + 1):
+                with llm_context(task_id=sm.id, phase="generate" if attempt == 1 else f"generate-attempt-{attempt}"):
+                    completion = llm.parse(
+                        model=MODEL_NAME,
+                        messages=msgs,
+                        temperature=TEMPERATURE,
+                        response_format=GeneratedOutput,
+                    )
+                fixed = parse_generated_steps(completion.text)
+                if fixed.ok or attempt == GENERATE_MAX_ATTEMPTS:
+                    break
+                print(f"⚠️ {sm.id}: 手順を読み取れないため再生成します: {fixed.violations[0].message}")
+                msgs = msgs + [{"role": "user", "content": RETRY_NOTE}]
+            if not fixed.ok:
+                raise ValueError(fixed.violations[0].message)
+            if fixed.fixes:
+                print(f"🔧 {sm.id}: {', '.join(fixed.fixes)}")
+            steps = [Step(id=s["id"], text=s["text"]) for s in fixed.steps]
         except Exception as e:
             print(f"❌ 生成失敗: {sm.id}: {e}")
             steps = []
-        results.append(
-            {
-                "id": sm.id,
-                "procedure_steps": [{"id": s.id, "text": s.text} for s in steps],
-            }
-        )
+        return {
+            "id": sm.id,
+            "procedure_steps": [{"id": s.id, "text": s.text} for s in steps],
+        }
+
+    results = _run_samples(samples, generate_one, controller, desc="Generating procedures")
     print(f"✅ 生成完了: {len(results)} samples")
     return results
 
 
+def _run_samples(samples: list, fn, controller: Optional[AdaptiveConcurrency], desc: str) -> list:
+    """サンプルごとの処理を順に、または controller の同時実行数で並行に実行する（結果は入力順）"""
+    if controller is None:
+        return [fn(sm) for sm in tqdm(samples, desc=desc)]
+    with tqdm(total=len(samples), desc=desc) as bar:
+        return run_adaptive(samples, fn, controller, on_result=lambda _: bar.update())
+
+
 # ============================================================================
 # Evaluation Functions
 # ============================================================================
@@ -354,63 +422,76 @@ def build_judge_messages(sample: ExampleSample, steps: List[Step]) -> list[dict]
     ]
 
 
-def judge_with_llm(samples: List[ExampleSample], generated: list[dict], api_key: str) -> pd.DataFrame:
-    client = OpenAI(api_key=api_key)
+def _judge_row(sample_id: str, parsed: Optional[JudgeOutput] = None, notes: str = "") -> dict:
+    if parsed is None:
+        return {"id": sample_id, "general_score": 0.0, "specific_score": 0.0, "total_score": 0.0, "notes": notes}
+    return {
+        "id": sample_id,
+        "general_score": parsed.general_score,
+        "specific_score": parsed.specific_score,
+        "total_score": parsed.final_score,
+        "notes": parsed.notes or "",
+    }
+
+
+def judge_with_llm(
+    samples: List[ExampleSample],
+    generated: list[dict],
+    api_key: str,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    controller: Optional[AdaptiveConcurrency] = None,
+    verdicts: Optional[VerdictCache] = None,
+    max_workers: int = DEFAULT_JUDGE_WORKERS,
+    votes: Optional[VotePolicy] = None,
+) -> pd.DataFrame:
+    """
+    max_workers 件ずつ並行に採点する（controller を渡すと同時実行数を AIMD で調整する）。
+    verdicts にある採点結果（採点モデル・採点プロンプトの版・入力・生成手順が同じもの）は採点し直さない。
+    votes を渡すと1サンプルを複数回採点して平均し、票数（votes）と total_score の分散（score_variance）を列に加える
+    （このとき max_workers・controller は全サンプル合わせた同時採点の票数の上限になる）
+    """
+    votes = votes or VotePolicy()
+    pool = JudgePool(verdicts, max_workers=max_workers, controller=controller, votes=votes)
+    llm = LLMClient(OpenAI(api_key=api_key), cache=cache, telemetry=telemetry)
     proc_map = {g["id"]: [Step(id=it["id"], text=it["text"]) for it in g["procedure_steps"]] for g in generated}
-    rows = []
-    quota_exhausted = False
-
-    def _is_insufficient_quota(err: Exception) -> bool:
-        s = str(err)
-        return "insufficient_quota" in s or "You exceeded your current quota" in s
-
-    for sm in tqdm(samples, desc="Evaluating procedures"):
-        if quota_exhausted:
-            print(f"⏭️ スキップ採点: {sm.id}（クォータ不足）")
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": 0.0,
-                    "specific_score": 0.0,
-                    "total_score": 0.0,
-                    "notes": "skipped_due_to_quota",
-                }
-            )
-            continue
+
+    def make_task(sm: ExampleSample) -> JudgeTask:
         steps = proc_map.get(sm.id, [])
-        msgs = build_judge_messages(sm, steps)
-        try:
-            completion = client.chat.completions.parse(
+
+        def vote(i: int) -> dict:
+            request = dict(
                 model=JUDGE_MODEL,
-                messages=msgs,
+                messages=build_judge_messages(sm, steps),
                 temperature=JUDGE_TEMPERATURE,
                 response_format=JudgeOutput,
             )
-            parsed: JudgeOutput = completion.choices[0].message.parsed
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": parsed.general_score,
-                    "specific_score": parsed.specific_score,
-                    "total_score": parsed.final_score,
-                    "notes": parsed.notes or "",
-                }
-            )
-        except Exception as e:
-            print(f"❌ 評価失敗: {sm.id}: {e}")
-            if _is_insufficient_quota(e):
-                print("⚠️ APIクォータ不足のため、以降の採点を中断します。プラン/課金設定をご確認ください。")
-                quota_exhausted = True
-            rows.append(
-                {
-                    "id": sm.id,
-                    "general_score": 0.0,
-                    "specific_score": 0.0,
-                    "total_score": 0.0,
-                    "notes": "evaluation_failed",
-                }
-            )
-    return pd.DataFrame(rows)
+            if i:
+                # 2票目以降は seed を変えて別のリクエストにする（キャッシュから同じ応答が返らないように）
+                request["seed"] = i
+            with llm_context(task_id=sm.id, phase="judge"):
+                completion = llm.parse(**request)
+            return _judge_row(sm.id, JudgeOutput.model_validate_json(completion.text))
+
+        key = verdict_key(
+            JUDGE_MODEL, JUDGE_PROMPT_VERSION, {"input": sm.input, "measurement": sm.measurement}, steps, votes.tag()
+        )
+        return JudgeTask(sm.id, key, lambda: pool.vote(vote))
+
+    with tqdm(total=len(samples), desc="Evaluating procedures") as bar:
+        rows = pool.run(
+            [make_task(sm) for sm in samples],
+            fallback=lambda sample_id, notes: {**_judge_row(sample_id, notes=notes), "votes": 0},
+            on_result=lambda _: bar.update(),
+        )
+    print(f"⚖️ Judge: {pool.metrics()}")
+    # 複数回採点を入れる前にキャッシュされた採点結果は1票
+    return pd.DataFrame(
+        [
+            {**row, "votes": row.get("votes", 1), "score_variance": row.get("score_variance", float("nan"))}
+            for row in rows
+        ]
+    )
 
 
 # ============================================================================
@@ -448,7 +529,17 @@ def main():
     print("\n" + "=" * 60)
     print("Step 1: 実験手順の生成")
     print("=" * 60)
-    generated_results = generate_outputs(samples, api_key)
+    cache = LLMCache(DEFAULT_CACHE_PATH, bypass=os.getenv("LLM_CACHE_BYPASS") == "1")
+    # LLM_TELEMETRY_PATH="" で計測を無効化
+    telemetry_path = os.getenv("LLM_TELEMETRY_PATH", str(DEFAULT_TELEMETRY_PATH))
+    telemetry = LLMTelemetry(telemetry_path) if telemetry_path else None
+    rpm, tpm = os.getenv("LLM_RPM"), os.getenv("LLM_TPM")
+    set_rate_limiter(RateLimiter(rpm=float(rpm) if rpm else None, tpm=float(tpm) if tpm else None))
+    adaptive_max = int(os.getenv("LLM_ADAPTIVE_MAX", "0"))
+    generate_controller = AdaptiveConcurrency(max_limit=adaptive_max) if adaptive_max else None
+    generated_results = generate_outputs(
+        samples, api_key, cache=cache, telemetry=telemetry, controller=generate_controller
+    )
     if generated_results:
         print(f"例: {generated_results[0]['id']} → {len(generated_results[0]['procedure_steps'])} steps")
 
@@ -467,15 +558,40 @@ def main():
     print("\n" + "=" * 60)
     print("Step 2: LLM-as-a-judge 評価")
     print("=" * 60)
-    df = judge_with_llm(samples, generated_results, api_key)
+    judge_controller = AdaptiveConcurrency(max_limit=adaptive_max) if adaptive_max else None
+    verdicts = VerdictCache(
+        os.getenv("JUDGE_CACHE_PATH", str(DEFAULT_VERDICT_CACHE_PATH)), bypass=os.getenv("JUDGE_CACHE_BYPASS") == "1"
+    )
+    df = judge_with_llm(
+        samples,
+        generated_results,
+        api_key,
+        cache=cache,
+        telemetry=telemetry,
+        controller=judge_controller,
+        verdicts=verdicts,
+        max_workers=int(os.getenv("JUDGE_CONCURRENCY", str(DEFAULT_JUDGE_WORKERS))),
+        votes=VotePolicy(
+            max_votes=int(os.getenv("JUDGE_MAX_VOTES", "1")),
+            batch_size=int(os.getenv("JUDGE_VOTE_BATCH", "3")),
+            ci_width=float(os.getenv("JUDGE_CI_WIDTH", "1.0")),
+        ),
+    )
     print(f"✅ LLM-as-a-judge: Scored {len(df)} samples (0-10)")
     print("\n評価結果:")
-    print(df[["id", "general_score", "specific_score", "total_score"]])
+    print(df[["id", "general_score", "specific_score", "total_score", "votes", "score_variance"]])
 
     # Save evaluation results to CSV
     csv_path = OUTPUT_DIR / f"eval_llm_{ts}.csv"
     df.to_csv(csv_path, index=False, encoding="utf_8_sig")
     print(f"\n📄 Saved CSV: {csv_path}")
+    print(f"🗄️ LLM cache: {cache.stats()}")
+    print(f"🗄️ Verdict cache: {verdicts.stats()}")
+    print(f"🚦 Rate limiter: {get_rate_limiter().metrics()}")
+    if generate_controller and judge_controller:
+        print(f"🔧 Adaptive concurrency: generate={generate_controller.metrics()} judge={judge_controller.metrics()}")
+    if telemetry:
+        print(f"⏱️ LLM call events: {telemetry.path} (run {telemetry.run_id})")
 
     print("\n" + "=" * 60)
     print("✅ 処理完了")
@@ -0,0 +1,178 @@
+"""
+LLMワーカーの同時実行数の適応制御（AIMD）。
+処理が健全（429なし・レイテンシが平常）な間は同時実行数を加算的に増やし、
+429 やレイテンシの急増を観測したら乗算的に減らす（TCP の輻輳制御と同じ考え方）。
+同時実行数が変わるたびに経過時間とともに記録・表示する。
+
+    controller = AdaptiveConcurrency(initial=2, max_limit=16)
+    results = run_adaptive(items, fn, controller)
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from tools.rate_limiter import track_throttles
+
+# レイテンシの基準値（平常時の指数移動平均）の平滑化係数
+EWMA_ALPHA = 0.2
+
+
+class AdaptiveConcurrency:
+    """AIMD で上限を調整するセマフォ（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        initial: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        decrease_factor: float = 0.5,
+        latency_factor: float = 2.0,
+        warmup: int = 5,
+        log: Optional[Callable[[str], None]] = print,
+    ):
+        """
+        Args:
+            initial, min_limit, max_limit: 同時実行数の初期値と範囲
+            decrease_factor: 混雑を観測したときに上限に掛ける係数
+            latency_factor: 平常時の何倍のレイテンシを急増とみなすか
+            warmup: レイテンシの急増判定を始めるまでに必要な平常時の完了数
+            log: 同時実行数が変わったときのメッセージの出力先（None なら出力しない）
+        """
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.warmup = warmup
+        self.log = log
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._healthy_streak = 0
+        self._healthy_count = 0
+        self._baseline: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self._started = time.monotonic()
+        self.history: List[Dict[str, Any]] = [{"t": 0.0, "limit": self.limit, "reason": "initial"}]
+        self.counters = {
+            "completed": 0,
+            "failed": 0,
+            "throttled": 0,
+            "latency_spikes": 0,
+            "increases": 0,
+            "decreases": 0,
+        }
+
+    def acquire(self) -> float:
+        """空きができるまで待って1枠を確保し、開始時刻を返す"""
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(
+        self, started: float, throttled: bool = False, failed: bool = False, latency: Optional[float] = None
+    ) -> None:
+        """
+        枠を返し、その処理の結果（429 を受けたか・失敗したか・レイテンシ）で上限を調整する。
+        latency を省略した場合は started からの経過時間を使う。
+        """
+        now = time.monotonic()
+        if latency is None:
+            latency = now - started
+        with self._cond:
+            self._in_flight -= 1
+            self.counters["completed"] += 1
+            spike = (
+                self._baseline is not None
+                and self._healthy_count >= self.warmup
+                and latency > self.latency_factor * self._baseline
+            )
+            if throttled or spike:
+                self.counters["throttled" if throttled else "latency_spikes"] += 1
+                self._healthy_streak = 0
+                # 減らした後に開始した処理の結果だけで次の減少を判断する（1回の混雑で何度も半減しない）
+                if started >= self._last_decrease:
+                    self._last_decrease = now
+                    reason = "throttled" if throttled else f"latency {latency:.1f}s > {self.latency_factor:g}x baseline"
+                    self._set_limit(max(self.min_limit, int(self.limit * self.decrease_factor)), reason)
+            elif failed:
+                self.counters["failed"] += 1
+                self._healthy_streak = 0
+            else:
+                self._healthy_count += 1
+                self._baseline = (
+                    latency if self._baseline is None else ((1 - EWMA_ALPHA) * self._baseline + EWMA_ALPHA * latency)
+                )
+                # 上限1回分（≒1往復分）の完了が全て健全なら1増やす
+                self._healthy_streak += 1
+                if self._healthy_streak >= self.limit and self.limit < self.max_limit:
+                    self._healthy_streak = 0
+                    self._set_limit(self.limit + 1, "healthy")
+            self._cond.notify_all()
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        if limit == self.limit:
+            return
+        elapsed = time.monotonic() - self._started
+        self.counters["increases" if limit > self.limit else "decreases"] += 1
+        if self.log:
+            self.log(f"🔧 concurrency {self.limit} → {limit} at {elapsed:.1f}s ({reason})")
+        self.limit = limit
+        self.history.append({"t": round(elapsed, 3), "limit": limit, "reason": reason})
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """with ブロックの間1枠を使う。ブロック内の LLM 呼び出しが 429 を受けたかを自動で判定する"""
+        started = self.acquire()
+        failed = False
+        with track_throttles() as throttles:
+            try:
+                yield
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self.release(started, throttled=throttles[0] > 0, failed=failed)
+
+    def metrics(self) -> Dict[str, Any]:
+        """現在の上限、時間加重平均の上限、調整回数など"""
+        with self._cond:
+            elapsed = time.monotonic() - self._started
+            area = 0.0
+            for current, following in zip(self.history, self.history[1:] + [{"t": elapsed}]):
+                area += current["limit"] * (following["t"] - current["t"])
+            return {
+                "limit": self.limit,
+                "mean_limit": round(area / elapsed, 2) if elapsed > 0 else float(self.limit),
+                "max_limit_seen": max(h["limit"] for h in self.history),
+                "baseline_latency_s": round(self._baseline, 3) if self._baseline is not None else None,
+                **self.counters,
+            }
+
+
+def run_adaptive(
+    items: Sequence[Any],
+    fn: Callable[[Any], Any],
+    controller: AdaptiveConcurrency,
+    on_result: Optional[Callable[[Any], None]] = None,
+) -> List[Any]:
+    """
+    items を fn で並行に処理し、入力順の結果を返す。同時に実行する数は controller が決める。
+    on_result は各結果が出た時点で（完了順に）呼ばれる。fn の例外はそのまま送出する。
+    """
+
+    def work(item):
+        with controller.slot():
+            return fn(item)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(controller.max_limit, len(items)))) as executor:
+        futures = [executor.submit(work, item) for item in items]
+        if on_result:
+            for future in as_completed(futures):
+                on_result(future.result())
+        return [future.result() for future in futures]
@@ -1,29 +1,191 @@
 import requests
 import sys
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 
+from requests.adapters import HTTPAdapter
 
-def fetch_text(url: str) -> str:
+sys.path.append(str(Path(__file__).parent.parent))
+from tools.reference_store import ReferenceStore, get_reference_store
+
+# Jina Reader API（URLの前に付けるとMarkdown化した本文を返す）
+JINA_READER_PREFIX = "https://r.jina.ai/"
+DEFAULT_TIMEOUT = 30
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0 (ResearchBot/1.0)"}
+
+# 全タスクで共有するkeep-aliveコネクションプール
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """プロセス共有の requests.Session を返す（同一ホストへの接続を再利用する）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+
+def extract_url(text: str) -> Optional[str]:
+    """参考文献の記述からURLを取り出す（簡易ヒューリスティック）"""
+    return next((w for w in text.split() if w.startswith("http")), None)
+
+
+def fetch_text(
+    url: str,
+    timeout: float = DEFAULT_TIMEOUT,
+    reader_prefix: str = JINA_READER_PREFIX,
+    store: Optional[ReferenceStore] = None,
+) -> str:
     """
     指定されたURLからテキストを取得し、Jina Readerを使用してMarkdown形式で返す。
+    参考文献キャッシュ（ReferenceStore）に有効な文書があればネットワークにはアクセスしない。
     """
+    store = store or get_reference_store()
+    # Jina Reader APIを使用
+    jina_url = f"{reader_prefix}{url}"
+
+    cached = store.get(jina_url)
+    if cached is not None and (store.offline or store.is_fresh(cached)):
+        return cached.text
+    if store.offline:
+        return f"Error fetching {url}: not in reference cache (offline mode)"
+
     try:
-        # Jina Reader APIを使用
-        jina_url = f"https://r.jina.ai/{url}"
-        headers = {"User-Agent": "Mozilla/5.0 (ResearchBot/1.0)"}
+        headers = {}
+        if cached is not None:
+            # 期限切れのキャッシュは条件付きリクエストで再検証する
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
 
-        response = requests.get(jina_url, headers=headers, timeout=30)
+        response = get_session().get(jina_url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            store.touch(cached)
+            return cached.text
         response.raise_for_status()
 
+        store.save(jina_url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
         return response.text
 
     except Exception as e:
+        if cached is not None:
+            # 再検証に失敗した場合は期限切れでもキャッシュを使う
+            return cached.text
         return f"Error fetching {url}: {str(e)}"
 
 
+def fetch_many(
+    urls: List[str],
+    deadline: Optional[float] = None,
+    max_workers: int = 8,
+    per_host_limit: int = 4,
+    timeout: float = DEFAULT_TIMEOUT,
+    reader_prefix: str = JINA_READER_PREFIX,
+    store: Optional[ReferenceStore] = None,
+) -> Dict[str, str]:
+    """
+    複数のURLを並行に取得する。
+
+    Args:
+        urls: 取得するURLのリスト
+        deadline: 全体の制限時間（秒）。超えた時点で取得済みの分だけを返す
+        max_workers: 全体の同時接続数
+        per_host_limit: 接続先ホストごとの同時接続数
+        timeout: 1リクエストあたりのタイムアウト（秒）
+        reader_prefix: URLの前に付けるリーダーAPIのプレフィックス（"" なら直接取得）
+        store: 参考文献キャッシュ（省略時はプロセス共有のデフォルト）
+
+    Returns:
+        URL → 取得結果。制限時間内に終わらなかったURLは含まれない
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+
+    started = time.monotonic()
+    host_limits: Dict[str, threading.BoundedSemaphore] = {}
+    host_limits_lock = threading.Lock()
+
+    def remaining() -> Optional[float]:
+        if deadline is None:
+            return None
+        return deadline - (time.monotonic() - started)
+
+    def fetch_one(url: str) -> str:
+        host = urlsplit(f"{reader_prefix}{url}").netloc
+        with host_limits_lock:
+            semaphore = host_limits.setdefault(host, threading.BoundedSemaphore(per_host_limit))
+        with semaphore:
+            left = remaining()
+            if left is not None and left <= 0:
+                raise TimeoutError("deadline exceeded")
+            return fetch_text(
+                url,
+                timeout=timeout if left is None else min(timeout, left),
+                reader_prefix=reader_prefix,
+                store=store,
+            )
+
+    results: Dict[str, str] = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(fetch_one, url): url for url in urls}
+        pending = set(futures)
+        while pending:
+            left = remaining()
+            if left is not None and left <= 0:
+                break
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    results[futures[future]] = future.result()
+    finally:
+        # 制限時間を過ぎたリクエストの完了は待たない
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def warm_references(jsonl_paths: List[str]) -> Dict[str, str]:
+    """JSONLファイル内の全参考文献を取得してキャッシュに載せる"""
+    urls = []
+    for path in jsonl_paths:
+        for line in Path(path).read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            for ref in json.loads(line).get("input", {}).get("references", []):
+                url = extract_url(ref if isinstance(ref, str) else ref.get("text", ""))
+                if url:
+                    urls.append(url)
+    return fetch_many(urls)
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python fetch_url.py <url>")
+        print("       python fetch_url.py --warm <input.jsonl> [...]")
         sys.exit(1)
 
+    if sys.argv[1] == "--warm":
+        fetched = warm_references(sys.argv[2:])
+        failed = [url for url, text in fetched.items() if text.startswith("Error fetching")]
+        print(f"Cached {len(fetched) - len(failed)} references ({len(failed)} failed)")
+        for url in failed:
+            print(f"  Failed: {url}")
+        sys.exit(0)
+
     url = sys.argv[1]
     print(fetch_text(url))
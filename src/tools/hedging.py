@@ -0,0 +1,161 @@
+"""
+LLM呼び出しのヘッジ（テールレイテンシ対策、オプトイン）。
+呼び出しがフェーズごとに観測したレイテンシのパーセンタイルを過ぎても返らなければ同じリクエストをもう1本送り、
+先に成功した方を採用する。もう一方は再試行を打ち切り、結果は捨てる
+（同期クライアントでは送信済みのHTTPリクエストは止められないため、その分も追加コストとして数える）。
+追加で送るリクエストの割合には上限を設ける。
+
+    llm = LLMClient(client, hedge=HedgePolicy(percentile=95, max_extra_ratio=0.1))
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from tools.llm_telemetry import percentile
+
+
+class HedgeCancelled(Exception):
+    """もう一方が先に成功したため、このリクエストの（再）試行を打ち切った"""
+
+
+@dataclass
+class CallOutcome:
+    """1本のリクエスト（再試行を含む）の結果"""
+
+    value: Any = None
+    error: Optional[Exception] = None
+    retries: int = 0
+    latency_s: float = 0.0
+
+
+def phase_key(phase: Optional[str]) -> str:
+    """ "2-attempt-3" のような試行番号付きのフェーズは同じ分布として扱う"""
+    return (phase or "-").split("-attempt")[0]
+
+
+class HedgePolicy:
+    """フェーズごとのレイテンシ分布からヘッジを出す時刻を決め、追加リクエストの割合を制限する（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_extra_ratio: float = 0.1,
+        min_samples: int = 20,
+        min_delay: float = 1.0,
+        window: int = 200,
+    ):
+        """
+        Args:
+            percentile: このパーセンタイルのレイテンシを過ぎたらヘッジを出す
+            max_extra_ratio: ヘッジとして追加で送るリクエストの、全呼び出しに対する割合の上限
+            min_samples: フェーズごとに、ヘッジを始めるまでに必要な観測数
+            min_delay: ヘッジを出すまでの最短の待ち時間（秒）
+            window: フェーズごとに保持する直近のレイテンシの数
+        """
+        self.percentile = percentile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "hedges_fired": 0, "hedges_won": 0, "skipped_budget": 0}
+
+    def hedge_delay(self, phase: Optional[str]) -> Optional[float]:
+        """ヘッジを出すまでの待ち時間（観測が足りなければ None = ヘッジしない）"""
+        with self._lock:
+            latencies = self._latencies.get(phase_key(phase))
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            return max(self.min_delay, percentile(list(latencies), self.percentile))
+
+    def observe(self, phase: Optional[str], latency_s: float) -> None:
+        with self._lock:
+            key = phase_key(phase)
+            if key not in self._latencies:
+                self._latencies[key] = deque(maxlen=self.window)
+            self._latencies[key].append(latency_s)
+
+    def _try_fire(self) -> bool:
+        with self._lock:
+            if self._counters["hedges_fired"] + 1 > self.max_extra_ratio * self._counters["calls"]:
+                self._counters["skipped_budget"] += 1
+                return False
+            self._counters["hedges_fired"] += 1
+            return True
+
+    def run(
+        self, launch: Callable[[threading.Event], CallOutcome], phase: Optional[str]
+    ) -> Tuple[CallOutcome, bool, bool]:
+        """
+        launch(cancelled) を実行し、必要ならヘッジとしてもう1本実行する。
+        launch は例外を送出せず CallOutcome を返し、cancelled がセットされたら再試行をやめること。
+
+        Returns:
+            (採用した結果, ヘッジを出したか, ヘッジが勝ったか)。両方失敗した場合は元のリクエストの結果
+        """
+        with self._lock:
+            self._counters["calls"] += 1
+        cancelled = threading.Event()
+        started = time.perf_counter()
+        primary = _start(launch, cancelled)
+        roles = {primary: "primary"}
+
+        delay = self.hedge_delay(phase)
+        if delay is not None and not wait([primary], timeout=delay).done and self._try_fire():
+            roles[_start(launch, cancelled)] = "hedge"
+        fired = len(roles) > 1
+
+        pending = set(roles)
+        failures: Dict[str, CallOutcome] = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                if outcome.error is None:
+                    cancelled.set()
+                    won = roles[future] == "hedge"
+                    # 呼び出し元から見たレイテンシ（元のリクエストの開始から）を記録する。
+                    # ヘッジ自身のレイテンシを記録すると、ヘッジが勝つたびにパーセンタイルが下がってしまう
+                    self.observe(phase, time.perf_counter() - started)
+                    if won:
+                        with self._lock:
+                            self._counters["hedges_won"] += 1
+                    return outcome, fired, won
+                failures[roles[future]] = outcome
+        return failures["primary"], fired, False
+
+    def metrics(self) -> Dict[str, Any]:
+        """ヘッジを出した回数・勝った回数・追加リクエストの割合と、フェーズごとの現在の待ち時間"""
+        with self._lock:
+            counters = dict(self._counters)
+            phases = list(self._latencies)
+        return {
+            **counters,
+            "extra_ratio": round(counters["hedges_fired"] / counters["calls"], 3) if counters["calls"] else 0.0,
+            "win_rate": (
+                round(counters["hedges_won"] / counters["hedges_fired"], 3) if counters["hedges_fired"] else 0.0
+            ),
+            "delay_s": {phase: self.hedge_delay(phase) for phase in phases},
+        }
+
+
+def _start(launch: Callable[[threading.Event], CallOutcome], cancelled: threading.Event) -> Future:
+    """launch を別スレッドで開始する（llm_context などのコンテキスト変数を引き継ぐ）"""
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def target():
+        started = time.perf_counter()
+        try:
+            future.set_result(context.run(launch, cancelled))
+        except Exception as e:  # launch は例外を送出しない約束だが、念のため結果に変換する
+            future.set_result(CallOutcome(error=e, latency_s=time.perf_counter() - started))
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
@@ -0,0 +1,96 @@
+"""
+完了したタスク結果を1件ずつ追記するJSONLチェックポイント。
+プロセスが途中で落ちても完了済みの結果は失われず、--resume で未完了分のみ再実行できる。
+"""
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Set
+
+
+def is_error_record(record: dict) -> bool:
+    """失敗として書き出されたレコードか（手順が空、または "Error:" で始まるフォールバック）"""
+    steps = record.get("output", {}).get("procedure_steps", [])
+    if not steps:
+        return True
+    return str(steps[0].get("text", "")).startswith("Error:")
+
+
+class JsonlCheckpoint:
+    """{"id": ..., "output": {...}} 形式のレコードを逐次保存する出力ファイル"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    def reset(self) -> None:
+        """既存の出力を破棄して空のファイルから始める"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text("", encoding="utf-8")
+        self._tail_checked = True
+
+    def load(self) -> Dict[str, dict]:
+        """保存済みレコードを id → レコードで返す（同じidは後の行が優先、壊れた行は無視）"""
+        records: Dict[str, dict] = {}
+        if not self.path.exists():
+            return records
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中で中断された末尾行
+                continue
+            if "id" in record:
+                records[str(record["id"])] = record
+        return records
+
+    def completed_ids(self) -> Set[str]:
+        """正常に完了したタスクのid（エラーで終わったものは含まない）"""
+        return {task_id for task_id, record in self.load().items() if not is_error_record(record)}
+
+    def append(self, record: dict) -> None:
+        """1レコードを追記し、ディスクまでフラッシュする（スレッドセーフ）"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if not self._tail_checked:
+                # 前回の実行が書き込み途中で落ちていた場合、壊れた行と連結しないよう改行で区切る
+                if self.path.exists() and self.path.stat().st_size > 0:
+                    with open(self.path, "rb") as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = "\n" + line
+                self._tail_checked = True
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def finalize(self, ordered_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        レコードを ordered_ids の順に並べ替えて書き直す。
+        一時ファイルに書いてから置き換えるため、途中で中断されても既存の出力は壊れない。
+        """
+        with self._lock:
+            records = self.load()
+            ordered = [records[str(task_id)] for task_id in ordered_ids if str(task_id) in records]
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for record in ordered:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        return records
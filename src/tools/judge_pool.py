@@ -0,0 +1,381 @@
+"""
+LLM-as-a-judge の並行採点と、採点結果（verdict）のキャッシュ。
+
+    pool = JudgePool(VerdictCache(), max_workers=8)
+    tasks = [JudgeTask(sm.id, verdict_key(JUDGE_MODEL, JUDGE_PROMPT_VERSION, sm.input, steps), judge_fn) ...]
+    rows = pool.run(tasks, fallback=lambda sample_id, notes: {...})
+
+- 採点結果は (採点モデル, 採点プロンプトの版, サンプルの入力, 生成手順) のハッシュをキーに保存し、
+  生成手順が変わっていないサンプルは採点し直さない。LLMレスポンスキャッシュと違い、リクエストの細部
+  （max_tokens など）や LLM_CACHE_BYPASS の影響を受けないので、採点プロンプトを変えたときは版を上げる。
+- 採点は上限つきのワーカープール（controller を渡した場合は AIMD で調整する同時実行数）で並行に行い、
+  結果は入力順に返す。
+- クォータ不足を一度検出したら、まだ送っていない採点・再試行待ちの採点をすべて打ち切る（全ワーカーで共有）。
+- 1サンプルを複数回採点（投票）する場合は JudgePool(votes=VotePolicy(...)) の vote() を使う。batch_size 票ずつ
+  並行に採点し、total_score の95%信頼区間の幅が閾値以下になった時点（または max_votes 票）で打ち切って平均する。
+  票は1票ずつプールの枠を使うので、同時に送る採点の数は全サンプル合わせて max_workers（controller）の範囲に収まる。
+"""
+
+import contextvars
+import dataclasses
+import hashlib
+import json
+import math
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tools.adaptive_concurrency import AdaptiveConcurrency, run_adaptive
+from tools.llm_cache import LLMCache
+from tools.llm_client import LLMCallCancelled, llm_cancel_scope
+
+DEFAULT_VERDICT_CACHE_PATH = Path("workspace/judge_verdicts.sqlite")
+DEFAULT_JUDGE_WORKERS = 8
+
+SKIPPED_DUE_TO_QUOTA = "skipped_due_to_quota"
+EVALUATION_FAILED = "evaluation_failed"
+
+
+def _canonical(value: Any) -> Any:
+    """キー計算用に、dataclass・集合・pydanticモデルを含む値を順序の決まったJSON化可能な形にする"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {f.name: _canonical(getattr(value, f.name)) for f in dataclasses.fields(value)}
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump())
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=lambda v: json.dumps(v, ensure_ascii=False, sort_keys=True))
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def verdict_key(judge_model: str, prompt_version: str, sample_input: Any, steps: Any, mode: str = "") -> str:
+    """
+    採点結果のキャッシュキー（SHA-256）。sample_input には採点プロンプトに入るもの（入力・個別採点基準）を渡す。
+    mode は採点方法（VotePolicy.tag()。単発の採点は空）で、採点方法の違う結果を取り違えないためのもの
+    """
+    fields = {
+        "judge_model": judge_model,
+        "prompt_version": prompt_version,
+        "input": _canonical(sample_input),
+        "steps": _canonical(steps),
+    }
+    if mode:
+        fields["mode"] = mode
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 95%信頼区間に使う t 分布の両側 2.5% 点（自由度 1〜30。それ以上は正規分布で近似する）
+_T_975 = [
+    12.706,
+    4.303,
+    3.182,
+    2.776,
+    2.571,
+    2.447,
+    2.365,
+    2.306,
+    2.262,
+    2.228,
+    2.201,
+    2.179,
+    2.160,
+    2.145,
+    2.131,
+    2.120,
+    2.110,
+    2.101,
+    2.093,
+    2.086,
+    2.080,
+    2.074,
+    2.069,
+    2.064,
+    2.060,
+    2.056,
+    2.052,
+    2.048,
+    2.045,
+    2.042,
+]
+
+
+def t_critical(df: int) -> float:
+    return _T_975[df - 1] if df <= len(_T_975) else 1.96
+
+
+@dataclass
+class VotePolicy:
+    """複数回採点（投票）の設定"""
+
+    max_votes: int = 1  # 1 なら単発の採点
+    batch_size: int = 3  # 並行に出す票の数（1回目の判定には2票以上が必要）
+    ci_width: float = 1.0  # 打ち切る95%信頼区間の幅（上限 - 下限、total_score の単位）
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_votes > 1
+
+    def tag(self) -> str:
+        """採点結果のキャッシュキーに含める採点方法（単発は空）"""
+        return f"votes:{self.batch_size}/{self.max_votes}/ci{self.ci_width:g}" if self.enabled else ""
+
+
+class RunningStats:
+    """得点の逐次の平均・分散（Welford 法）"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> float:
+        """不偏分散（1票では定義できないので NaN）"""
+        return self._m2 / (self.n - 1) if self.n > 1 else math.nan
+
+    def ci_width(self) -> float:
+        """平均の95%信頼区間の幅（1票では無限大）"""
+        if self.n < 2:
+            return math.inf
+        return 2 * t_critical(self.n - 1) * math.sqrt(self.variance / self.n)
+
+
+def run_votes(
+    vote: Callable[[int], Dict[str, Any]],
+    policy: VotePolicy,
+    score_key: str = "total_score",
+    slot: Optional[Callable[[], ContextManager]] = None,
+) -> Dict[str, Any]:
+    """
+    vote(票の番号) で採点した行を batch_size 票ずつ並行に集め、score_key の信頼区間の幅が
+    policy.ci_width 以下になるか max_votes 票に達したら打ち切る。
+    数値の列は全票の平均にし、票数（votes）と score_key の分散（score_variance）の列を加えた行を返す。
+    slot を渡すと各票を with slot(): の中で採点する（複数サンプルの票で同時実行数の上限を共有するため）。
+    どれかの票が例外を送出した場合は、その例外をそのまま送出する。
+    """
+    slot = slot or nullcontext
+
+    def cast(i: int) -> Dict[str, Any]:
+        with slot():
+            return vote(i)
+
+    rows: List[Dict[str, Any]] = []
+    stats = RunningStats()
+    max_votes = max(1, policy.max_votes)
+    # 信頼区間には2票以上が必要なので、最初は batch_size が1でも2票出す
+    first_batch = min(max(policy.batch_size, 2), max_votes)
+    with ThreadPoolExecutor(max_workers=max(first_batch, policy.batch_size)) as executor:
+        while len(rows) < max_votes:
+            size = min(policy.batch_size if rows else first_batch, max_votes - len(rows))
+            # 票を出すスレッドでも、呼び出し元の計測・打ち切り（llm_context / llm_cancel_scope）を引き継ぐ
+            futures = [executor.submit(contextvars.copy_context().run, cast, len(rows) + i) for i in range(size)]
+            for future in futures:
+                rows.append(future.result())
+                stats.add(float(rows[-1][score_key]))
+            if stats.ci_width() <= policy.ci_width:
+                break
+
+    numeric = [key for key, value in rows[0].items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    merged = {**rows[0], **{key: sum(float(row[key]) for row in rows) / len(rows) for key in numeric}}
+    merged["votes"] = len(rows)
+    merged["score_variance"] = stats.variance
+    return merged
+
+
+class VerdictCache:
+    """採点結果（CSVの1行分の dict）の永続キャッシュ（保存先は LLMCache と同じ形式の SQLite）"""
+
+    def __init__(self, path: str | Path = DEFAULT_VERDICT_CACHE_PATH, bypass: bool = False):
+        self._store = LLMCache(path, bypass=bypass)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._store.get(key)
+        return json.loads(value) if value is not None else None
+
+    def put(self, key: str, verdict: Dict[str, Any]) -> None:
+        self._store.put(key, json.dumps(verdict, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, int]:
+        return self._store.stats()
+
+
+def is_insufficient_quota(error: Exception) -> bool:
+    """APIのクォータ不足（課金上限）によるエラーか（待っても回復しないので、以降の採点をやめる）"""
+    s = str(error)
+    return "insufficient_quota" in s or "You exceeded your current quota" in s
+
+
+class QuotaGuard:
+    """
+    クォータ不足の検出を全ワーカーで共有する。
+    最初に検出したワーカーだけが警告を表示し、event をセットして、
+    llm_cancel_scope(event) 内で送信・再試行を待っている他の採点も打ち切る。
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.event.is_set()
+
+    def trip(self, error: Exception) -> bool:
+        """error がクォータ不足なら event をセットして True を返す"""
+        if not is_insufficient_quota(error):
+            return False
+        with self._lock:
+            first = not self.event.is_set()
+            self.event.set()
+        if first:
+            print("⚠️ APIクォータ不足のため、以降の採点を中断します。プラン/課金設定をご確認ください。")
+        return True
+
+
+@dataclass
+class JudgeTask:
+    """1サンプル分の採点"""
+
+    id: str
+    key: str  # verdict_key() で計算した採点結果のキャッシュキー
+    judge: Callable[[], Dict[str, Any]]  # 採点してCSVの1行（dict）を返す。失敗時は例外を送出する
+
+
+class JudgePool:
+    """採点結果をキャッシュしながら、上限つきのワーカープールで並行に採点する"""
+
+    def __init__(
+        self,
+        cache: Optional[VerdictCache] = None,
+        max_workers: int = DEFAULT_JUDGE_WORKERS,
+        controller: Optional[AdaptiveConcurrency] = None,
+        votes: Optional[VotePolicy] = None,
+    ):
+        """
+        Args:
+            cache: 採点結果のキャッシュ（None なら毎回採点する）
+            max_workers: 同時に実行する採点の数（controller を渡した場合は controller が決める）
+            controller: 同時実行数を AIMD で調整する場合のコントローラー
+            votes: vote() で使う複数回採点の設定。複数回採点では同時実行数をサンプル単位ではなく票単位で数える
+        """
+        self.cache = cache
+        self.max_workers = max(1, max_workers)
+        self.controller = controller
+        self.votes = votes or VotePolicy()
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self.guard = QuotaGuard()
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        tasks: Sequence[JudgeTask],
+        fallback: Callable[[str, str], Dict[str, Any]],
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        全サンプルを採点し、入力順の行を返す。
+        キャッシュにある採点結果はそのまま使い、採点できなかったサンプルは fallback(サンプルID, notes) の行にする
+        （notes は "evaluation_failed" か "skipped_due_to_quota"。これらの行はキャッシュしない）。
+        on_result は各行が確定した時点で呼ばれる。
+        """
+        rows: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+        pending: List[Tuple[int, JudgeTask]] = []
+        for i, task in enumerate(tasks):
+            verdict = self.cache.get(task.key) if self.cache is not None else None
+            if verdict is None:
+                pending.append((i, task))
+                continue
+            rows[i] = {**verdict, "id": task.id}
+            self._count("cached")
+            if on_result:
+                on_result(rows[i])
+
+        def work(item: Tuple[int, JudgeTask]) -> Tuple[int, Dict[str, Any]]:
+            i, task = item
+            return i, self._judge(task, fallback)
+
+        def report(result: Tuple[int, Dict[str, Any]]) -> None:
+            if on_result:
+                on_result(result[1])
+
+        if self.controller is not None and not self.votes.enabled:
+            results = run_adaptive(pending, work, self.controller, on_result=report)
+        elif pending:
+            # 複数回採点では各票が vote() で枠を取るので、ここではサンプルを並べるだけで枠は取らない
+            workers = self.controller.max_limit if self.controller is not None else self.max_workers
+            with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                futures = [executor.submit(work, item) for item in pending]
+                results = []
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    report(results[-1])
+        else:
+            results = []
+        for i, row in results:
+            rows[i] = row
+        return rows
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """with ブロックの間、採点1回分の枠を使う（controller があれば AIMD の枠、なければ max_workers 個の枠）"""
+        if self.controller is not None:
+            with self.controller.slot():
+                yield
+        else:
+            with self._slots:
+                yield
+
+    def vote(self, vote: Callable[[int], Dict[str, Any]], score_key: str = "total_score") -> Dict[str, Any]:
+        """
+        self.votes の設定で run_votes() する（JudgeTask.judge から呼ぶ）。
+        複数回採点では各票がこのプールの枠を1つずつ使うので、全サンプルの票を合わせても同時実行数は上限を超えない。
+        単発の採点では run() がサンプルごとに枠を取っているので、ここでは取らない。
+        """
+        return run_votes(vote, self.votes, score_key, slot=self.slot if self.votes.enabled else None)
+
+    def _judge(self, task: JudgeTask, fallback: Callable[[str, str], Dict[str, Any]]) -> Dict[str, Any]:
+        if self.guard.exhausted:
+            print(f"⏭️ スキップ採点: {task.id}（クォータ不足）")
+            self._count("skipped")
+            return fallback(task.id, SKIPPED_DUE_TO_QUOTA)
+        try:
+            with llm_cancel_scope(self.guard.event):
+                row = task.judge()
+        except LLMCallCancelled:
+            print(f"⏭️ スキップ採点: {task.id}（クォータ不足）")
+            self._count("skipped")
+            return fallback(task.id, SKIPPED_DUE_TO_QUOTA)
+        except Exception as e:
+            print(f"❌ 評価失敗: {task.id}: {e}")
+            self.guard.trip(e)
+            self._count("failed")
+            return fallback(task.id, EVALUATION_FAILED)
+
+        if self.cache is not None:
+            self.cache.put(task.key, row)
+        self._count("judged")
+        return row
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def metrics(self) -> Dict[str, int]:
+        """採点した数・キャッシュから返した数・失敗した数・クォータ不足でスキップした数"""
+        with self._lock:
+            return {name: self._counts[name] for name in ("judged", "cached", "failed", "skipped")}
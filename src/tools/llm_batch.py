@@ -0,0 +1,308 @@
+"""
+OpenAI Batch API によるLLM呼び出しのまとめて実行。
+全リクエストをBatch形式のJSONLに書き出して投入し、完了までポーリングしてから
+custom_id で結果を呼び出し元に対応付ける。
+
+投入・ポーリングはバックエンドとして差し替えられる:
+    OpenAIBatchBackend: files / batches API を使う本番用
+    LocalBatchBackend:  ディレクトリ上でJSONLを処理するローカルの代替（テスト・オフライン用）
+
+LLMCache・LLMTelemetry は LLMClient と同じキーと形式で使うため、
+バッチで得た結果は通常の（同期）呼び出しでもキャッシュヒットする。
+"""
+
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from tools.llm_cache import LLMCache
+from tools.llm_client import is_cacheable
+from tools.llm_telemetry import LLMTelemetry, llm_context, normalize_usage
+
+# LLMClient のエンドポイント名 → Batch API の url
+BATCH_URLS = {
+    "chat.completions.create": "/v1/chat/completions",
+    "chat.completions.parse": "/v1/chat/completions",
+    "responses.create": "/v1/responses",
+}
+# 1バッチあたりのリクエスト数の上限（Batch API の制限）
+MAX_BATCH_REQUESTS = 50_000
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchItem:
+    """バッチで送る1リクエスト（request は LLMClient に渡すのと同じキーワード引数）"""
+
+    custom_id: str
+    endpoint: str
+    request: Dict[str, Any]
+    phase: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    """1リクエスト分の結果（失敗時は error に理由が入り text は空）"""
+
+    custom_id: str
+    text: str = ""
+    from_cache: bool = False
+    raw: Any = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def to_batch_body(endpoint: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """LLMClient 用の引数をBatchのリクエストボディに変換する（pydantic の response_format はJSONスキーマに）"""
+    body = dict(request)
+    response_format = body.get("response_format")
+    if isinstance(response_format, type) and hasattr(response_format, "model_json_schema"):
+        body["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": response_format.__name__, "schema": response_format.model_json_schema()},
+        }
+    return body
+
+
+def body_text(endpoint: str, body: Dict[str, Any]) -> str:
+    """Batch結果のレスポンスボディ（dict）から出力テキストを取り出す"""
+    if endpoint.startswith("chat."):
+        choices = body.get("choices") or [{}]
+        return (choices[0].get("message") or {}).get("content") or ""
+    if body.get("output_text"):
+        return body["output_text"]
+    for item in body.get("output") or []:
+        for content in item.get("content") or []:
+            if content.get("type") == "output_text" and content.get("text"):
+                return content["text"]
+    return ""
+
+
+class BatchBackend(ABC):
+    """バッチの投入・状態確認・結果取得のインターフェース"""
+
+    @abstractmethod
+    def submit(self, input_path: Path, url: str) -> str:
+        """Batch形式のJSONLを投入し、バッチIDを返す"""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """ "validating" / "in_progress" / "completed" / "failed" などの状態を返す"""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> List[dict]:
+        """出力ファイルとエラーファイルの行（{"custom_id", "response", "error"}）を返す"""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI の files / batches API を使うバックエンド"""
+
+    def __init__(self, client: Any, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: Path, url: str) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id, endpoint=url, completion_window=self.completion_window
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = self.client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        return lines
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    ファイルベースのローカル代替。投入したJSONLを directory/<batch_id>/ に置き、
+    最初の状態確認のときに handler(url, body) → レスポンスボディ で全リクエストを処理する。
+    handler が例外を送出したリクエストはエラー行になる。
+    """
+
+    def __init__(self, directory: str | Path, handler: Callable[[str, Dict[str, Any]], Dict[str, Any]]):
+        self.directory = Path(directory)
+        self.handler = handler
+
+    def submit(self, input_path: Path, url: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        batch_dir = self.directory / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        (batch_dir / "input.jsonl").write_bytes(Path(input_path).read_bytes())
+        (batch_dir / "status").write_text("validating", encoding="utf-8")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch_dir = self.directory / batch_id
+        status = (batch_dir / "status").read_text(encoding="utf-8")
+        if status == "validating":
+            self._process(batch_dir)
+            status = "completed"
+            (batch_dir / "status").write_text(status, encoding="utf-8")
+        return status
+
+    def results(self, batch_id: str) -> List[dict]:
+        output = self.directory / batch_id / "output.jsonl"
+        return [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    def _process(self, batch_dir: Path) -> None:
+        lines = []
+        for line in (batch_dir / "input.jsonl").read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            record = {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"]}
+            try:
+                body = self.handler(request["url"], request["body"])
+                record.update(response={"status_code": 200, "body": body}, error=None)
+            except Exception as e:
+                record.update(response=None, error={"code": type(e).__name__, "message": str(e)})
+            lines.append(json.dumps(record, ensure_ascii=False))
+        (batch_dir / "output.jsonl").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def client_handler(client: Any) -> Callable[[str, Dict[str, Any]], Dict[str, Any]]:
+    """LocalBatchBackend 用: 各リクエストを OpenAI クライアント（モックサーバー等）で同期実行する handler"""
+
+    def handle(url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        if url == "/v1/responses":
+            return client.responses.create(**body).model_dump()
+        return client.chat.completions.create(**body).model_dump()
+
+    return handle
+
+
+def _line_error(line: dict) -> Optional[str]:
+    if line.get("error"):
+        error = line["error"]
+        return f"{error.get('code')}: {error.get('message')}"
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        message = ((response.get("body") or {}).get("error") or {}).get("message", "")
+        return f"HTTP {response.get('status_code')}: {message}"
+    return None
+
+
+def run_batch(
+    items: Iterable[BatchItem],
+    backend: BatchBackend,
+    workdir: str | Path,
+    cache: Optional[LLMCache] = None,
+    telemetry: Optional[LLMTelemetry] = None,
+    poll_interval: float = 30.0,
+    timeout: Optional[float] = None,
+    max_requests: int = MAX_BATCH_REQUESTS,
+) -> Dict[str, BatchResult]:
+    """
+    リクエストをBatchで実行し、custom_id → BatchResult を返す。
+    キャッシュ済みのリクエストは投入しない。Batch API は1バッチ1エンドポイントのため、
+    url ごと・max_requests 件ごとにバッチを分けて投入し、全バッチが終わるまで待つ。
+
+    Raises:
+        TimeoutError: timeout 秒以内に全バッチが終わらなかった場合
+    """
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    results: Dict[str, BatchResult] = {}
+    pending: Dict[str, BatchItem] = {}
+    keys: Dict[str, str] = {}
+
+    for item in items:
+        if item.custom_id in pending or item.custom_id in results:
+            raise ValueError(f"duplicate custom_id: {item.custom_id}")
+        if cache is not None:
+            keys[item.custom_id] = cache.make_key(item.endpoint, item.request)
+            cached = cache.get(keys[item.custom_id])
+            if cached is not None:
+                results[item.custom_id] = BatchResult(item.custom_id, text=cached, from_cache=True)
+                _record(telemetry, item, 0.0, from_cache=True)
+                continue
+        pending[item.custom_id] = item
+
+    by_url: Dict[str, List[BatchItem]] = {}
+    for item in pending.values():
+        by_url.setdefault(BATCH_URLS[item.endpoint], []).append(item)
+
+    submitted = time.perf_counter()
+    batch_ids: List[str] = []
+    for url, group in by_url.items():
+        for start in range(0, len(group), max_requests):
+            input_path = workdir / f"batch_input_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.jsonl"
+            with open(input_path, "w", encoding="utf-8") as f:
+                for item in group[start : start + max_requests]:
+                    line = {
+                        "custom_id": item.custom_id,
+                        "method": "POST",
+                        "url": url,
+                        "body": to_batch_body(item.endpoint, item.request),
+                    }
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            batch_ids.append(backend.submit(input_path, url))
+            print(f"📦 Batch submitted: {batch_ids[-1]} ({min(max_requests, len(group) - start)} requests → {url})")
+
+    statuses = {batch_id: None for batch_id in batch_ids}
+    while True:
+        for batch_id, status in statuses.items():
+            if status not in TERMINAL_STATUSES:
+                statuses[batch_id] = backend.status(batch_id)
+        if all(status in TERMINAL_STATUSES for status in statuses.values()):
+            break
+        if timeout is not None and time.perf_counter() - submitted > timeout:
+            raise TimeoutError(f"batches not finished after {timeout}s: {statuses}")
+        time.sleep(poll_interval)
+    elapsed = time.perf_counter() - submitted
+
+    for batch_id, status in statuses.items():
+        if status == "failed":
+            print(f"❌ Batch failed: {batch_id}")
+            continue
+        # expired / cancelled でも完了済みの分は結果ファイルに含まれる
+        for line in backend.results(batch_id):
+            item = pending.get(line.get("custom_id"))
+            if item is None:
+                continue
+            error = _line_error(line)
+            body = None if error else line["response"]["body"]
+            text = body_text(item.endpoint, body) if body else ""
+            if not error and not text:
+                error = "empty response"
+            results[item.custom_id] = BatchResult(item.custom_id, text=text, raw=body, error=error)
+            _record(telemetry, item, elapsed, raw=body, error=error)
+            if cache is not None and not error and is_cacheable(item.request, text):
+                cache.put(keys[item.custom_id], text)
+
+    for custom_id, item in pending.items():
+        if custom_id not in results:
+            error = f"no result (batch {', '.join(f'{b}={s}' for b, s in statuses.items())})"
+            results[custom_id] = BatchResult(custom_id, error=error)
+            _record(telemetry, item, elapsed, error=error)
+    return results
+
+
+def _record(telemetry: Optional[LLMTelemetry], item: BatchItem, latency_s: float, raw: Any = None, **fields) -> None:
+    # バッチ内の個々の所要時間は分からないので、投入から全バッチ完了までの時間を記録する
+    if telemetry is not None:
+        with llm_context(task_id=item.custom_id, phase=item.phase):
+            telemetry.record(
+                f"batch:{item.endpoint}",
+                item.request.get("model"),
+                latency_s,
+                usage=normalize_usage(raw),
+                **fields,
+            )
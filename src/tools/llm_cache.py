@@ -0,0 +1,140 @@
+"""
+LLMレスポンスの永続キャッシュ（コンテンツアドレス方式）。
+リクエスト内容（モデル・メッセージ・response_format・temperature 等）のハッシュをキーに、
+SQLite ファイルへレスポンス本文を保存する。複数スレッド・複数プロセスから同時に書き込んでも安全。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+DEFAULT_CACHE_PATH = Path("workspace/llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _normalize(value: Any) -> Any:
+    """キー計算用にリクエストをJSON化可能な形へ正規化する（pydanticモデルはスキーマに変換）"""
+    if isinstance(value, type) and hasattr(value, "model_json_schema"):
+        return {"__schema__": value.model_json_schema()}
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class LLMCache:
+    """サイズ上限付きLRUのLLMレスポンスキャッシュ"""
+
+    def __init__(
+        self,
+        path: str | Path = DEFAULT_CACHE_PATH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        bypass: bool = False,
+    ):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            max_bytes: 保存する本文の合計サイズ上限。超えた分は最終アクセスが古い順に削除する
+            bypass: True の場合はキャッシュを読まずに毎回APIを呼ぶ（結果は書き込む）
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # 呼び出しごとに接続する（接続をスレッド間で共有しない）。ロック待ちは timeout まで待機
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(endpoint: str, request: Dict[str, Any]) -> str:
+        """エンドポイント名とリクエスト引数からキャッシュキー（SHA-256）を計算"""
+        payload = json.dumps(
+            {"endpoint": endpoint, "request": _normalize(request)},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュされたレスポンス本文を返す（なければ None）"""
+        if self.bypass:
+            self._count(hit=False)
+            return None
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        self._count(hit=row is not None)
+        return row[0] if row is not None else None
+
+    def put(self, key: str, value: str) -> None:
+        """レスポンス本文を保存し、サイズ上限を超えていれば古いエントリを削除する"""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _count(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット/ミス数（このプロセス内）と、キャッシュ全体のエントリ数・サイズ"""
+        with self._connect() as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
@@ -0,0 +1,206 @@
+"""
+OpenAI API 呼び出しの共通レイヤー。
+エージェント・ベースライン・採点（judge）の全てのLLM呼び出しはこのクラスを経由し、
+永続キャッシュ（LLMCache）とレート制限器（RateLimiter）を共有する。
+"""
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from openai import OpenAI
+
+from tools.llm_cache import LLMCache
+from tools.hedging import CallOutcome, HedgeCancelled, HedgePolicy
+from tools.llm_telemetry import LLMTelemetry, current_context, normalize_usage
+from tools.rate_limiter import RateLimiter, get_rate_limiter
+
+
+class LLMCallCancelled(Exception):
+    """llm_cancel_scope() のイベントがセットされたため、リクエストを（再）送信せずに打ち切った"""
+
+
+# このコンテキストでの呼び出しを打ち切るためのイベント（copy_context で起動したスレッドとも共有する）
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar("llm_cancel", default=None)
+
+
+@contextmanager
+def llm_cancel_scope(event: threading.Event) -> Iterator[None]:
+    """
+    このブロック内のLLM呼び出しは、event がセットされると以降の送信・再試行をやめて LLMCallCancelled を送出する
+    （送信済みのHTTPリクエストは止められないので、その応答は捨てる側で無視する）。
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+@dataclass
+class LLMResponse:
+    """LLM呼び出しの結果（キャッシュから返した場合 raw は None）"""
+
+    text: str
+    from_cache: bool = False
+    raw: Any = None
+
+
+def _chat_text(response: Any) -> str:
+    return response.choices[0].message.content or ""
+
+
+def _responses_text(response: Any) -> str:
+    """Responses API のレスポンスから出力テキストを取り出す"""
+    if getattr(response, "output_text", None):
+        return response.output_text
+    for item in getattr(response, "output", None) or []:
+        for content in getattr(item, "content", None) or []:
+            if getattr(content, "text", None):
+                return content.text
+    return ""
+
+
+def _expects_json(request: Dict[str, Any]) -> bool:
+    """構造化出力（JSON）を要求するリクエストか"""
+    if request.get("response_format") is not None:
+        return True
+    text_format = (request.get("text") or {}).get("format") or {}
+    return text_format.get("type") in ("json_schema", "json_object")
+
+
+def is_cacheable(request: Dict[str, Any], text: str) -> bool:
+    """
+    応答テキストをキャッシュしてよいか（LLMClient と Batch の結果で共通）。
+    途中で切れた構造化出力などをキャッシュして再利用し続けないようにする
+    """
+    if not _expects_json(request):
+        return True
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+class LLMClient:
+    """キャッシュ・計測・レート制限付きのOpenAIクライアントラッパー"""
+
+    def __init__(
+        self,
+        client: OpenAI,
+        cache: Optional[LLMCache] = None,
+        telemetry: Optional[LLMTelemetry] = None,
+        limiter: Optional[RateLimiter] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        """
+        Args:
+            limiter: 省略時はプロセス共有の制限器（get_rate_limiter()）を使う
+            hedge: 指定するとヘッジ付きで呼び出す（遅い呼び出しに重複リクエストを出す。省略時は無効）
+        """
+        # 再試行は制限器が行うため、SDK 自身のリトライは無効にする
+        self.client = client.with_options(max_retries=0) if hasattr(client, "with_options") else client
+        self.cache = cache
+        self.telemetry = telemetry
+        self.limiter = limiter or get_rate_limiter()
+        self.hedge = hedge
+
+    def chat(self, **request) -> LLMResponse:
+        """chat.completions.create"""
+        return self._call("chat.completions.create", request, self.client.chat.completions.create, _chat_text)
+
+    def parse(self, **request) -> LLMResponse:
+        """chat.completions.parse（response_format に pydantic モデルを渡す）。text はJSON文字列"""
+        return self._call("chat.completions.parse", request, self.client.chat.completions.parse, _chat_text)
+
+    def responses(self, **request) -> LLMResponse:
+        """responses.create"""
+        return self._call("responses.create", request, self.client.responses.create, _responses_text)
+
+    def _call(
+        self,
+        endpoint: str,
+        request: Dict[str, Any],
+        invoke: Callable[..., Any],
+        extract_text: Callable[[Any], str],
+    ) -> LLMResponse:
+        started = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(endpoint, request)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(endpoint, request, started, from_cache=True)
+                return LLMResponse(text=cached, from_cache=True)
+
+        if self.hedge is None:
+            outcome, hedged, hedge_won = self._invoke(request, invoke), False, False
+        else:
+            outcome, hedged, hedge_won = self.hedge.run(
+                lambda cancelled: self._invoke(request, invoke, cancelled), current_context()["phase"]
+            )
+        hedge_fields = {"hedged": hedged, "hedge_won": hedge_won}
+        if outcome.error is not None:
+            error = outcome.error
+            self._record(
+                endpoint,
+                request,
+                started,
+                retries=outcome.retries,
+                error=f"{type(error).__name__}: {error}",
+                **hedge_fields,
+            )
+            raise error
+
+        raw = outcome.value
+        text = extract_text(raw)
+        self._record(endpoint, request, started, raw=raw, retries=outcome.retries, **hedge_fields)
+
+        if key is not None and text and is_cacheable(request, text):
+            self.cache.put(key, text)
+        return LLMResponse(text=text, raw=raw)
+
+    def _invoke(
+        self, request: Dict[str, Any], invoke: Callable[..., Any], cancelled: Optional[threading.Event] = None
+    ) -> CallOutcome:
+        """レート制限器の予算内で1本のリクエストを送り、429/5xx/タイムアウトは再試行する（例外は結果に入れて返す）"""
+        started = time.perf_counter()
+        attempt = 0
+        scope = _cancel_event.get()
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                return CallOutcome(error=HedgeCancelled(), retries=attempt, latency_s=time.perf_counter() - started)
+            if scope is not None and scope.is_set():
+                return CallOutcome(error=LLMCallCancelled(), retries=attempt, latency_s=time.perf_counter() - started)
+            estimate = self.limiter.acquire(request)
+            try:
+                raw = invoke(**request)
+            except Exception as e:
+                self.limiter.settle(estimate, None)
+                delay = self.limiter.retry_delay(e, attempt)
+                if delay is None:
+                    return CallOutcome(error=e, retries=attempt, latency_s=time.perf_counter() - started)
+                attempt += 1
+                if scope is not None:
+                    scope.wait(delay)  # 打ち切られたらバックオフを待たずに抜ける
+                else:
+                    time.sleep(delay)
+                continue
+            usage = normalize_usage(raw)
+            self.limiter.settle(estimate, usage.prompt_tokens + usage.completion_tokens)
+            return CallOutcome(value=raw, retries=attempt, latency_s=time.perf_counter() - started)
+
+    def _record(self, endpoint: str, request: Dict[str, Any], started: float, raw: Any = None, **fields) -> None:
+        if self.telemetry is not None:
+            self.telemetry.record(
+                endpoint,
+                request.get("model"),
+                time.perf_counter() - started,
+                usage=normalize_usage(raw),
+                **fields,
+            )
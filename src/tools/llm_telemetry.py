@@ -0,0 +1,255 @@
+"""
+LLM呼び出しの計測（レイテンシ・トークン使用量）。
+LLMClient は呼び出しごとにイベントを1行のJSONとして追記する。
+タスクIDとフェーズは llm_context() で呼び出し側から付与する。
+
+集計:
+    python src/tools/llm_telemetry.py workspace/llm_events.jsonl [--all-runs]
+"""
+
+import argparse
+import contextvars
+import json
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_TELEMETRY_PATH = Path("workspace/llm_events.jsonl")
+
+# 呼び出し元のタスクID・フェーズ（スレッドごと、with ブロックの間だけ有効）
+_task_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_task_id", default=None)
+_phase: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_phase", default=None)
+
+
+@contextmanager
+def llm_context(task_id: Optional[str] = None, phase: Optional[str] = None) -> Iterator[None]:
+    """このブロック内のLLM呼び出しにタスクIDとフェーズ（"1.1", "2-attempt-1", "judge" など）を付与する"""
+    tokens = []
+    if task_id is not None:
+        tokens.append((_task_id, _task_id.set(str(task_id))))
+    if phase is not None:
+        tokens.append((_phase, _phase.set(phase)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_context() -> Dict[str, Optional[str]]:
+    return {"task_id": _task_id.get(), "phase": _phase.get()}
+
+
+@dataclass
+class Usage:
+    """chat.completions と responses で形式の異なる usage を正規化したもの"""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    reasoning_tokens: int = 0
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def normalize_usage(raw: Any) -> Usage:
+    """レスポンスの usage を Usage に変換する（usage がなければ全て0）"""
+    usage = _field(raw, "usage")
+    if usage is None:
+        return Usage()
+
+    if _field(usage, "input_tokens") is not None:
+        # Responses API
+        prompt, completion = _field(usage, "input_tokens"), _field(usage, "output_tokens")
+        prompt_details, completion_details = _field(usage, "input_tokens_details"), _field(
+            usage, "output_tokens_details"
+        )
+    else:
+        # Chat Completions API
+        prompt, completion = _field(usage, "prompt_tokens"), _field(usage, "completion_tokens")
+        prompt_details, completion_details = _field(usage, "prompt_tokens_details"), _field(
+            usage, "completion_tokens_details"
+        )
+
+    return Usage(
+        prompt_tokens=prompt or 0,
+        completion_tokens=completion or 0,
+        cached_tokens=_field(prompt_details, "cached_tokens") or 0,
+        reasoning_tokens=_field(completion_details, "reasoning_tokens") or 0,
+    )
+
+
+@dataclass
+class LLMEvent:
+    """LLM呼び出し1回分の記録"""
+
+    run_id: str
+    timestamp: float
+    task_id: Optional[str]
+    phase: Optional[str]
+    endpoint: str
+    model: Optional[str]
+    latency_s: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    reasoning_tokens: int = 0
+    retries: int = 0
+    from_cache: bool = False
+    error: Optional[str] = None
+    hedged: bool = False  # 重複リクエスト（ヘッジ）を出したか
+    hedge_won: bool = False  # ヘッジの方が先に返ったか
+
+
+class LLMTelemetry:
+    """イベントをJSONLファイルに追記するシンク（スレッドセーフ）"""
+
+    def __init__(self, path: str | Path = DEFAULT_TELEMETRY_PATH, run_id: Optional[str] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 同じファイルに複数回の実行を追記するため、実行ごとにIDを振る
+        self.run_id = run_id or f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        endpoint: str,
+        model: Optional[str],
+        latency_s: float,
+        usage: Optional[Usage] = None,
+        retries: int = 0,
+        from_cache: bool = False,
+        error: Optional[str] = None,
+        hedged: bool = False,
+        hedge_won: bool = False,
+    ) -> LLMEvent:
+        event = LLMEvent(
+            run_id=self.run_id,
+            timestamp=time.time(),
+            endpoint=endpoint,
+            model=model,
+            latency_s=round(latency_s, 4),
+            retries=retries,
+            from_cache=from_cache,
+            error=error,
+            hedged=hedged,
+            hedge_won=hedge_won,
+            **current_context(),
+            **asdict(usage or Usage()),
+        )
+        line = json.dumps(asdict(event), ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return event
+
+
+# ----------------------------------------------------------------------
+# 集計
+# ----------------------------------------------------------------------
+
+
+def load_events(path: str | Path, run_id: Optional[str] = None) -> List[dict]:
+    """イベントを読み込む（run_id="latest" なら最後の実行のみ）"""
+    events = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    if run_id == "latest" and events:
+        run_id = events[-1]["run_id"]
+    if run_id:
+        events = [e for e in events if e.get("run_id") == run_id]
+    return events
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(events: List[dict], key: str) -> List[dict]:
+    """key（"phase" / "task_id"）ごとの呼び出し数・レイテンシ・トークン数"""
+    groups: Dict[str, List[dict]] = {}
+    for event in events:
+        groups.setdefault(event.get(key) or "-", []).append(event)
+
+    rows = []
+    for name, group in sorted(groups.items()):
+        # キャッシュヒットはレイテンシの分布から除く（API呼び出しの遅さを見るため）
+        latencies = [e["latency_s"] for e in group if not e.get("from_cache")]
+        prompt_tokens = sum(e.get("prompt_tokens", 0) for e in group)
+        cached_tokens = sum(e.get("cached_tokens", 0) for e in group)
+        rows.append(
+            {
+                key: name,
+                "calls": len(group),
+                "cache_hits": sum(1 for e in group if e.get("from_cache")),
+                "errors": sum(1 for e in group if e.get("error")),
+                "retries": sum(e.get("retries", 0) for e in group),
+                "hedges": sum(1 for e in group if e.get("hedged")),
+                "hedge_wins": sum(1 for e in group if e.get("hedge_won")),
+                "p50_s": percentile(latencies, 50),
+                "p95_s": percentile(latencies, 95),
+                "total_s": sum(latencies),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": sum(e.get("completion_tokens", 0) for e in group),
+                "cached_tokens": cached_tokens,
+                # 入力トークンのうちプロバイダのプレフィックスキャッシュに当たった割合
+                "prefix_cache_rate": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+                "reasoning_tokens": sum(e.get("reasoning_tokens", 0) for e in group),
+            }
+        )
+    return rows
+
+
+def format_summary(rows: List[dict], key: str) -> str:
+    header = (
+        f"{key:<16} {'calls':>6} {'hits':>5} {'err':>4} {'retry':>5} {'hedge':>5} {'won':>4} "
+        f"{'p50 s':>7} {'p95 s':>7} {'total s':>8} "
+        f"{'prompt':>9} {'compl':>8} {'cached':>8} {'cache%':>6} {'reason':>8}"
+    )
+    lines = [header]
+    for r in rows:
+        lines.append(
+            f"{str(r[key])[:16]:<16} {r['calls']:>6} {r['cache_hits']:>5} {r['errors']:>4} {r['retries']:>5} "
+            f"{r['hedges']:>5} {r['hedge_wins']:>4} "
+            f"{r['p50_s']:>7.2f} {r['p95_s']:>7.2f} {r['total_s']:>8.1f} {r['prompt_tokens']:>9} "
+            f"{r['completion_tokens']:>8} {r['cached_tokens']:>8} {r['prefix_cache_rate']:>6.1%} "
+            f"{r['reasoning_tokens']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize LLM call telemetry")
+    parser.add_argument("events", nargs="?", default=str(DEFAULT_TELEMETRY_PATH), help="Telemetry JSONL file")
+    parser.add_argument("--run", default="latest", help="Run id to summarize (default: the latest run)")
+    parser.add_argument("--all-runs", action="store_true", help="Summarize every run in the file")
+    args = parser.parse_args()
+
+    events = load_events(args.events, None if args.all_runs else args.run)
+    print(f"{len(events)} events" + ("" if args.all_runs else f" (run {events[0]['run_id'] if events else '-'})"))
+    print("\n# per phase")
+    print(format_summary(summarize(events, "phase"), "phase"))
+    print("\n# per task")
+    print(format_summary(summarize(events, "task_id"), "task_id"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+オフライン検証用の OpenAI API 互換モックサーバー。
+
+このリポジトリで使う chat.completions と responses のエンドポイントを実装し、
+フェーズ1/2/3・生成・採点それぞれでスキーマに合う固定のJSONを返す。
+レイテンシの分布と 429/5xx エラーの発生率を設定できる。
+プロンプトの先頭部分のキャッシュ（プレフィックスキャッシュ）も OpenAI と同じ規則で模擬し、usage の cached_tokens に返す。
+
+Usage:
+    python src/tools/mock_openai_server.py --port 8008 --latency lognormal:1.0:0.5 --rate-429 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=mock python src/main.py data/public_test.jsonl out.jsonl
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# ----------------------------------------------------------------------
+# 固定レスポンス
+# ----------------------------------------------------------------------
+
+PHASE1_DESIGN = {
+    "experimental_design": {
+        "conditions": ["sample", "negative control"],
+        "replicates": 3,
+        "controls": ["Negative Control"],
+        "sample_logic": "sample と buffer を混合し、吸光度を測定する。",
+    }
+}
+
+PHASE1_OBJECTS = {
+    "identified_objects": {
+        "initial": ["objects/initial/sample.reagent", "objects/initial/buffer.reagent"],
+        "intermediate": ["objects/intermediate/mix.sample"],
+        "final": ["objects/final/absorbance.data"],
+    }
+}
+
+PHASE2_OPERATIONS = {
+    "operations": [
+        {
+            "operation_id": "op_mix",
+            "text_description": "sample と buffer を混合する",
+            "input": ["objects/initial/sample.reagent", "objects/initial/buffer.reagent"],
+            "output": ["objects/intermediate/mix.sample"],
+        },
+        {
+            "operation_id": "op_measure",
+            "text_description": "混合液の吸光度を測定する",
+            "input": ["objects/intermediate/mix.sample"],
+            "output": ["objects/final/absorbance.data"],
+        },
+    ]
+}
+
+# 検証に失敗する計画（入力が生成されていない）。再試行ループの負荷を再現するのに使う
+PHASE2_INVALID_OPERATIONS = {
+    "operations": [
+        {
+            "operation_id": "op_measure",
+            "text_description": "混合液の吸光度を測定する",
+            "input": ["objects/intermediate/mix.sample"],
+            "output": ["objects/final/absorbance.data"],
+        }
+    ]
+}
+
+# PHASE2_INVALID_OPERATIONS を修正するパッチ（パッチ修正モードの応答）
+PHASE2_PATCH = {
+    "add_operations": [PHASE2_OPERATIONS["operations"][0]],
+    "remove_operation_ids": [],
+    "replace_operations": [],
+}
+
+PROCEDURE = {
+    "procedure_steps": [
+        {"id": 1, "text": "1.5 mLマイクロチューブに sample を 50 µL 分注する。"},
+        {"id": 2, "text": "buffer を 450 µL 加え、ボルテックスで5秒間撹拌する。"},
+        {"id": 3, "text": "分光光度計で 600 nm の吸光度を測定し、値を記録する。"},
+    ]
+}
+
+JUDGE = {
+    "general_score": 3.0,
+    "specific_score": 2.0,
+    "final_score": 5.0,
+    "general_reason": "mock judge",
+    "specific_matches": [],
+    "notes": "mock",
+}
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    """messages / input から全テキストを連結する"""
+    items = body.get("messages") or body.get("input") or []
+    if isinstance(items, str):
+        return items
+    parts = []
+    for item in items:
+        content = item.get("content", "") if isinstance(item, dict) else ""
+        if isinstance(content, list):
+            content = " ".join(c.get("text", "") for c in content if isinstance(c, dict))
+        parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _schema_name(body: Dict[str, Any]) -> str:
+    """構造化出力のスキーマ名（chat の response_format / responses の text.format）"""
+    response_format = body.get("response_format") or {}
+    text_format = (body.get("text") or {}).get("format") or {}
+    name = (response_format.get("json_schema") or {}).get("name") or text_format.get("name") or ""
+    return name.replace("_", "").lower()
+
+
+def classify_request(body: Dict[str, Any]) -> str:
+    """リクエストがどのフェーズのものかを判定する"""
+    schema = _schema_name(body)
+    if schema == "judgeoutput":
+        return "judge"
+    if schema == "generatedoutput":
+        return "generate"
+
+    prompt = _prompt_text(body)
+    if "実験手順書" in prompt:
+        return "phase3"
+    if "remove_operation_ids" in prompt:
+        return "phase2_patch"
+    if "operation_id" in prompt:
+        return "phase2"
+    if "identified_objects" in prompt:
+        return "phase1_objects"
+    if "Experimental Design" in prompt:
+        return "phase1_design"
+    return "text"
+
+
+# usage のトークン数は3文字≒1トークンで数える
+CHARS_PER_TOKEN = 3
+# OpenAI のプレフィックスキャッシュの規則: 1024 tokens 以上の先頭部分を 128 tokens 単位でキャッシュする
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_BLOCK_TOKENS = 128
+
+
+class PrefixCache:
+    """これまでに見たプロンプトの先頭部分（block_tokens 単位の境界ごとのハッシュ）を覚えておく"""
+
+    def __init__(self, min_tokens: int = PREFIX_CACHE_MIN_TOKENS, block_tokens: int = PREFIX_CACHE_BLOCK_TOKENS):
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self._seen: set = set()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, prompt: str) -> int:
+        """過去のプロンプトと一致する先頭部分のトークン数を返し、このプロンプトの先頭部分を記録する"""
+        boundaries = range(self.min_tokens, len(prompt) // CHARS_PER_TOKEN + 1, self.block_tokens)
+        digests = [(n, hashlib.sha256(prompt[: n * CHARS_PER_TOKEN].encode("utf-8")).digest()) for n in boundaries]
+        with self._lock:
+            cached = max((n for n, digest in digests if digest in self._seen), default=0)
+            self._seen.update(digest for _, digest in digests)
+        return cached
+
+
+# ----------------------------------------------------------------------
+# 設定
+# ----------------------------------------------------------------------
+
+
+@dataclass
+class LatencyModel:
+    """
+    レスポンスまでの待ち時間（秒）の分布。
+    "fixed:0.5" / "uniform:0.2:1.0" / "lognormal:1.0:0.5"（中央値, シグマ）の形式で指定する。
+    """
+
+    kind: str = "fixed"
+    params: Tuple[float, ...] = (0.0,)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        kind, *values = spec.split(":")
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"invalid latency spec: {spec!r} (fixed:S, uniform:LO:HI or lognormal:MEDIAN:SIGMA)")
+        return cls(kind, tuple(float(v) for v in values))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return median * rng.lognormvariate(0.0, sigma)
+        return self.params[0]
+
+
+@dataclass
+class MockConfig:
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    retry_after: float = 1.0  # 429 の Retry-After（秒）
+    invalid_plan_rate: float = 0.0  # フェーズ2で検証に失敗する計画を返す確率
+    prefix_cache_min_tokens: int = PREFIX_CACHE_MIN_TOKENS  # これより短い先頭部分はキャッシュしない
+    seed: Optional[int] = None
+
+
+# ----------------------------------------------------------------------
+# サーバー
+# ----------------------------------------------------------------------
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_MockHTTPServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            endpoint = "chat"
+        elif path.endswith("/responses"):
+            endpoint = "responses"
+        else:
+            self._send_json(
+                404, {"error": {"message": f"unknown endpoint {self.path}", "type": "invalid_request_error"}}
+            )
+            return
+
+        mock = self.server.mock
+        delay, fault, kind, text = mock.plan_response(body)
+        time.sleep(delay)
+
+        if fault == 429:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"Retry-After": f"{mock.config.retry_after:g}"},
+            )
+            return
+        if fault:
+            self._send_json(fault, {"error": {"message": "The server had an error (mock)", "type": "server_error"}})
+            return
+
+        prompt = _prompt_text(body)
+        prompt_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        cached_tokens = mock.prefix_cache.lookup_and_store(prompt)
+        completion_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+        model = body.get("model", "mock")
+        response_id = next(mock.ids)
+        if endpoint == "chat":
+            payload = {
+                "id": f"chatcmpl-mock-{response_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text, "refusal": None},
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                    "completion_tokens_details": {"reasoning_tokens": 0},
+                },
+            }
+        else:
+            payload = {
+                "id": f"resp_mock_{response_id}",
+                "object": "response",
+                "created_at": int(time.time()),
+                "status": "completed",
+                "model": model,
+                "output": [
+                    {
+                        "type": "message",
+                        "id": f"msg_mock_{response_id}",
+                        "status": "completed",
+                        "role": "assistant",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}],
+                    }
+                ],
+                "parallel_tool_calls": True,
+                "tool_choice": "auto",
+                "tools": [],
+                "usage": {
+                    "input_tokens": prompt_tokens,
+                    "output_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "input_tokens_details": {"cached_tokens": cached_tokens},
+                    "output_tokens_details": {"reasoning_tokens": 0},
+                },
+            }
+        self._send_json(200, payload)
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    mock: "MockOpenAIServer"
+
+
+class MockOpenAIServer:
+    """OpenAI API 互換のモックサーバー（バックグラウンドスレッドで動く）"""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.counts: Dict[str, int] = {}
+        self.prefix_cache = PrefixCache(min_tokens=self.config.prefix_cache_min_tokens)
+        self._httpd = _MockHTTPServer((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def plan_response(self, body: Dict[str, Any]) -> Tuple[float, int, str, str]:
+        """(待ち時間, エラーのHTTPステータス（0なら成功）, 種別, 本文) を決める"""
+        kind = classify_request(body)
+        with self._rng_lock:
+            delay = self.config.latency.sample(self._rng)
+            roll = self._rng.random()
+            invalid_plan = self._rng.random() < self.config.invalid_plan_rate
+            fault = 0
+            if roll < self.config.rate_429:
+                fault = 429
+            elif roll < self.config.rate_429 + self.config.rate_5xx:
+                fault = self._rng.choice((500, 502, 503))
+            key = f"{kind}:{fault}" if fault else kind
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+        payloads = {
+            "phase1_design": PHASE1_DESIGN,
+            "phase1_objects": PHASE1_OBJECTS,
+            "phase2": PHASE2_INVALID_OPERATIONS if invalid_plan else PHASE2_OPERATIONS,
+            "phase2_patch": PHASE2_PATCH,
+            "phase3": PROCEDURE,
+            "generate": PROCEDURE,
+            "judge": JUDGE,
+        }
+        text = json.dumps(payloads[kind], ensure_ascii=False) if kind in payloads else "mock response"
+        return max(0.0, delay), fault, kind, text
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock server for offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--latency", default="fixed:0.2", help="fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of requests answered with 500/502/503")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument(
+        "--invalid-plan-rate", type=float, default=0.0, help="Fraction of Phase 2 plans that fail validation"
+    )
+    parser.add_argument(
+        "--prefix-cache-min-tokens",
+        type=int,
+        default=PREFIX_CACHE_MIN_TOKENS,
+        help="Shortest prompt prefix reported as cached_tokens "
+        "(lower it to see prefix reuse with the short mock prompts)",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(
+        latency=LatencyModel.parse(args.latency),
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        retry_after=args.retry_after,
+        invalid_plan_rate=args.invalid_plan_rate,
+        prefix_cache_min_tokens=args.prefix_cache_min_tokens,
+        seed=args.seed,
+    )
+    server = MockOpenAIServer(config, host=args.host, port=args.port)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    print(f"  export OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=mock")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+        print(f"Requests served: {server.counts}")
+
+
+if __name__ == "__main__":
+    main()
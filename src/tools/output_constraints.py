@@ -0,0 +1,278 @@
+"""
+手順書の出力制約（ステップ数50以下・各ステップ10文以下・IDは1からの連番）の検査と、LLMを呼ばない機械的な修正。
+
+    result = fix_steps(output["procedure_steps"])
+    if result.ok:
+        output["procedure_steps"] = result.steps  # 制約を満たす（result.fixes に適用した修正）
+    else:
+        ...  # 使えるステップが1つもない → LLMで再生成する
+
+修正は決定的で、次の順に行う。
+- 空のステップを除き、元のID順に並べる
+- 10文を超えるステップを、文の区切りで均等に分割する
+- 50ステップを超える場合は、合計の文数が最も少ない隣接ステップから、10文以内に収まる範囲でまとめる
+- それでも超える場合は、隣接ステップをまとめたうえで短い文どうしを読点・セミコロンでつないで10文に詰める
+- IDを1からの連番に振り直す
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MAX_STEPS = 50
+MAX_SENTENCES = 10
+
+# 文末の候補: 日本語の句点・感嘆符・疑問符（全角・半角）、英語のピリオド、改行。
+# 直後の閉じ括弧・引用符は文に含める
+_CLOSING = "」』）)]\"'”’"
+_TERMINATOR = re.compile(r"(?:[。．！？!?]+|\.+|\n+)[" + re.escape(_CLOSING) + "]*")
+_TERMINATOR_CHARS = "。．！？!?.\n"
+# ピリオドの後に文が続かない略語（小文字化して比較する）
+_ABBREVIATIONS = frozenset(
+    [
+        "e.g",
+        "i.e",
+        "approx",
+        "ca",
+        "cf",
+        "vs",
+        "fig",
+        "figs",
+        "no",
+        "nos",
+        "dr",
+        "prof",
+        "st",
+        "vol",
+        "ref",
+        "eq",
+        "al",
+        "pp",
+    ]
+)
+_WORD_BEFORE = re.compile(r"[A-Za-z][A-Za-z.]*$")
+_ENUMERATION = re.compile(r"\s*\d+\.\s")
+# 文の終わりに付いていれば、次の文と空白なしでつなぐ記号
+_CJK_END = frozenset("。．！？」』）")
+
+
+def _is_boundary(text: str, start: int, end: int, sentence_start: int = 0) -> bool:
+    """text[start:end] の文末候補が本当に文の区切りか（sentence_start はその文の始まりの位置）"""
+    char = text[start]
+    next_char = text[end] if end < len(text) else ""
+    if text[end - 1] in _CLOSING and next_char and not next_char.isspace():
+        return False  # 引用の中の文末（「完了。」と記録する）
+    if char == "\n" or char in "。！？!?":
+        return True
+    if char == "．":
+        # 全角の小数点（2．5 mL）
+        return not (start > 0 and text[start - 1].isdigit() and next_char.isdigit())
+    # 半角のピリオド: 小数（2.5 mL）・ファイル名・URL など、直後に空白がなければ区切りではない
+    if next_char and not next_char.isspace():
+        return False
+    if end - start > 1 and text[start + 1] == ".":
+        return True  # 省略記号（...）
+    word = _WORD_BEFORE.search(text, max(0, start - 12), start)
+    if word and word.group().lower().rstrip(".") in _ABBREVIATIONS:
+        return False
+    # 文頭の番号付け（"1. Add ..."）。テキストの先頭に限らず判定するため、ステップをまとめても文の数が変わらない
+    enumeration = _ENUMERATION.match(text, sentence_start)
+    return not (enumeration and enumeration.end() == end + 1)
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    日英混在のテキストを文に分ける（句点・感嘆符・疑問符・ピリオド・改行で区切る）。
+    小数（2.5 mL）、略語（e.g., approx. など）、文頭の番号付け（"1. "）では区切らない。
+    """
+    sentences = []
+    last = 0
+    for match in _TERMINATOR.finditer(text):
+        start, end = match.span()
+        if not _is_boundary(text, start, end, last):
+            continue
+        sentence = text[last:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        last = end
+    tail = text[last:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def count_sentences(text: str) -> int:
+    return len(split_sentences(text))
+
+
+def _exceeds(text: str, max_sentences: int) -> bool:
+    """text が max_sentences 文を超えるか（文末の候補の文字が少なければ、文に分けずに判定する）"""
+    if sum(map(text.count, _TERMINATOR_CHARS)) < max_sentences:
+        return False
+    return count_sentences(text) > max_sentences
+
+
+def join_sentences(sentences: Iterable[str]) -> str:
+    """文をつないで1つのテキストにする（日本語の文末の後は空白なし、英語の文末の後は空白1つ）"""
+    text = ""
+    for sentence in sentences:
+        if text and text[-1] not in _CJK_END:
+            text += " "
+        text += sentence
+    return text
+
+
+def _fuse(first: str, second: str) -> str:
+    """2つの文を1文につなぐ（日本語は句点を読点に、英語はピリオドをセミコロンに置き換える）"""
+    body = first.rstrip("。．.!?！？\n ")
+    if first[-1:] in _CJK_END or re.search(r"[぀-ヿ㐀-鿿]$", body):
+        return f"{body}、{second}"
+    return f"{body}; {second}"
+
+
+@dataclass
+class ConstraintViolation:
+    """出力制約の違反1件"""
+
+    type: str  # "EMPTY_OUTPUT" / "TOO_MANY_STEPS" / "TOO_MANY_SENTENCES" / "EMPTY_STEP" / "BAD_STEP_IDS"
+    message: str
+    step_id: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, "message": self.message, "step_id": self.step_id}
+
+
+def check_steps(
+    steps: List[Dict[str, Any]], max_steps: int = MAX_STEPS, max_sentences: int = MAX_SENTENCES
+) -> List[ConstraintViolation]:
+    """手順（{"id", "text"} の一覧）の制約違反を返す（空なら制約を満たす）"""
+    if not steps:
+        return [ConstraintViolation("EMPTY_OUTPUT", "ステップが1つもありません。")]
+    violations = []
+    if len(steps) > max_steps:
+        violations.append(
+            ConstraintViolation("TOO_MANY_STEPS", f"ステップ数が{len(steps)}で、上限の{max_steps}を超えています。")
+        )
+    if [step.get("id") for step in steps] != list(range(1, len(steps) + 1)):
+        violations.append(ConstraintViolation("BAD_STEP_IDS", "ステップIDが1からの連番になっていません。"))
+    for step in steps:
+        text = str(step.get("text") or "").strip()
+        if not text:
+            violations.append(ConstraintViolation("EMPTY_STEP", "ステップの本文が空です。", step.get("id")))
+        elif _exceeds(text, max_sentences):
+            violations.append(
+                ConstraintViolation(
+                    "TOO_MANY_SENTENCES",
+                    f"ステップ{step.get('id')}が{count_sentences(text)}文で、上限の{max_sentences}文を超えています。",
+                    step.get("id"),
+                )
+            )
+    return violations
+
+
+@dataclass
+class FixResult:
+    """機械的な修正の結果"""
+
+    steps: List[Dict[str, Any]]  # 修正後の手順（{"id", "text"}）
+    fixes: List[str] = field(default_factory=list)  # 適用した修正
+    violations: List[ConstraintViolation] = field(default_factory=list)  # 修正後も残った違反
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+
+def _normalize(steps: Any) -> List[str]:
+    """ステップの一覧（{"id", "text"} の辞書か文字列）を、元のID順の本文のリストにする"""
+    if not isinstance(steps, list):
+        return []
+    entries = []
+    for position, step in enumerate(steps):
+        if isinstance(step, dict):
+            text, step_id = step.get("text"), step.get("id")
+        else:
+            text, step_id = step, None
+        text = str(text).strip() if text is not None else ""
+        if not text:
+            continue
+        try:
+            key = float(step_id)
+        except (TypeError, ValueError):
+            key = float(position + 1)
+        entries.append((key, position, text))
+    entries.sort()
+    return [text for _, _, text in entries]
+
+
+def _compact(sentences: List[str], max_sentences: int) -> List[str]:
+    """最も短い隣接する2文をつなぐことを繰り返して、max_sentences 文以内にする"""
+    sentences = list(sentences)
+    while len(sentences) > max_sentences:
+        i = min(range(len(sentences) - 1), key=lambda k: len(sentences[k]) + len(sentences[k + 1]))
+        sentences[i : i + 2] = [_fuse(sentences[i], sentences[i + 1])]
+    return sentences
+
+
+def fix_steps(steps: Any, max_steps: int = MAX_STEPS, max_sentences: int = MAX_SENTENCES) -> FixResult:
+    """
+    手順を出力制約を満たすように機械的に直す（本文のあるステップが1つでもあれば必ず直せる）。
+    本文のあるステップが1つもない場合（LLMの出力形式が違うなど）は直せないため、違反を残して返す。
+    修正後の手順は検査し直し、違反が残っていれば ok にしない。
+    """
+    texts = _normalize(steps)
+    original = steps if isinstance(steps, list) else []
+    fixes: List[str] = []
+    if len(texts) < len(original):
+        fixes.append(f"空のステップを{len(original) - len(texts)}個削除")
+    if not texts:
+        return FixResult(steps=[], fixes=fixes, violations=check_steps([], max_steps, max_sentences))
+
+    # 長すぎるステップを分割する（(文のリスト, 手を加えていなければ元の本文) の組で扱う。
+    # 文のリストは、分割・結合で必要になるまで作らない）
+    entries: List[Tuple[Optional[List[str]], Optional[str]]] = []
+    split = 0
+    for text in texts:
+        if not _exceeds(text, max_sentences):
+            entries.append((None, text))
+            continue
+        sentences = split_sentences(text)
+        parts = -(-len(sentences) // max_sentences)
+        size, extra = divmod(len(sentences), parts)
+        start = 0
+        for part in range(parts):
+            end = start + size + (1 if part < extra else 0)
+            entries.append((sentences[start:end], None))
+            start = end
+        split += 1
+    if split:
+        fixes.append(f"{max_sentences}文を超えるステップを{split}個分割")
+
+    # 多すぎるステップをまとめる（10文以内に収まる組がなければ、まとめたうえで文をつなぐ）
+    merged = compacted = 0
+    if len(entries) > max_steps:
+        entries = [(sentences or split_sentences(text), text) for sentences, text in entries]
+    while len(entries) > max_steps:
+        i = min(range(len(entries) - 1), key=lambda k: (len(entries[k][0]) + len(entries[k + 1][0]), k))
+        combined = entries[i][0] + entries[i + 1][0]
+        if len(combined) > max_sentences:
+            combined = _compact(combined, max_sentences)
+            compacted += 1
+        else:
+            merged += 1
+        entries[i : i + 2] = [(combined, None)]
+    if merged:
+        fixes.append(f"短い隣接ステップを{merged}組まとめた")
+    if compacted:
+        fixes.append(f"隣接ステップを{compacted}組まとめ、文をつないで{max_sentences}文以内に詰めた")
+
+    fixed = [
+        {"id": i, "text": text if text is not None else join_sentences(sentences)}
+        for i, (sentences, text) in enumerate(entries, 1)
+    ]
+    if not fixes and [step.get("id") if isinstance(step, dict) else None for step in original] != list(
+        range(1, len(fixed) + 1)
+    ):
+        fixes.append("ステップIDを1からの連番に振り直した")
+    # 分割・結合したステップは、つないだ本文を数え直すと文の数が変わりうるため、結果全体を検査し直す
+    return FixResult(steps=fixed, fixes=fixes, violations=check_steps(fixed, max_steps, max_sentences))
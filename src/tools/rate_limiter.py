@@ -0,0 +1,233 @@
+"""
+プロセス共有のLLM呼び出しレート制限とリトライ。
+requests/minute（RPM）と tokens/minute（TPM）をトークンバケットで制限し、
+429・5xx・タイムアウトはジッター付き指数バックオフ（Retry-After があればそれに従う）で再試行する。
+
+LLMClient は既定でプロセス共有の制限器（get_rate_limiter()）を使うため、
+エージェント・ベースライン・採点の全ての呼び出しが同じ予算を分け合う。
+"""
+
+import contextvars
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import openai
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """1分あたり rate_per_minute だけ連続的に補充されるバケット（容量も1分分）"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を取り出せるまでの秒数（0 なら今すぐ取り出せる）"""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 容量を超える要求は満タンになれば通す
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        """見積もりとの差分を戻す（負なら追加で消費し、残量は負になりうる）"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """
+    リクエストが消費するトークン数の見積もり（TPM 用）。
+    入力は日本語・英語混在を想定して2文字≒1トークンとし、出力は要求した上限を数える（APIの数え方と同じ）。
+    """
+    prompt = request.get("messages") or request.get("input") or ""
+    chars = len(prompt) if isinstance(prompt, str) else len(json.dumps(prompt, ensure_ascii=False))
+    max_output = (
+        request.get("max_tokens") or request.get("max_completion_tokens") or request.get("max_output_tokens") or 0
+    )
+    return chars // 2 + max_output
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """エラーレスポンスの Retry-After（retry-after-ms / retry-after）を秒で返す"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def classify_error(error: Exception) -> Optional[str]:
+    """再試行すべきエラーなら "429" / "5xx" / "timeout" を返す（クォータ不足などは None）"""
+    if isinstance(error, openai.RateLimitError):
+        # クォータ不足は待っても回復しないので再試行しない
+        return None if "insufficient_quota" in str(error) else "429"
+    if isinstance(error, openai.APIStatusError):
+        return "5xx" if error.status_code >= 500 else None
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return "timeout"
+    return None
+
+
+# track_throttles() の間だけ有効な 429 のカウンタ（copy_context で起動したスレッドとも共有する）
+_throttle_counter: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("llm_throttles", default=None)
+
+
+@contextmanager
+def track_throttles() -> Iterator[List[int]]:
+    """
+    このブロック内で受けた 429 の回数を数える（適応的な同時実行数制御が、処理ごとに混雑を受けたかを知るため）。
+    返したリストの [0] が回数。
+    """
+    counter = [0]
+    token = _throttle_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _throttle_counter.reset(token)
+
+
+class RateLimiter:
+    """RPM/TPM のトークンバケットとバックオフ方針（スレッドセーフ、プロセス内で共有する）"""
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            rpm: 1分あたりのリクエスト数の上限（None なら制限しない）
+            tpm: 1分あたりのトークン数の上限（None なら制限しない）
+            max_retries: 1回の呼び出しで再試行する最大回数
+            base_delay, max_delay: 指数バックオフの初期値と上限（秒）
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self._paused_until = 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "throttled": 0, "wait_s": 0.0, "retries": 0, "429": 0, "5xx": 0, "timeout": 0}
+
+    def acquire(self, request: Dict[str, Any]) -> int:
+        """予算が空くまで待ってから1リクエスト分を消費し、見積もったトークン数を返す"""
+        estimate = estimate_tokens(request)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self._requests.wait_time(1, now) if self._requests else 0.0,
+                    self._tokens.wait_time(estimate, now) if self._tokens else 0.0,
+                )
+                if wait <= 0:
+                    if self._requests:
+                        self._requests.take(1)
+                    if self._tokens:
+                        self._tokens.take(estimate)
+                    self._counters["calls"] += 1
+                    if waited:
+                        self._counters["throttled"] += 1
+                        self._counters["wait_s"] += waited
+                    return estimate
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, estimate: int, actual: Optional[int]) -> None:
+        """実際の使用トークン数で見積もりを精算する（失敗して使用量が分からない場合は actual=None で全額戻す）"""
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.give_back(estimate - (actual or 0))
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        attempt 回目（0始まり）の失敗後に待つ秒数。再試行しない場合は None。
+        Retry-After があればそれに従い、なければフルジッター付き指数バックオフ。
+        429 の場合は他のスレッドも同じ時刻まで新しい呼び出しを止める。
+        """
+        kind = classify_error(error)
+        counter = _throttle_counter.get()
+        if kind == "429" and counter is not None:
+            counter[0] += 1
+        if kind is None or attempt >= self.max_retries:
+            return None
+
+        retry_after = retry_after_seconds(error)
+        with self._lock:
+            if retry_after is not None:
+                delay = retry_after + self._random.uniform(0, min(1.0, retry_after * 0.1))
+            else:
+                delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            if kind == "429":
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._counters[kind] += 1
+            self._counters["retries"] += 1
+        return delay
+
+    def metrics(self) -> Dict[str, Any]:
+        """現在の上限・残量と、待機・再試行の累計"""
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self._requests, self._tokens):
+                if bucket:
+                    bucket._refill(now)
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "requests_available": round(self._requests.tokens, 1) if self._requests else None,
+                "tokens_available": round(self._tokens.tokens) if self._tokens else None,
+                "paused_s": round(max(0.0, self._paused_until - now), 2),
+                **{k: round(v, 2) if isinstance(v, float) else v for k, v in self._counters.items()},
+            }
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """プロセス共有のデフォルト制限器を返す（未設定なら上限なし・リトライのみ）"""
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+def set_rate_limiter(limiter: RateLimiter) -> None:
+    """デフォルト制限器を差し替える（RPM/TPM の設定用）"""
+    global _default_limiter
+    with _default_limiter_lock:
+        _default_limiter = limiter
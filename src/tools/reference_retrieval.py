@@ -0,0 +1,199 @@
+"""
+参考文献の関連箇所検索（ローカル、外部依存なし）。
+取得した文書をチャンクに分割し、タスクごとにメモリ上の BM25 インデックスを作って、
+指示文・必須物品に関連するチャンクを上位から token 予算内で選ぶ。
+
+    chunks = select_chunks({"1": text1, "2": text2}, query, budget_tokens=1500)
+    references_text = format_chunks(chunks, labels={"1": "Reference [1] (https://...)"})
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+DEFAULT_CHUNK_CHARS = 600
+DEFAULT_OVERLAP_CHARS = 100
+DEFAULT_BUDGET_TOKENS = 1500
+DEFAULT_TOP_K = 8
+
+# 英数字の語（小数・型番を含む）と、日本語（ひらがな・カタカナ・漢字）の連続
+_WORD = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+_CJK = re.compile(r"[぀-ヿ㐀-鿿豈-﫿々〆ー]+")
+# 文の区切り（日本語の句点と、英語の文末記号の後の空白）
+_SENTENCE_END = re.compile(r"(?<=[。！？])|(?<=[.!?])\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    英語は小文字化した語、日本語は文字 bigram に分割する（形態素解析器なしで日英混在の文書を扱うため）。
+    1文字だけの日本語の連続はそのまま1トークンにする。
+    """
+    text = text.lower()
+    tokens = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_text_tokens(text: str) -> int:
+    """プロンプトに入れたときのトークン数の見積もり（rate_limiter.estimate_tokens と同じく2文字≒1トークン）"""
+    return (len(text) + 1) // 2
+
+
+@dataclass
+class Chunk:
+    """文書の一部分"""
+
+    source: str  # 文書のID（参考文献ID）
+    index: int  # 文書内での通し番号（選んだチャンクを元の順に並べるため）
+    text: str  # このチャンクの本文（検索の対象）
+    context: str = ""  # 直前のチャンクの末尾（文脈としてプロンプトには入れるが、検索の対象にはしない）
+    score: float = 0.0
+
+    @property
+    def prompt_text(self) -> str:
+        return f"{self.context}\n{self.text}" if self.context else self.text
+
+
+def split_chunks(
+    text: str, chunk_chars: int = DEFAULT_CHUNK_CHARS, overlap_chars: int = DEFAULT_OVERLAP_CHARS
+) -> List[Tuple[str, str]]:
+    """
+    段落（空行区切り）を単位に chunk_chars 程度のチャンクにまとめ、(直前のチャンクの末尾, 本文) の組で返す。
+    長すぎる段落は文で、それでも長い文は文字数で分ける。
+    直前のチャンクの末尾 overlap_chars 文字は、境目で文脈が切れないようにプロンプトで前に付ける分。
+    """
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            sentence = sentence.strip()
+            for start in range(0, len(sentence), chunk_chars):
+                pieces.append(sentence[start : start + chunk_chars])
+
+    bodies: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > chunk_chars:
+            bodies.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        bodies.append(current)
+    return [(bodies[i - 1][-overlap_chars:] if i and overlap_chars else "", body) for i, body in enumerate(bodies)]
+
+
+def chunk_text(
+    text: str, chunk_chars: int = DEFAULT_CHUNK_CHARS, overlap_chars: int = DEFAULT_OVERLAP_CHARS
+) -> List[str]:
+    """split_chunks の結果を、直前のチャンクの末尾を重ねたテキストとして返す"""
+    return [
+        f"{context}\n{body}" if context else body for context, body in split_chunks(text, chunk_chars, overlap_chars)
+    ]
+
+
+class BM25Index:
+    """チャンク集合に対する Okapi BM25 のインデックス（1タスク分をメモリ上に作って捨てる）"""
+
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = sum(self._lengths) / len(chunks) if chunks else 0.0
+        doc_freq: Counter = Counter()
+        for tf in self._term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(chunks)
+        self._idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query: str) -> List[float]:
+        """各チャンクのクエリに対するスコア（チャンクの順）"""
+        terms = set(tokenize(query))
+        results = []
+        for tf, length in zip(self._term_freqs, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_length) if self._avg_length else self.k1
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+
+def select_chunks(
+    documents: Mapping[str, str],
+    query: str,
+    budget_tokens: int = DEFAULT_BUDGET_TOKENS,
+    top_k: int = DEFAULT_TOP_K,
+    chunk_chars: int = DEFAULT_CHUNK_CHARS,
+    overlap_chars: int = DEFAULT_OVERLAP_CHARS,
+) -> List[Chunk]:
+    """
+    全文書のチャンクから query に関連する上位 top_k 件を、合計 budget_tokens 以内で選ぶ。
+    予算に収まらないチャンクは飛ばして次の候補を見る。
+    query に一致するチャンクが1つもない場合は、各文書の先頭チャンクを予算内で返す。
+
+    Returns:
+        選んだチャンク（文書ID・文書内の順に並べ直したもの）
+    """
+    chunks = [
+        Chunk(source=source, index=i, text=body, context=context)
+        for source, document in documents.items()
+        for i, (context, body) in enumerate(split_chunks(document, chunk_chars, overlap_chars))
+    ]
+    if not chunks:
+        return []
+
+    for chunk, score in zip(chunks, BM25Index(chunks).scores(query)):
+        chunk.score = score
+    candidates = sorted((c for c in chunks if c.score > 0), key=lambda c: c.score, reverse=True)
+    if not candidates:
+        candidates = [c for c in chunks if c.index == 0]
+
+    selected: List[Chunk] = []
+    used = 0
+    for chunk in candidates:
+        if len(selected) >= top_k:
+            break
+        cost = estimate_text_tokens(chunk.prompt_text)
+        if used + cost > budget_tokens:
+            continue
+        selected.append(chunk)
+        used += cost
+
+    order = {source: n for n, source in enumerate(documents)}
+    return sorted(selected, key=lambda c: (order[c.source], c.index))
+
+
+def format_chunks(chunks: Iterable[Chunk], labels: Optional[Mapping[str, str]] = None) -> str:
+    """
+    選んだチャンクを文書ごとにまとめてプロンプト用のテキストにする（labels は文書ID → 見出し）。
+    連続するチャンクは重なりを除いてつなげ、離れたチャンクの間には "..." を入れる。
+    """
+    labels = labels or {}
+    sections: Dict[str, List[str]] = {}
+    previous: Dict[str, int] = {}
+    for chunk in chunks:
+        parts = sections.setdefault(chunk.source, [])
+        if previous.get(chunk.source) == chunk.index - 1:
+            parts.append(f"\n{chunk.text}")
+        else:
+            parts.append(f"\n...\n{chunk.prompt_text}" if parts else chunk.prompt_text)
+        previous[chunk.source] = chunk.index
+    return "\n\n".join(
+        f"{labels.get(source, f'Reference [{source}]')}:\n" + "".join(parts) for source, parts in sections.items()
+    )
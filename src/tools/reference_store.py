@@ -0,0 +1,100 @@
+"""
+参考文献ドキュメントの永続キャッシュ（URLをキーとする）。
+fetch_text はネットワークより先にここを参照し、TTL 内ならそのまま返す。
+TTL 切れの場合は ETag / Last-Modified で再検証し、offline モードではキャッシュ済みの文書のみを返す。
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_STORE_DIR = Path("workspace/reference_cache")
+DEFAULT_TTL = 30 * 24 * 3600  # 30日
+
+
+@dataclass
+class StoredReference:
+    """キャッシュされた参考文献1件"""
+
+    url: str
+    text: str
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class ReferenceStore:
+    """URL → 文書本文のディスクキャッシュ"""
+
+    def __init__(self, root: str | Path = DEFAULT_STORE_DIR, ttl: float = DEFAULT_TTL, offline: bool = False):
+        """
+        Args:
+            root: キャッシュディレクトリ
+            ttl: 再検証なしで使う期間（秒）
+            offline: True の場合ネットワークにアクセスせず、キャッシュ済みの文書のみを返す
+        """
+        self.root = Path(root)
+        self.ttl = ttl
+        self.offline = offline
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        return self.root / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, url: str) -> Optional[StoredReference]:
+        path = self._path(url)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return StoredReference(**data)
+
+    def is_fresh(self, entry: StoredReference) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def save(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        self._write(StoredReference(url=url, text=text, fetched_at=time.time(), etag=etag, last_modified=last_modified))
+
+    def touch(self, entry: StoredReference) -> None:
+        """再検証で変更なし（304）だった文書の取得時刻を更新する"""
+        entry.fetched_at = time.time()
+        self._write(entry)
+
+    def _write(self, entry: StoredReference) -> None:
+        # 一時ファイルに書いてから置き換える（並行タスクが読み途中のファイルを見ないように）
+        path = self._path(entry.url)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(asdict(entry), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+_default_store: Optional[ReferenceStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_reference_store() -> ReferenceStore:
+    """プロセス共有のデフォルトストアを返す"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ReferenceStore()
+        return _default_store
+
+
+def set_reference_store(store: ReferenceStore) -> None:
+    """デフォルトストアを差し替える（TTL・offline 設定の変更用）"""
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
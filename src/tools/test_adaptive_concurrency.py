@@ -0,0 +1,72 @@
+"""
+同時実行数の適応制御（adaptive_concurrency）のテスト
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.adaptive_concurrency import AdaptiveConcurrency, run_adaptive
+from tools.rate_limiter import RateLimiter
+from tools.test_rate_limiter import api_error
+
+
+def complete(controller, latency=0.1, **kwargs):
+    controller.release(controller.acquire(), latency=latency, **kwargs)
+
+
+def test_additive_increase_and_multiplicative_decrease():
+    """上限1回分の健全な完了ごとに+1、429 で半減。減少前に始まった処理の 429 では再度減らさない"""
+    controller = AdaptiveConcurrency(initial=4, max_limit=6, log=None)
+    for _ in range(4 + 5 + 6):
+        complete(controller)
+    assert controller.limit == 6  # 上限で止まる
+
+    in_flight = [controller.acquire() for _ in range(3)]
+    controller.release(in_flight[0], throttled=True)
+    assert controller.limit == 3
+    controller.release(in_flight[1], throttled=True)
+    assert controller.limit == 3  # 同じ混雑での2回目の 429
+    controller.release(in_flight[2])
+
+    complete(controller, throttled=True)
+    assert controller.limit == 1
+    assert [h["reason"] for h in controller.history][-2:] == ["throttled", "throttled"]
+    assert controller.metrics()["throttled"] == 3
+
+
+def test_latency_spike_decreases():
+    """平常時の latency_factor 倍を超えるレイテンシは 429 と同様に扱う（warmup 後のみ）"""
+    controller = AdaptiveConcurrency(initial=8, max_limit=8, warmup=3, log=None)
+    for _ in range(3):
+        complete(controller, latency=1.0)
+    complete(controller, latency=1.5)
+    assert controller.limit == 8
+    complete(controller, latency=5.0)
+    assert controller.limit == 4 and controller.metrics()["latency_spikes"] == 1
+
+
+def test_run_adaptive_respects_limit_and_order():
+    """結果は入力順で、同時実行数は上限を超えない。ワーカーが受けた 429 で上限が下がる"""
+    controller = AdaptiveConcurrency(initial=3, max_limit=3, log=None)
+    limiter = RateLimiter(max_retries=0)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def fn(i):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        if i == 5:
+            limiter.retry_delay(api_error(429), attempt=0)  # LLMClient が 429 を受けたときと同じ記録
+        with lock:
+            state["running"] -= 1
+        return i * 10
+
+    assert run_adaptive(list(range(12)), fn, controller) == [i * 10 for i in range(12)]
+    assert state["peak"] <= 3
+    assert controller.metrics()["throttled"] == 1 and controller.metrics()["decreases"] == 1
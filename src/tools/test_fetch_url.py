@@ -0,0 +1,165 @@
+"""
+fetch_url の並行取得テスト（ローカルのHTTPスタブサーバーに対して実行）
+"""
+
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.fetch_url import fetch_many, fetch_text
+from tools.reference_store import ReferenceStore
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /doc/<n> は gate がセットされるまで、/slow/<n> は release がセットされるまで待ってから本文を返す。
+    ETag による 304 応答に対応
+    """
+
+    protocol_version = "HTTP/1.1"
+    active = 0
+    max_active = 0
+    requests = 0
+    not_modified = 0
+    changed = threading.Condition()
+    gate = threading.Event()
+    release = threading.Event()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.changed:
+            cls.active += 1
+            cls.requests += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.changed.notify_all()
+        try:
+            (cls.release if self.path.startswith("/slow") else cls.gate).wait(timeout=10)
+            etag = f'"{self.path}"'
+            if self.headers.get("If-None-Match") == etag:
+                with cls.changed:
+                    cls.not_modified += 1
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = f"content of {self.path}".encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.changed:
+                cls.active -= 1
+                cls.changed.notify_all()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 打ち切られたリクエストの BrokenPipe などをテスト出力に出さない
+        pass
+
+
+def start_stub_server(gated=False):
+    StubHandler.active = 0
+    StubHandler.max_active = 0
+    StubHandler.requests = 0
+    StubHandler.not_modified = 0
+    StubHandler.gate = threading.Event()
+    StubHandler.release = threading.Event()
+    if not gated:
+        StubHandler.gate.set()
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def stop_stub_server(server):
+    StubHandler.gate.set()
+    StubHandler.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def open_gate_when_active(count):
+    """count 件のリクエストが同時に処理中になったら /doc の応答を始めさせる"""
+
+    def wait_and_open():
+        with StubHandler.changed:
+            StubHandler.changed.wait_for(lambda: StubHandler.active >= count, timeout=10)
+        StubHandler.gate.set()
+
+    threading.Thread(target=wait_and_open, daemon=True).start()
+
+
+def test_fetch_many_concurrent(tmp_path):
+    """複数URLを並行に取得し、ホストごとの同時接続数上限を守る"""
+    server, base = start_stub_server(gated=True)
+    try:
+        urls = [f"{base}/doc/{i}" for i in range(6)]
+        open_gate_when_active(3)
+        results = fetch_many(urls, per_host_limit=3, reader_prefix="", store=ReferenceStore(tmp_path))
+
+        assert set(results) == set(urls)
+        assert results[urls[0]] == "content of /doc/0"
+        # 3件が同時に処理中になるまで応答しないので、並行に取得していれば上限ちょうどに達する
+        assert StubHandler.max_active == 3
+    finally:
+        stop_stub_server(server)
+
+
+def test_fetch_many_deadline_returns_partial(tmp_path):
+    """制限時間を超えたら、取得済みの結果だけを返す"""
+    server, base = start_stub_server()
+    try:
+        fast = [f"{base}/doc/{i}" for i in range(2)]
+        slow = [f"{base}/slow/{i}" for i in range(2)]
+        # /slow は制限時間内には応答しない（テストの終了時に解放する）
+        results = fetch_many(fast + slow, deadline=1.0, reader_prefix="", store=ReferenceStore(tmp_path))
+
+        assert set(results) == set(fast)
+        assert results[fast[1]] == "content of /doc/1"
+    finally:
+        stop_stub_server(server)
+
+
+def test_reference_store_ttl_and_revalidation(tmp_path):
+    """TTL内はネットワークにアクセスせず、期限切れ後は ETag で再検証する"""
+    server, base = start_stub_server()
+    try:
+        url = f"{base}/doc/1"
+        store = ReferenceStore(tmp_path, ttl=3600)
+        assert fetch_text(url, reader_prefix="", store=store) == "content of /doc/1"
+        assert fetch_text(url, reader_prefix="", store=store) == "content of /doc/1"
+        assert StubHandler.requests == 1
+
+        expired = ReferenceStore(tmp_path, ttl=0)
+        assert fetch_text(url, reader_prefix="", store=expired) == "content of /doc/1"
+        assert StubHandler.requests == 2
+        assert StubHandler.not_modified == 1
+    finally:
+        stop_stub_server(server)
+
+
+def test_reference_store_offline(tmp_path):
+    """offline モードではキャッシュ済みの文書のみを返す"""
+    server, base = start_stub_server()
+    try:
+        cached_url, missing_url = f"{base}/doc/1", f"{base}/doc/2"
+        fetch_text(cached_url, reader_prefix="", store=ReferenceStore(tmp_path))
+
+        offline = ReferenceStore(tmp_path, ttl=0, offline=True)
+        assert fetch_text(cached_url, reader_prefix="", store=offline) == "content of /doc/1"
+        assert fetch_text(missing_url, reader_prefix="", store=offline).startswith("Error fetching")
+        assert StubHandler.requests == 1
+    finally:
+        stop_stub_server(server)
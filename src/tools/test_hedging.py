@@ -0,0 +1,78 @@
+"""
+ヘッジ付きLLM呼び出し（hedging）のテスト
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.hedging import HedgePolicy, phase_key
+from tools.llm_client import LLMClient
+from tools.llm_telemetry import LLMTelemetry, llm_context, load_events
+from tools.rate_limiter import RateLimiter
+
+
+def slow_first_client(delays):
+    """n 回目の呼び出しが delays[n] 秒かかり、何回目の呼び出しかを返すクライアント"""
+    lock = threading.Lock()
+    calls = []
+
+    def create(**kwargs):
+        with lock:
+            n = len(calls)
+            calls.append(n)
+        time.sleep(delays[n] if n < len(delays) else 0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"call {n}"))], usage=None)
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), calls
+
+
+def warmed_policy(**kwargs):
+    policy = HedgePolicy(percentile=50, min_samples=3, min_delay=0.01, **kwargs)
+    for _ in range(3):
+        policy.observe("3", 0.05)
+    return policy
+
+
+def test_hedge_wins_on_slow_primary(tmp_path):
+    """p50 を過ぎても返らない呼び出しにはヘッジを出し、先に返った方を採用する"""
+    policy = warmed_policy(max_extra_ratio=1.0)
+    telemetry = LLMTelemetry(tmp_path / "events.jsonl", run_id="run1")
+    client, calls = slow_first_client([1.0])
+    llm = LLMClient(client, telemetry=telemetry, limiter=RateLimiter(), hedge=policy)
+
+    started = time.perf_counter()
+    with llm_context(task_id="t1", phase="3"):
+        response = llm.chat(model="gpt-4o", messages=[])
+    assert response.text == "call 1"
+    assert time.perf_counter() - started < 0.5
+    assert len(calls) == 2
+
+    (event,) = load_events(tmp_path / "events.jsonl")
+    assert (event["task_id"], event["hedged"], event["hedge_won"]) == ("t1", True, True)
+    metrics = policy.metrics()
+    assert (metrics["hedges_fired"], metrics["hedges_won"], metrics["win_rate"]) == (1, 1, 1.0)
+    # ヘッジが勝っても、元のリクエストの開始からのレイテンシ（待ち時間 + ヘッジのレイテンシ）を記録する
+    assert policy._latencies["3"][-1] >= 0.05
+
+
+def test_no_hedge_without_samples_or_budget():
+    """観測が足りないフェーズや、追加リクエストの割合が上限に達した場合はヘッジしない"""
+    client, calls = slow_first_client([0.1, 0.1])
+    llm = LLMClient(client, limiter=RateLimiter(), hedge=warmed_policy(max_extra_ratio=0.0))
+    with llm_context(phase="1.1"):
+        llm.chat(model="gpt-4o", messages=[])
+    with llm_context(phase="3"):
+        llm.chat(model="gpt-4o", messages=[])
+
+    assert len(calls) == 2
+    assert llm.hedge.metrics()["skipped_budget"] == 1 and llm.hedge.metrics()["hedges_fired"] == 0
+
+
+def test_phase_key_groups_attempts():
+    assert phase_key("2-attempt-3") == phase_key("2-attempt-1") == "2"
+    assert phase_key(None) == "-"
@@ -0,0 +1,77 @@
+"""
+完了済みタスク結果のJSONLチェックポイント（jsonl_checkpoint）のテスト
+"""
+
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.jsonl_checkpoint import JsonlCheckpoint
+
+
+def _record(task_id, text="遠心する。"):
+    return {"id": task_id, "output": {"procedure_steps": [{"id": 1, "text": text}]}}
+
+
+def _error_record(task_id):
+    return _record(task_id, text="Error: request timed out")
+
+
+def test_append_then_completed_ids(tmp_path):
+    """追記したレコードが1行ずつ保存され、完了済みidとして読み戻せる"""
+    checkpoint = JsonlCheckpoint(tmp_path / "out" / "results.jsonl")
+    checkpoint.reset()
+    checkpoint.append(_record("a"))
+    checkpoint.append(_record(2))
+
+    lines = checkpoint.path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["a", 2]
+    assert checkpoint.completed_ids() == {"a", "2"}
+
+
+def test_error_records_are_not_completed(tmp_path):
+    """エラーで終わったレコードは --resume で再実行されるよう未完了として扱う"""
+    checkpoint = JsonlCheckpoint(tmp_path / "results.jsonl")
+    checkpoint.append(_record("ok"))
+    checkpoint.append(_error_record("failed"))
+    checkpoint.append({"id": "empty", "output": {"procedure_steps": []}})
+    assert checkpoint.completed_ids() == {"ok"}
+
+    # 再実行で成功した結果が後から追記されれば完了扱いになる
+    resumed = JsonlCheckpoint(checkpoint.path)
+    resumed.append(_record("failed"))
+    assert resumed.completed_ids() == {"ok", "failed"}
+
+
+def test_finalize_writes_input_order_and_drops_superseded_errors(tmp_path):
+    """finalize は入力順に並べ替え、同じidの古いエラーレコードを残さない"""
+    checkpoint = JsonlCheckpoint(tmp_path / "results.jsonl")
+    checkpoint.append(_record("c"))
+    checkpoint.append(_error_record("a"))
+    checkpoint.append(_record("b"))
+    checkpoint.append(_record("a", text="上清を捨てる。"))
+
+    checkpoint.finalize(["a", "b", "c", "missing"])
+
+    records = [json.loads(line) for line in checkpoint.path.read_text(encoding="utf-8").splitlines()]
+    assert [record["id"] for record in records] == ["a", "b", "c"]
+    assert records[0]["output"]["procedure_steps"][0]["text"] == "上清を捨てる。"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_truncated_last_line_is_tolerated(tmp_path):
+    """書き込み途中で中断された末尾行は無視し、次の追記と連結しない"""
+    path = tmp_path / "results.jsonl"
+    path.write_text(json.dumps(_record("a")) + "\n" + '{"id": "b", "output": {"procedure_st', encoding="utf-8")
+
+    checkpoint = JsonlCheckpoint(path)
+    assert checkpoint.completed_ids() == {"a"}
+
+    checkpoint.append(_record("b"))
+    assert checkpoint.completed_ids() == {"a", "b"}
+    assert path.read_text(encoding="utf-8").endswith("\n")
+
+    checkpoint.finalize(["a", "b"])
+    assert [json.loads(line)["id"] for line in path.read_text(encoding="utf-8").splitlines()] == ["a", "b"]
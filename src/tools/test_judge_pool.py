@@ -0,0 +1,158 @@
+"""
+並行採点・採点結果のキャッシュ・複数回採点（judge_pool）のテスト
+"""
+
+import math
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.adaptive_concurrency import AdaptiveConcurrency
+from tools.judge_pool import JudgePool, JudgeTask, VerdictCache, VotePolicy, run_votes, verdict_key
+from tools.llm_client import LLMClient
+from tools.rate_limiter import RateLimiter
+
+
+def fallback(sample_id, notes):
+    return {"id": sample_id, "total_score": 0.0, "notes": notes}
+
+
+def test_verdicts_are_cached_by_input_and_steps(tmp_path):
+    """生成手順が変わっていないサンプルは採点し直さず、変わったサンプルと失敗したサンプルだけを採点する"""
+    cache = VerdictCache(tmp_path / "verdicts.sqlite")
+    calls = []
+
+    def tasks(steps_by_id, fail=()):
+        def judge(sample_id, steps):
+            calls.append(sample_id)
+            if sample_id in fail:
+                raise RuntimeError("judge error")
+            return {"id": sample_id, "total_score": float(len(steps)), "notes": ""}
+
+        return [
+            JudgeTask(
+                sample_id,
+                verdict_key("judge-model", "v1", {"instruction": sample_id, "objects": {"b", "a"}}, steps),
+                lambda sample_id=sample_id, steps=steps: judge(sample_id, steps),
+            )
+            for sample_id, steps in steps_by_id.items()
+        ]
+
+    first = JudgePool(cache).run(tasks({"s1": ["x"], "s2": ["x", "y"], "s3": ["z"]}, fail={"s3"}), fallback)
+    assert [row["total_score"] for row in first] == [1.0, 2.0, 0.0] and first[2]["notes"] == "evaluation_failed"
+
+    calls.clear()
+    pool = JudgePool(cache)
+    second = pool.run(tasks({"s1": ["x"], "s2": ["x", "y", "w"], "s3": ["z"]}), fallback)
+    assert sorted(calls) == ["s2", "s3"]
+    assert [row["total_score"] for row in second] == [1.0, 3.0, 1.0]
+    assert pool.metrics() == {"judged": 2, "cached": 1, "failed": 0, "skipped": 0}
+    assert verdict_key("m", "v1", {"o": {"a", "b"}}, []) == verdict_key("m", "v1", {"o": {"b", "a"}}, [])
+    assert verdict_key("m", "v1", {}, []) != verdict_key("m", "v2", {}, [])
+
+
+def test_pool_bounds_concurrency_and_keeps_order():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def judge(n):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02 * (5 - n % 5))
+        with lock:
+            state["running"] -= 1
+        return {"id": str(n), "total_score": float(n)}
+
+    tasks = [JudgeTask(str(n), str(n), lambda n=n: judge(n)) for n in range(10)]
+    rows = JudgePool(max_workers=3).run(tasks, fallback)
+    assert [row["total_score"] for row in rows] == [float(n) for n in range(10)]
+    assert state["peak"] == 3
+
+
+def test_quota_exhaustion_cancels_waiting_and_unsent_judges():
+    """クォータ不足を検出したら、再試行待ちの採点を打ち切り、まだ送っていない採点はスキップする"""
+
+    def create(**kwargs):
+        error = openai.InternalServerError.__new__(openai.InternalServerError)
+        Exception.__init__(error, "server error")
+        error.status_code, error.response = 500, SimpleNamespace(headers={})
+        raise error
+
+    llm = LLMClient(
+        SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))),
+        limiter=RateLimiter(base_delay=10, seed=0),
+    )
+    retrying = threading.Event()
+
+    def waiting_judge():
+        retrying.set()
+        return llm.chat(model="judge", messages=[])  # 再試行のバックオフで待ち続ける
+
+    def quota_judge():
+        retrying.wait(1)
+        raise RuntimeError("Error code: 429 - insufficient_quota")
+
+    tasks = [JudgeTask("wait", "k1", waiting_judge), JudgeTask("quota", "k2", quota_judge)]
+    tasks += [JudgeTask(f"later{n}", f"k{n + 3}", lambda: {"id": "x"}) for n in range(3)]
+    pool = JudgePool(max_workers=2)
+    started = time.perf_counter()
+    rows = pool.run(tasks, fallback)
+
+    assert time.perf_counter() - started < 5
+    assert [row["notes"] for row in rows] == ["skipped_due_to_quota", "evaluation_failed"] + [
+        "skipped_due_to_quota"
+    ] * 3
+    assert pool.metrics() == {"judged": 0, "cached": 0, "failed": 1, "skipped": 4}
+
+
+def test_votes_stop_when_confidence_interval_is_narrow():
+    """票を batch_size ずつ並行に集め、信頼区間の幅が閾値以下になった時点で打ち切って平均する"""
+    scores = {0: 6.0, 1: 6.0, 2: 6.0, 3: 2.0, 4: 9.0, 5: 5.0}
+
+    def vote(i, table):
+        return {"id": "s1", "general_score": 3.0, "total_score": table[i], "notes": f"vote {i}"}
+
+    agreed = run_votes(lambda i: vote(i, scores), VotePolicy(max_votes=6, batch_size=3, ci_width=1.0))
+    assert (agreed["votes"], agreed["total_score"], agreed["score_variance"]) == (3, 6.0, 0.0)
+    assert agreed["notes"] == "vote 0" and agreed["id"] == "s1"
+
+    noisy = {0: 6.0, 1: 2.0, 2: 9.0, 3: 5.0, 4: 6.0, 5: 5.0}
+    split = run_votes(lambda i: vote(i, noisy), VotePolicy(max_votes=5, batch_size=2, ci_width=1.0))
+    assert split["votes"] == 5 and split["total_score"] == pytest.approx(5.6)
+    assert split["score_variance"] == pytest.approx(6.3)
+
+    single = run_votes(lambda i: vote(i, scores), VotePolicy())
+    assert single["votes"] == 1 and math.isnan(single["score_variance"])
+    assert VotePolicy().tag() == "" and VotePolicy(max_votes=6).tag() != VotePolicy(max_votes=9).tag()
+
+
+@pytest.mark.parametrize("use_controller", [False, True])
+def test_votes_share_the_pool_limit(use_controller):
+    """複数回採点の票は全サンプル合わせて max_workers（controller の上限）までしか同時に送らない"""
+    lock = threading.Lock()
+    in_flight = [0, 0]  # 現在の数, 最大値
+
+    def vote(i):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return {"id": "x", "total_score": float(i % 3)}
+
+    controller = AdaptiveConcurrency(initial=2, max_limit=2, log=None) if use_controller else None
+    pool = JudgePool(max_workers=2, controller=controller, votes=VotePolicy(max_votes=4, batch_size=3, ci_width=0.0))
+    tasks = [JudgeTask(f"s{n}", f"k{n}", lambda: pool.vote(vote)) for n in range(4)]
+    rows = pool.run(tasks, fallback)
+
+    assert [row["votes"] for row in rows] == [4] * 4
+    assert in_flight[1] == 2
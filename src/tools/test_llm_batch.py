@@ -0,0 +1,116 @@
+"""
+Batch API レイヤー（llm_batch）のテスト（ファイルベースのローカル代替とモックサーバーを使う）
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from openai import OpenAI
+from pydantic import BaseModel
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.llm_batch import BatchBackend, BatchItem, LocalBatchBackend, client_handler, run_batch, to_batch_body
+from tools.llm_cache import LLMCache
+from tools.llm_telemetry import LLMTelemetry, load_events
+from tools.mock_openai_server import MockOpenAIServer
+
+
+def echo_handler(url, body):
+    """ユーザーメッセージをそのまま返す。"fail" を含むリクエストは失敗させる"""
+    content = body["messages"][-1]["content"]
+    if "fail" in content:
+        raise RuntimeError("server error")
+    return {
+        "choices": [{"message": {"role": "assistant", "content": json.dumps({"echo": content})}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+    }
+
+
+def chat_item(custom_id, content):
+    request = dict(
+        model="gpt-4o", messages=[{"role": "user", "content": content}], response_format={"type": "json_object"}
+    )
+    return BatchItem(custom_id, "chat.completions.create", request, phase="judge")
+
+
+def test_results_mapped_by_custom_id(tmp_path):
+    """結果は custom_id で対応付けられ、失敗したリクエストだけが error になる。バッチは max_requests 件ごとに分かれる"""
+    backend = LocalBatchBackend(tmp_path / "batches", echo_handler)
+    telemetry = LLMTelemetry(tmp_path / "events.jsonl", run_id="run1")
+    items = [chat_item(f"s{i}", f"q{i}") for i in range(5)] + [chat_item("bad", "fail")]
+
+    results = run_batch(items, backend, tmp_path / "work", telemetry=telemetry, poll_interval=0, max_requests=4)
+
+    assert len(list((tmp_path / "batches").iterdir())) == 2
+    assert json.loads(results["s3"].text) == {"echo": "q3"}
+    assert not results["bad"].ok and "server error" in results["bad"].error
+    events = {e["task_id"]: e for e in load_events(tmp_path / "events.jsonl")}
+    assert events["s0"]["phase"] == "judge" and events["s0"]["prompt_tokens"] == 10
+    assert events["bad"]["error"]
+
+
+def test_cached_requests_are_not_submitted(tmp_path):
+    """2回目はキャッシュから返し、未完了のものだけを投入する"""
+    backend = LocalBatchBackend(tmp_path / "batches", echo_handler)
+    cache = LLMCache(tmp_path / "cache.sqlite")
+    run_batch([chat_item("a", "qa")], backend, tmp_path / "work", cache=cache, poll_interval=0)
+
+    results = run_batch(
+        [chat_item("a", "qa"), chat_item("b", "qb")], backend, tmp_path / "work", cache=cache, poll_interval=0
+    )
+
+    assert results["a"].from_cache and not results["b"].from_cache
+    submitted = [json.loads(p.read_text())["custom_id"] for p in (tmp_path / "batches").glob("*/input.jsonl")]
+    assert sorted(submitted) == ["a", "b"]
+
+
+def test_truncated_json_is_not_cached(tmp_path):
+    """構造化出力が途中で切れた結果はキャッシュせず、次回も投入し直す"""
+
+    def truncated_handler(url, body):
+        return {"choices": [{"message": {"role": "assistant", "content": '{"echo": "q'}}]}
+
+    cache = LLMCache(tmp_path / "cache.sqlite")
+    truncated = LocalBatchBackend(tmp_path / "b1", truncated_handler)
+    first = run_batch([chat_item("a", "qa")], truncated, tmp_path / "work", cache=cache, poll_interval=0)
+    echo = LocalBatchBackend(tmp_path / "b2", echo_handler)
+    second = run_batch([chat_item("a", "qa")], echo, tmp_path / "work", cache=cache, poll_interval=0)
+
+    assert first["a"].text == '{"echo": "q' and not second["a"].from_cache
+    assert json.loads(second["a"].text) == {"echo": "qa"}
+
+
+def test_backend_must_implement_interface():
+    """submit・status・results のどれかを実装していないバックエンドは作れない"""
+
+    class SubmitOnly(BatchBackend):
+        def submit(self, input_path, url):
+            return "batch"
+
+    with pytest.raises(TypeError):
+        SubmitOnly()
+
+
+class JudgeOutput(BaseModel):
+    final_score: float
+
+
+def test_pydantic_response_format_through_mock_server(tmp_path):
+    """pydantic の response_format はJSONスキーマに変換され、モックサーバー経由で採点結果が返る"""
+    body = to_batch_body("chat.completions.parse", {"response_format": JudgeOutput})
+    assert body["response_format"]["json_schema"]["name"] == "JudgeOutput"
+
+    with MockOpenAIServer() as server:
+        client = OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+        backend = LocalBatchBackend(tmp_path / "batches", client_handler(client))
+        item = BatchItem(
+            "s1",
+            "chat.completions.parse",
+            dict(model="gpt-4.1-mini", messages=[{"role": "user", "content": "x"}], response_format=JudgeOutput),
+        )
+        results = run_batch([item], backend, tmp_path / "work", poll_interval=0)
+
+    assert JudgeOutput.model_validate_json(results["s1"].text).final_score >= 0
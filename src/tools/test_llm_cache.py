@@ -0,0 +1,80 @@
+"""
+LLMCache / LLMClient のテスト
+"""
+
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.llm_cache import LLMCache
+from tools.llm_client import LLMClient
+
+
+class FakeCompletions:
+    """chat.completions 互換のスタブ（呼び出し回数を数える）"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        content = '{"answer": "%s"}' % kwargs["messages"][-1]["content"]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_client(cache):
+    completions = FakeCompletions()
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return LLMClient(fake, cache=cache), completions
+
+
+def test_cache_hit_and_bypass(tmp_path):
+    """同一リクエストは2回目以降キャッシュから返し、bypass時は再度APIを呼ぶ"""
+    cache = LLMCache(tmp_path / "cache.sqlite")
+    llm, completions = make_client(cache)
+    request = dict(model="m", messages=[{"role": "user", "content": "q"}], temperature=0.2)
+
+    first = llm.chat(**request, response_format={"type": "json_object"})
+    second = llm.chat(**request, response_format={"type": "json_object"})
+    assert completions.calls == 1
+    assert second.from_cache and second.text == first.text
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    # temperature が違えば別キー
+    llm.chat(**{**request, "temperature": 0.7})
+    assert completions.calls == 2
+
+    bypass_llm, bypass_completions = make_client(LLMCache(tmp_path / "cache.sqlite", bypass=True))
+    bypass_llm.chat(**request, response_format={"type": "json_object"})
+    assert bypass_completions.calls == 1
+
+
+def test_lru_eviction(tmp_path):
+    """サイズ上限を超えると最終アクセスが古いエントリから削除される"""
+    cache = LLMCache(tmp_path / "cache.sqlite", max_bytes=250)
+    for i in range(3):
+        cache.put(f"k{i}", "x" * 100)
+    assert cache.get("k0") is None
+    assert cache.get("k2") is not None
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_concurrent_writers(tmp_path):
+    """複数スレッドから同時に書き込んでもエントリが失われない"""
+    cache = LLMCache(tmp_path / "cache.sqlite")
+
+    def writer(n):
+        for i in range(20):
+            cache.put(f"{n}-{i}", f"value-{n}-{i}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert cache.stats()["entries"] == 160
+    assert cache.get("7-19") == "value-7-19"
@@ -0,0 +1,93 @@
+"""
+LLM呼び出し計測（llm_telemetry）のテスト
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.llm_cache import LLMCache
+from tools.llm_client import LLMClient
+from tools.llm_telemetry import LLMTelemetry, llm_context, load_events, normalize_usage, percentile, summarize
+
+
+def chat_response(content):
+    usage = SimpleNamespace(
+        prompt_tokens=120,
+        completion_tokens=30,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=100),
+        completion_tokens_details=SimpleNamespace(reasoning_tokens=0),
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+def test_normalize_usage_chat_and_responses():
+    """chat.completions と responses の usage を同じ形に揃える"""
+    chat = normalize_usage(chat_response("x"))
+    assert (chat.prompt_tokens, chat.completion_tokens, chat.cached_tokens) == (120, 30, 100)
+
+    responses = normalize_usage(
+        {
+            "usage": {
+                "input_tokens": 50,
+                "output_tokens": 400,
+                "input_tokens_details": {"cached_tokens": 0},
+                "output_tokens_details": {"reasoning_tokens": 320},
+            }
+        }
+    )
+    assert (responses.prompt_tokens, responses.completion_tokens, responses.reasoning_tokens) == (50, 400, 320)
+    assert normalize_usage(None).prompt_tokens == 0
+
+
+def test_client_records_events_with_context(tmp_path):
+    """呼び出しごとにタスクID・フェーズ・トークン数付きのイベントが記録される（キャッシュヒット・失敗も含む）"""
+    telemetry = LLMTelemetry(tmp_path / "events.jsonl", run_id="run1")
+    fail = {"next": False}
+
+    def create(**kwargs):
+        if fail["next"]:
+            raise RuntimeError("rate limited")
+        return chat_response('{"ok": true}')
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    llm = LLMClient(fake, cache=LLMCache(tmp_path / "cache.sqlite"), telemetry=telemetry)
+    request = dict(model="gpt-4o", messages=[{"role": "user", "content": "q"}], response_format={"type": "json_object"})
+
+    with llm_context(task_id="task-1", phase="1.1"):
+        llm.chat(**request)
+        with llm_context(phase="1.2"):
+            llm.chat(**request)  # キャッシュヒット
+        fail["next"] = True
+        with pytest.raises(RuntimeError):
+            llm.chat(**{**request, "temperature": 0.5})
+    llm.chat(**request)  # コンテキスト外
+
+    events = load_events(tmp_path / "events.jsonl", "latest")
+    assert [(e["task_id"], e["phase"], e["from_cache"]) for e in events] == [
+        ("task-1", "1.1", False),
+        ("task-1", "1.2", True),
+        ("task-1", "1.1", False),
+        (None, None, True),
+    ]
+    assert events[0]["model"] == "gpt-4o" and events[0]["prompt_tokens"] == 120 and events[0]["cached_tokens"] == 100
+    assert events[2]["error"].startswith("RuntimeError")
+
+
+def test_summary_percentiles():
+    """フェーズごとの p50/p95 はキャッシュヒットを除いて計算する"""
+    events = [
+        {"phase": "3", "latency_s": float(i), "from_cache": False, "prompt_tokens": 10, "cached_tokens": 5 * (i % 2)}
+        for i in range(1, 21)
+    ]
+    events.append({"phase": "3", "latency_s": 0.0, "from_cache": True})
+    (row,) = summarize(events, "phase")
+
+    assert row["calls"] == 21 and row["cache_hits"] == 1
+    assert (row["p50_s"], row["p95_s"]) == (10.0, 19.0)
+    assert row["prompt_tokens"] == 200 and row["prefix_cache_rate"] == 0.25
+    assert percentile([], 50) == 0.0
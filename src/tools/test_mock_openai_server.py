@@ -0,0 +1,71 @@
+"""
+モックOpenAIサーバーのテスト（実際の openai クライアントから呼び出す）
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from openai import OpenAI, RateLimitError
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from agents.dag_validator import DAGValidator
+from agents.prompts import PHASE2_OP_DEF_PROMPT
+from tools.mock_openai_server import PHASE1_OBJECTS, LatencyModel, MockConfig, MockOpenAIServer
+
+
+def test_phase_payloads_are_schema_valid():
+    """フェーズ2の固定計画はフェーズ1の固定オブジェクトに対して検証に通り、responses も同じ形で返る"""
+    with MockOpenAIServer() as server:
+        client = OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+        prompt = PHASE2_OP_DEF_PROMPT.format(instruction="x", identified_objects="{}", source_protocol="[]")
+        completion = client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": prompt}], response_format={"type": "json_object"}
+        )
+        plan = json.loads(completion.choices[0].message.content)
+        assert completion.usage.prompt_tokens > 0
+
+        response = client.responses.create(
+            model="gpt-5.1",
+            input=[{"role": "user", "content": "x"}],
+            text={"format": {"type": "json_schema", "name": "generated_output", "schema": {}, "strict": True}},
+        )
+        assert json.loads(response.output_text)["procedure_steps"]
+        assert server.counts == {"phase2": 1, "generate": 1}
+
+    validator = DAGValidator()
+    validator.load_from_phases(PHASE1_OBJECTS, plan)
+    assert validator.validate().valid
+
+
+def test_rate_limit_injection():
+    """429 は Retry-After 付きで返り、クライアントには RateLimitError として見える"""
+    with MockOpenAIServer(MockConfig(rate_429=1.0, retry_after=2)) as server:
+        client = OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+        with pytest.raises(RateLimitError) as excinfo:
+            client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "x"}])
+        assert excinfo.value.response.headers["Retry-After"] == "2"
+
+
+def test_prefix_cache_reports_cached_tokens():
+    """1024 tokens 以上の一致した先頭部分は 128 tokens 単位で cached_tokens として返る"""
+    static = "固定の指示。" * 600  # 3600文字 ≒ 1200 tokens
+    with MockOpenAIServer() as server:
+        client = OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+
+        def cached_tokens(prompt):
+            completion = client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": prompt}])
+            return completion.usage.prompt_tokens_details.cached_tokens
+
+        assert cached_tokens(static + "タスク1") == 0
+        assert cached_tokens(static + "タスク2") == 1152
+        assert cached_tokens("タスク3" + static) == 0
+
+
+def test_latency_model_parse():
+    assert LatencyModel.parse("fixed:0.5").params == (0.5,)
+    assert LatencyModel.parse("lognormal:1.0:0.5").kind == "lognormal"
+    with pytest.raises(ValueError):
+        LatencyModel.parse("gamma:1")
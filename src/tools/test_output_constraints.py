@@ -0,0 +1,67 @@
+"""
+手順書の出力制約の検査・修正（output_constraints）のテスト
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.output_constraints import check_steps, count_sentences, fix_steps, split_sentences
+
+
+def test_split_sentences_mixed_languages():
+    """句点・ピリオドで区切り、小数・略語・番号付け・引用の中の句点では区切らない"""
+    assert split_sentences("1.5 mLチューブに 2.5 mL 加える。撹拌する（5秒）！次へ") == [
+        "1.5 mLチューブに 2.5 mL 加える。",
+        "撹拌する（5秒）！",
+        "次へ",
+    ]
+    assert split_sentences("1. Add buffer, e.g. Tris-HCl. Incubate approx. 5 min. Done?") == [
+        "1. Add buffer, e.g. Tris-HCl.",
+        "Incubate approx. 5 min.",
+        "Done?",
+    ]
+    assert split_sentences("「完了。」と記録する。objects/initial/buffer.reagent を使う．2．5 mL") == [
+        "「完了。」と記録する。",
+        "objects/initial/buffer.reagent を使う．",
+        "2．5 mL",
+    ]
+    assert count_sentences("遠心する\n上清を捨てる") == 2
+
+
+def test_fix_splits_long_steps_and_renumbers():
+    """10文を超えるステップは均等に分割し、元のID順に並べて1からの連番に振り直す"""
+    long_text = "".join(f"操作{i}を行う。" for i in range(1, 13))
+    result = fix_steps([{"id": 7, "text": "最後に記録する。"}, {"id": 3, "text": long_text}, {"id": 5, "text": " "}])
+
+    assert result.ok and not check_steps(result.steps)
+    assert [count_sentences(step["text"]) for step in result.steps] == [6, 6, 1]
+    assert [step["id"] for step in result.steps] == [1, 2, 3]
+    assert result.steps[0]["text"].startswith("操作1を行う。") and result.steps[2]["text"] == "最後に記録する。"
+    assert len(result.fixes) == 2
+
+
+def test_fix_merges_and_compacts_overflowing_steps():
+    """50ステップを超える分は隣接ステップをまとめ、10文に収まらなければ文をつないで詰める"""
+    short = [{"id": i, "text": f"Step {i}."} for i in range(1, 61)]
+    merged = fix_steps(short)
+    assert merged.ok and len(merged.steps) == 50
+    assert merged.steps[0]["text"] == "Step 1. Step 2."
+
+    dense = [{"id": i, "text": "試薬を加える。混ぜる。待つ。測る。記録する。片付ける。"} for i in range(1, 56)]
+    compacted = fix_steps(dense)
+    assert compacted.ok and len(compacted.steps) == 50 and not check_steps(compacted.steps)
+    assert compacted.steps[0]["text"].startswith("試薬を加える。混ぜる。待つ、測る。")
+
+    assert not fix_steps([]).ok and not fix_steps({"steps": []}).ok
+    assert [v.type for v in fix_steps([{"id": 1, "text": ""}]).violations] == ["EMPTY_OUTPUT"]
+
+
+def test_fixed_steps_pass_the_check():
+    """番号付きのステップをまとめても、番号を文の区切りとして数えず、修正結果が検査に通る"""
+    steps = [{"id": i, "text": f"{i}. Add 1 mL buffer. Mix. Spin. Wait 5 min. Read."} for i in range(1, 61)]
+    result = fix_steps(steps)
+    assert result.ok and len(result.steps) == 50 and not check_steps(result.steps)
+    assert count_sentences(result.steps[0]["text"]) == 10
+    assert split_sentences("Mix. 2. Add buffer. Spin at 3. Done") == ["Mix.", "2. Add buffer.", "Spin at 3.", "Done"]
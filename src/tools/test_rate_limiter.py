@@ -0,0 +1,112 @@
+"""
+レート制限・リトライ（rate_limiter）のテスト
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.llm_client import LLMCallCancelled, LLMClient, llm_cancel_scope
+from tools.llm_telemetry import LLMTelemetry, load_events
+from tools.rate_limiter import RateLimiter, TokenBucket, classify_error, estimate_tokens
+
+
+def api_error(status, message="error", headers=None):
+    """SDK の例外クラスのインスタンス（HTTP レスポンスはヘッダーだけを持つ代用品）"""
+    classes = {429: openai.RateLimitError, 500: openai.InternalServerError, 400: openai.BadRequestError}
+    cls = classes.get(status, openai.APITimeoutError)
+    error = cls.__new__(cls)
+    Exception.__init__(error, message)
+    error.status_code = status
+    error.response = SimpleNamespace(headers=headers or {})
+    return error
+
+
+def chat_response():
+    usage = SimpleNamespace(
+        prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None, completion_tokens_details=None
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))], usage=usage)
+
+
+def fake_client(errors):
+    """errors を順に送出し、尽きたら正常なレスポンスを返すクライアント"""
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        if errors:
+            raise errors.pop(0)
+        return chat_response()
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), calls
+
+
+def test_token_bucket_refill():
+    """容量は1分分で、消費後は rate/60 の速度で補充される"""
+    bucket = TokenBucket(60)
+    bucket.updated = 0.0
+    assert bucket.wait_time(60, now=0.0) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now=0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now=0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1000, now=60.0) == 0.0  # 容量を超える要求は満タンなら通す
+
+
+def test_retry_after_and_metrics(tmp_path):
+    """429 は Retry-After に従って再試行し、再試行回数が計測イベントと指標に残る"""
+    limiter = RateLimiter(rpm=1000, tpm=100_000, seed=0)
+    telemetry = LLMTelemetry(tmp_path / "events.jsonl", run_id="run1")
+    client, calls = fake_client([api_error(429, headers={"retry-after-ms": "20"}), api_error(500)])
+    llm = LLMClient(client, telemetry=telemetry, limiter=limiter)
+    limiter.base_delay = 0.01
+
+    assert llm.chat(model="gpt-4o", messages=[{"role": "user", "content": "q"}]).text == "ok"
+
+    assert len(calls) == 3
+    (event,) = load_events(tmp_path / "events.jsonl")
+    assert event["retries"] == 2 and event["error"] is None
+    metrics = limiter.metrics()
+    assert (metrics["calls"], metrics["retries"], metrics["429"], metrics["5xx"]) == (3, 2, 1, 1)
+    assert metrics["tokens_available"] < 100_000 and metrics["rpm_limit"] == 1000
+
+
+def test_non_retryable_errors():
+    """クォータ不足や 400 は再試行せずにそのまま送出する"""
+    limiter = RateLimiter(seed=0)
+    client, calls = fake_client([api_error(429, message="insufficient_quota")])
+    with pytest.raises(openai.RateLimitError):
+        LLMClient(client, limiter=limiter).chat(model="gpt-4o", messages=[])
+    assert len(calls) == 1
+    assert classify_error(api_error(400)) is None
+    assert classify_error(api_error(0)) == "timeout"
+
+    client, calls = fake_client([api_error(500)] * 5)
+    with pytest.raises(openai.InternalServerError):
+        LLMClient(client, limiter=RateLimiter(max_retries=2, base_delay=0.001)).chat(model="gpt-4o", messages=[])
+    assert len(calls) == 3
+
+
+def test_cancel_scope_stops_retries():
+    """llm_cancel_scope のイベントがセットされると、バックオフ中でも再試行をやめて LLMCallCancelled を送出する"""
+    client, calls = fake_client([api_error(500)] * 5)
+    llm = LLMClient(client, limiter=RateLimiter(base_delay=10, seed=0))
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+
+    started = time.perf_counter()
+    with llm_cancel_scope(cancel), pytest.raises(LLMCallCancelled):
+        llm.chat(model="gpt-4o", messages=[])
+    assert time.perf_counter() - started < 5 and len(calls) == 1
+
+
+def test_estimate_tokens_counts_requested_output():
+    assert estimate_tokens({"messages": "x" * 100, "max_tokens": 50}) == 100
+    assert estimate_tokens({"input": "", "max_output_tokens": 16}) == 16
@@ -0,0 +1,55 @@
+"""
+参考文献の関連箇所検索（reference_retrieval）のテスト
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from tools.reference_retrieval import chunk_text, estimate_text_tokens, format_chunks, select_chunks, tokenize
+
+
+def test_tokenize_mixed_languages():
+    """英語は語、日本語は文字 bigram に分ける"""
+    assert tokenize("Tensile test 500 mm/min 引張試験") == [
+        "tensile",
+        "test",
+        "500",
+        "mm",
+        "min",
+        "引張",
+        "張試",
+        "試験",
+    ]
+    assert tokenize("JIS K 6251 表") == ["jis", "k", "6251", "表"]
+
+
+def test_chunk_text_respects_size_and_overlap():
+    """段落をまとめてチャンクにし、長い段落は文で分け、直前のチャンクの末尾を重ねる"""
+    text = "\n\n".join(["段落A。" * 10, "段落B。" * 10, "x" * 250])
+    chunks = chunk_text(text, chunk_chars=120, overlap_chars=10)
+    assert all(len(chunk) <= 120 + 10 + 1 for chunk in chunks)
+    assert chunks[0].startswith("段落A") and chunks[1].startswith(chunks[0][-10:])
+    assert "".join(chunks).count("x") >= 250
+
+
+def test_select_chunks_prefers_relevant_within_budget():
+    """クエリに関連するチャンクを予算内で選び、元の順に並べる。一致がなければ先頭チャンク"""
+    filler = "\n\n".join(f"この章は適用範囲と用語の定義について述べる。番号{i}。" * 5 for i in range(20))
+    documents = {
+        "1": filler + "\n\n引張試験機のつかみ具に試験片を取り付け、500 mm/min で引っ張る。\n\n" + filler,
+        "2": "Dumbbell test pieces shall be conditioned at 23 °C and 50 % RH.\n\n" + filler,
+    }
+    query = "引張試験機で試験片を引っ張る\ndumbbell test pieces"
+    chunks = select_chunks(documents, query, budget_tokens=300, top_k=2, chunk_chars=200)
+
+    assert [chunk.source for chunk in chunks] == ["1", "2"]
+    assert "500 mm/min" in chunks[0].text and "Dumbbell" in chunks[1].text
+    assert sum(estimate_text_tokens(chunk.prompt_text) for chunk in chunks) <= 300
+
+    fallback = select_chunks(documents, "unrelated query", budget_tokens=10_000)
+    assert [(chunk.source, chunk.index) for chunk in fallback] == [("1", 0), ("2", 0)]
+
+    text = format_chunks(chunks, labels={"1": "Reference [1] (https://example.com)"})
+    assert text.startswith("Reference [1] (https://example.com):\n") and "\n\nReference [2]:\n" in text